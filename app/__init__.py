@@ -1,16 +1,25 @@
 from flask import Flask
 import os
-from .config import Config
+import logging
+from .config import Config, DEFAULT_SECRET_KEY
+
+logger = logging.getLogger(__name__)
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if app.config['SECRET_KEY'] == DEFAULT_SECRET_KEY:
+        logger.warning("SECRET_KEY non impostata: /chat non emette ID di sessione e risponde senza cronologia")
     
     # Crea la directory di upload se non esiste
     os.makedirs(os.path.join(os.path.dirname(os.path.abspath(__file__)), app.config['UPLOAD_FOLDER']), exist_ok=True)
     
     # Registra i blueprint
-    from app.routes import main_bp
+    from app.routes import main_bp, chatbot_loader
     app.register_blueprint(main_bp)
     
+    # Il chatbot viene costruito in background: l'app risponde subito e /api/ready ne segue l'avanzamento
+    if app.config['CHATBOT_WARMUP_ON_START']:
+        chatbot_loader.start()
+    
     return app
@@ -7,9 +7,12 @@ from dotenv import load_dotenv
 # Carica le variabili d'ambiente
 load_dotenv()
 
+# Chiave predefinita, pubblica: con questa i token firmati (es. gli ID di sessione di /chat) non sono affidabili
+DEFAULT_SECRET_KEY = 'chiave-segreta-predefinita'
+
 class Config:
     """Configurazione base dell'applicazione"""
-    SECRET_KEY = os.getenv('SECRET_KEY', 'chiave-segreta-predefinita')
+    SECRET_KEY = os.getenv('SECRET_KEY', DEFAULT_SECRET_KEY)
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 MB
     
@@ -18,6 +21,11 @@ class Config:
     BEDROCK_MODEL_ID = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
     BEDROCK_EMBEDDING_MODEL_ID = os.getenv('BEDROCK_EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v1')
     
+    # Token richiesto dagli endpoint di amministrazione (header X-Admin-Token); se vuoto sono disattivati
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+    
     # Configurazione del chatbot
     CHATBOT_ENABLED = True
     CHATBOT_FALLBACK_ENABLED = True
+    # Avvia la costruzione del chatbot (RAG, embedding, agenti) in background all'avvio; se False al primo utilizzo
+    CHATBOT_WARMUP_ON_START = os.getenv('CHATBOT_WARMUP_ON_START', 'true').lower() == 'true'
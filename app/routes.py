@@ -1,11 +1,20 @@
-from flask import Blueprint, render_template, request, jsonify, current_app, send_from_directory
+from flask import Blueprint, render_template, request, jsonify, current_app, send_from_directory, url_for, Response, stream_with_context, session
 import os
+import hmac
+import json
+import math
+import queue
 import uuid
 import logging
+from itsdangerous import BadSignature, URLSafeSerializer
 from werkzeug.utils import secure_filename
 from app.services.document_processor import process_document
-from app.services.strands_agent import analyze_bill, compare_with_previous, chat_with_assistant
+from app.services.strands_agent import analyze_bill, compare_with_previous, chat_with_assistant, agent_stats
 from app.services.chatbot import EnergyWiseChatbot
+from app.services.job_queue import BillJobQueue
+from app.services.cache import get_analysis_cache
+from app.services.warmup import BackgroundInitializer
+from app.config import DEFAULT_SECRET_KEY
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,14 +22,139 @@ logger = logging.getLogger(__name__)
 
 main_bp = Blueprint('main', __name__)
 
-# Inizializzazione del chatbot
-chatbot = EnergyWiseChatbot()
+# Inizializzazione del chatbot in background (avviata da create_app o alla prima richiesta)
+chatbot_loader = BackgroundInitializer(lambda progress: EnergyWiseChatbot(progress=progress), 'chatbot')
+
+# Coda dei job di analisi in background
+job_queue = BillJobQueue(process_document, analyze_bill)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
+# Intervallo dei commenti keep-alive dello stream SSE, per non far chiudere le connessioni inattive
+SSE_KEEPALIVE_SECONDS = 15
+
+# Secondi suggeriti ai client (header Retry-After) mentre il chatbot è in inizializzazione
+WARMUP_RETRY_AFTER = 5
+
+WARMUP_MESSAGE = "Sto ancora preparando la knowledge base di EnergyWise: riprova tra qualche secondo."
+
+WARMUP_FAILED_MESSAGE = "L'assistente di EnergyWise non è al momento disponibile: riprova più tardi."
+
+# Salt delle firme degli ID di conversazione di /chat
+CHAT_SESSION_SALT = 'chat-session'
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _chat_session_token(data):
+    """
+    ID della conversazione di /chat, emesso e firmato dal server
+    
+    Il token arriva nel campo session_id della richiesta oppure dal cookie di sessione di Flask (i browser
+    lo inviano da soli); senza token ne viene emesso uno nuovo. Un token con firma non valida non è stato
+    emesso da questo server e viene rifiutato.
+    
+    Returns:
+        tuple: (session_id, token), oppure (None, None) se il token non è valido
+    """
+    serializer = URLSafeSerializer(current_app.secret_key, salt=CHAT_SESSION_SALT)
+    token = data.get('session_id') or session.get('chat_session')
+    if not token:
+        token = serializer.dumps(uuid.uuid4().hex)
+    try:
+        session_id = serializer.loads(token)
+    except BadSignature:
+        return None, None
+    session['chat_session'] = token
+    return session_id, token
+
+def _warming_up_response():
+    """
+    Risposta 503 per le richieste al chatbot arrivate prima della fine dell'inizializzazione
+    
+    Se l'ultima costruzione è fallita la risposta lo dice (failed invece di warming_up) e
+    Retry-After indica quando è previsto il prossimo tentativo.
+    """
+    status = chatbot_loader.status()
+    failed = status['state'] == 'failed'
+    response = jsonify({
+        'response': WARMUP_FAILED_MESSAGE if failed else WARMUP_MESSAGE,
+        'has_bill_analysis': False,
+        'warming_up': not failed,
+        'failed': failed,
+        'status': status
+    })
+    response.status_code = 503
+    retry_after = math.ceil(status.get('retry_in_seconds', 0)) if failed else 0
+    response.headers['Retry-After'] = str(max(retry_after, WARMUP_RETRY_AFTER))
+    return response
+
+@main_bp.route('/api/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: 200 quando il chatbot è pronto, 503 durante l'inizializzazione o se è fallita
+    (in attesa di un nuovo tentativo)
+    
+    Con embedding falliti il chatbot è degraded (ricerca vettoriale parziale, riprovata in
+    background); se nessun chunk è indicizzato non è considerato pronto.
+    """
+    status = chatbot_loader.status()
+    ready = status['state'] == 'ready'
+    components = {'chatbot': status}
+    if ready:
+        knowledge = chatbot_loader.get().rag_system.knowledge_status()
+        components['knowledge_base'] = knowledge
+        status['degraded'] = knowledge['embedding_failed'] > 0
+        if knowledge['chunks'] and not knowledge['indexed']:
+            ready = False
+    return jsonify({
+        'ready': ready,
+        'components': components
+    }), 200 if ready else 503
+
+@main_bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """Statistiche delle cache: risultati delle analisi e, con il chatbot pronto, ricerche RAG"""
+    stats = {'analysis': get_analysis_cache().stats()}
+    chatbot = chatbot_loader.get()
+    if chatbot is not None and chatbot.rag_system is not None:
+        stats['rag'] = chatbot.rag_system.cache_stats()
+    return jsonify(stats)
+
+@main_bp.route('/api/agents/stats', methods=['GET'])
+def agents_stats():
+    """Statistiche degli agenti Strands: sessioni di chat, riassunti e token di prompt"""
+    stats = agent_stats()
+    chatbot = chatbot_loader.get()
+    if chatbot is not None:
+        stats['rag'] = chatbot.rag_system.agent_stats()
+    return jsonify(stats)
+
+@main_bp.route('/api/admin/knowledge-base/reload', methods=['POST'])
+def reload_knowledge_base():
+    """Ricarica subito la knowledge base di questo processo (gli altri la ricaricano con il watcher)"""
+    admin_token = current_app.config.get('ADMIN_TOKEN')
+    if not admin_token:
+        return jsonify({'error': 'Endpoint di amministrazione disattivato'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), admin_token):
+        logger.warning("Token di amministrazione non valido per il ricaricamento della knowledge base")
+        return jsonify({'error': 'Non autorizzato'}), 401
+        
+    chatbot = chatbot_loader.get()
+    if chatbot is None:
+        status = chatbot_loader.status()
+        error = 'Inizializzazione del chatbot fallita' if status['state'] == 'failed' else 'Chatbot in inizializzazione'
+        return jsonify({'error': error, 'status': status}), 503
+    if chatbot.rag_system is None:
+        return jsonify({'error': 'Sistema RAG non disponibile'}), 503
+        
+    try:
+        summary = chatbot.rag_system.reload()
+        return jsonify({'status': 'success', 'reload': summary})
+    except Exception as e:
+        logger.error(f"Errore durante il ricaricamento della knowledge base: {e}")
+        return jsonify({'error': f'Errore durante il ricaricamento della knowledge base: {str(e)}'}), 500
+
 @main_bp.route('/')
 def index():
     return render_template('index.html')
@@ -57,8 +191,19 @@ def upload_file():
         
         logger.info(f"File salvato: {full_path}")
         
+        # Modalità asincrona: OCR e analisi proseguono in background e il client interroga il job
+        if request.values.get('async', '').lower() in ('1', 'true', 'yes'):
+            job_id = job_queue.submit(full_path, unique_filename)
+            return jsonify({
+                'job_id': job_id,
+                'status': 'queued',
+                'filename': unique_filename,
+                'status_url': url_for('main.job_status', job_id=job_id)
+            }), 202
+            
         # Processa il documento
-        extracted_text = process_document(full_path)
+        report = {}
+        extracted_text = process_document(full_path, report=report)
         
         if not extracted_text or len(extracted_text.strip()) < 50:
             logger.warning(f"Testo insufficiente estratto dal file: {unique_filename}")
@@ -82,12 +227,87 @@ def upload_file():
         return jsonify({
             'success': True,
             'filename': unique_filename,
+            'lang': report.get('lang'),
             'analysis': analysis_result
         })
     
     logger.warning(f"Tipo di file non consentito: {file.filename}")
     return jsonify({'error': 'Tipo di file non consentito'}), 400
 
+@main_bp.route('/upload/stream', methods=['POST'])
+def upload_file_stream():
+    if 'file' not in request.files:
+        logger.warning("Nessun file nella richiesta")
+        return jsonify({'error': 'Nessun file nella richiesta'}), 400
+        
+    file = request.files['file']
+    
+    if file.filename == '':
+        logger.warning("Nessun file selezionato")
+        return jsonify({'error': 'Nessun file selezionato'}), 400
+        
+    if not allowed_file(file.filename):
+        logger.warning(f"Tipo di file non consentito: {file.filename}")
+        return jsonify({'error': 'Tipo di file non consentito'}), 400
+        
+    # Genera un nome file sicuro con UUID per evitare conflitti
+    filename = secure_filename(file.filename)
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    
+    # Crea la directory di upload se non esiste
+    upload_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), current_app.config['UPLOAD_FOLDER'])
+    os.makedirs(upload_folder, exist_ok=True)
+    
+    # Salva il file
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_filename)
+    full_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_path)
+    file.save(full_path)
+    
+    logger.info(f"File salvato per analisi in streaming: {full_path}")
+    
+    # Il job gira sui pool in background; la richiesta si limita a inoltrare gli eventi
+    events = queue.Queue()
+    job_id = job_queue.submit(full_path, unique_filename, listener=lambda event, data: events.put((event, data)))
+    
+    def generate():
+        try:
+            yield _sse_event('job', {'job_id': job_id, 'filename': unique_filename})
+            while True:
+                try:
+                    event, data = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse_event(event, data)
+                if event in ('result', 'error'):
+                    break
+        finally:
+            # Con il client disconnesso il job prosegue (risultato su /api/jobs), ma senza riempire la coda
+            job_queue.remove_listener(job_id)
+                
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _sse_event(event, data):
+    """Formatta un evento server-sent event con payload JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@main_bp.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    # Long-polling: con wait > 0 la risposta arriva appena il job supera la versione indicata
+    wait = request.args.get('wait', 0, type=float)
+    version = request.args.get('version', -1, type=int)
+    
+    job = job_queue.wait(job_id, version=version, timeout=wait)
+    if job is None:
+        logger.warning(f"Job non trovato: {job_id}")
+        return jsonify({'error': 'Job non trovato'}), 404
+        
+    return jsonify(job)
+
 @main_bp.route('/compare', methods=['POST'])
 def compare_bills():
     data = request.json
@@ -130,13 +350,20 @@ def chat():
         
     message = data.get('message')
     bill_analysis = data.get('bill_analysis')
+    session_id, token = None, None
+    # Con la chiave predefinita (pubblica) chiunque potrebbe firmare un ID: niente sessioni, solo domande singole
+    if current_app.secret_key != DEFAULT_SECRET_KEY:
+        session_id, token = _chat_session_token(data)
+        if session_id is None:
+            logger.warning("ID di conversazione non emesso dal server")
+            return jsonify({'error': 'Sessione di chat non valida'}), 400
     
     try:
-        # Chat con l'assistente
+        # Chat con l'assistente: con una sessione la conversazione prosegue con la sua cronologia
         logger.info("Chat con l'assistente")
-        response = chat_with_assistant(message, bill_analysis)
+        response = chat_with_assistant(message, bill_analysis, session_id)
         
-        return jsonify({'response': response})
+        return jsonify({'response': response, 'session_id': token})
         
     except Exception as e:
         logger.error(f"Errore durante la chat: {e}")
@@ -154,6 +381,10 @@ def chatbot_message():
     user_id = data.get('user_id')
     message = data.get('message')
     
+    chatbot = chatbot_loader.get()
+    if chatbot is None:
+        return _warming_up_response()
+        
     try:
         # Processa il messaggio con il chatbot
         logger.info(f"Processamento messaggio chatbot per l'utente {user_id}")
@@ -183,6 +414,10 @@ def chatbot_upload():
     user_id = request.form.get('user_id')
     file = request.files['file']
     
+    chatbot = chatbot_loader.get()
+    if chatbot is None:
+        return _warming_up_response()
+    
     if file.filename == '':
         logger.warning("Nessun file selezionato per il chatbot")
         return jsonify({'error': 'Nessun file selezionato'}), 400
@@ -256,6 +491,11 @@ def chatbot_reset():
         
     user_id = data.get('user_id')
     
+    chatbot = chatbot_loader.get()
+    if chatbot is None:
+        # Nessuna conversazione può esistere prima che il chatbot sia pronto
+        return jsonify({'status': 'success'})
+        
     try:
         # Resetta la conversazione per l'utente
         chatbot.reset_conversation(user_id)
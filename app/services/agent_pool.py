@@ -0,0 +1,225 @@
+"""
+Agenti Strands per sessione con cronologia limitata e metriche sui token di prompt
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+from strands import Agent
+from strands.agent.conversation_manager import SummarizingConversationManager
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione delle sessioni di conversazione
+AGENT_SESSION_WINDOW = int(os.getenv('AGENT_SESSION_WINDOW', '20'))  # Messaggi oltre i quali si riassume
+AGENT_SESSION_KEEP = int(os.getenv('AGENT_SESSION_KEEP', '6'))  # Messaggi recenti mai riassunti
+AGENT_MAX_SESSIONS = int(os.getenv('AGENT_MAX_SESSIONS', '200'))
+AGENT_SESSION_TTL = int(os.getenv('AGENT_SESSION_TTL', '1800'))  # Secondi di inattività prima della rimozione
+MAX_TRACKED_TURNS = 50  # Turni distinti nelle statistiche per numero di turno
+
+SUMMARY_SYSTEM_PROMPT = """
+Riassumi la conversazione tra un cliente e l'assistente per le bollette elettriche in pochi punti.
+Conserva i dati della bolletta citati (importi, consumi, periodi, anomalie), le domande del cliente
+e le risposte già date. Non aggiungere informazioni nuove.
+"""
+
+class PromptTokenStats:
+    """
+    Token di prompt (input del modello, sommati su tutti i cicli di una chiamata) per operazione
+    
+    Con il numero di turno (per le sessioni) registra anche la media per turno, che mostra quanto
+    cresce il prompt con la cronologia e se la finestra lo mantiene stabile.
+    """
+    
+    def __init__(self):
+        self.calls = 0
+        self.total = 0
+        self.max = 0
+        self._by_turn = defaultdict(lambda: [0, 0])
+        self._lock = threading.Lock()
+        
+    def record(self, tokens: int, turn: Optional[int] = None) -> None:
+        with self._lock:
+            self.calls += 1
+            self.total += tokens
+            self.max = max(self.max, tokens)
+            if turn is not None:
+                bucket = self._by_turn[min(turn, MAX_TRACKED_TURNS)]
+                bucket[0] += tokens
+                bucket[1] += 1
+                
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                'calls': self.calls,
+                'avg_prompt_tokens': round(self.total / self.calls, 1) if self.calls else 0.0,
+                'max_prompt_tokens': self.max
+            }
+            if self._by_turn:
+                stats['avg_prompt_tokens_by_turn'] = {
+                    turn: round(total / count, 1) for turn, (total, count) in sorted(self._by_turn.items())
+                }
+            return stats
+
+def input_tokens(agent: Agent) -> int:
+    """Token di input consumati finora dall'agente (su tutte le sue chiamate)"""
+    return agent.event_loop_metrics.accumulated_usage.get('inputTokens', 0)
+
+class WindowedSummarizingConversationManager(SummarizingConversationManager):
+    """
+    Riassume i messaggi più vecchi appena la conversazione supera window_messages messaggi
+    
+    SummarizingConversationManager riassume solo quando il modello segnala il superamento del
+    contesto; qui il riassunto scatta alla fine di ogni turno oltre la finestra, così il prompt
+    resta limitato anche in conversazioni lunghe ma lontane dal limite del modello. Gli ultimi
+    preserve_recent_messages messaggi e le coppie tool use/tool result restano intatti.
+    """
+    
+    def __init__(self, window_messages: int, preserve_recent_messages: int, summarization_agent: Agent):
+        super().__init__(
+            summary_ratio=0.8,
+            preserve_recent_messages=preserve_recent_messages,
+            summarization_agent=summarization_agent
+        )
+        self.window_messages = window_messages
+        self.summaries = 0
+        
+    def apply_management(self, agent: Agent, **kwargs: Any) -> None:
+        super().apply_management(agent, **kwargs)
+        if len(agent.messages) <= self.window_messages:
+            return
+        try:
+            self.reduce_context(agent)
+            self.summaries += 1
+            logger.info(f"Cronologia riassunta: {len(agent.messages)} messaggi dopo il riassunto")
+        except Exception as e:
+            # Senza riassunto la conversazione continua, solo con un prompt più lungo
+            logger.warning(f"Riassunto della cronologia non riuscito: {e}")
+
+class SessionAgentPool:
+    """
+    Un agente Strands per sessione, con cronologia limitata e accesso serializzato
+    
+    Ogni sessione ha il proprio agente (nessuna cronologia condivisa tra utenti) e il proprio lock,
+    perché un agente non può servire due richieste contemporaneamente; sessioni diverse procedono
+    in parallelo. Le sessioni inattive da più di ttl secondi vengono rimosse e, oltre max_sessions,
+    si rimuove la meno recente.
+    """
+    
+    def __init__(self, factory: Callable[..., Agent], summarizer_factory: Callable[[], Agent],
+                 max_sessions: int = None, ttl: float = None, window_messages: int = None, keep_messages: int = None):
+        """
+        Inizializza il pool
+        
+        Args:
+            factory: Funzione che crea un agente; riceve conversation_manager come argomento keyword
+            summarizer_factory: Funzione che crea l'agente (senza tool) usato per riassumere la cronologia
+            max_sessions: Sessioni mantenute al massimo (default: AGENT_MAX_SESSIONS)
+            ttl: Secondi di inattività dopo cui una sessione viene rimossa (default: AGENT_SESSION_TTL)
+            window_messages: Messaggi oltre i quali la cronologia viene riassunta (default: AGENT_SESSION_WINDOW)
+            keep_messages: Messaggi recenti esclusi dal riassunto (default: AGENT_SESSION_KEEP)
+        """
+        self.factory = factory
+        self.summarizer_factory = summarizer_factory
+        self.max_sessions = AGENT_MAX_SESSIONS if max_sessions is None else max_sessions
+        self.ttl = AGENT_SESSION_TTL if ttl is None else ttl
+        self.window_messages = AGENT_SESSION_WINDOW if window_messages is None else window_messages
+        self.keep_messages = AGENT_SESSION_KEEP if keep_messages is None else keep_messages
+        self.evicted = 0
+        self.summaries = 0
+        self.prompt_tokens = PromptTokenStats()
+        self._sessions: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def _session(self, session_id: str) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, session in self._sessions.items() if now - session['last_used'] > self.ttl]
+            for key in expired:
+                del self._sessions[key]
+            self.evicted += len(expired)
+            
+            session = self._sessions.get(session_id)
+            if session is None:
+                manager = WindowedSummarizingConversationManager(
+                    self.window_messages, self.keep_messages, self.summarizer_factory()
+                )
+                session = {
+                    'agent': self.factory(conversation_manager=manager),
+                    'manager': manager,
+                    'lock': threading.Lock(),
+                    'turns': 0,
+                    'first_prompt_tokens': 0,
+                    'last_prompt_tokens': 0
+                }
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+            self._sessions.move_to_end(session_id)
+            session['last_used'] = now
+            return session
+            
+    def run(self, session_id: str, prompt: str, **kwargs: Any) -> Any:
+        """
+        Invia un messaggio all'agente della sessione (creandolo se necessario)
+        
+        Returns:
+            AgentResult: Risultato dell'agente
+        """
+        session = self._session(session_id)
+        with session['lock']:
+            agent = session['agent']
+            before = input_tokens(agent)
+            summaries = session['manager'].summaries
+            response = agent(prompt, **kwargs)
+            tokens = input_tokens(agent) - before
+            summarized = session['manager'].summaries - summaries
+            session['turns'] += 1
+            if session['turns'] == 1:
+                session['first_prompt_tokens'] = tokens
+            session['last_prompt_tokens'] = tokens
+            session['last_used'] = time.monotonic()
+            turn = session['turns']
+        with self._lock:
+            self.summaries += summarized
+        self.prompt_tokens.record(tokens, turn)
+        return response
+        
+    def reset(self, session_id: str) -> None:
+        """Dimentica la conversazione di una sessione"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            
+    def stats(self) -> Dict[str, Any]:
+        """
+        Statistiche del pool
+        
+        Returns:
+            dict: sessioni attive, rimosse, riassunti eseguiti, token di prompt per turno e crescita
+                  media del prompt per turno nelle sessioni con almeno due turni
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            evicted = self.evicted
+            summaries = self.summaries
+        growth = [
+            (session['last_prompt_tokens'] - session['first_prompt_tokens']) / (session['turns'] - 1)
+            for session in sessions if session['turns'] > 1
+        ]
+        return {
+            'sessions': len(sessions),
+            'evicted': evicted,
+            'summaries': summaries,
+            'max_messages': max((len(session['agent'].messages) for session in sessions), default=0),
+            'prompt_growth_per_turn': round(sum(growth) / len(growth), 1) if growth else 0.0,
+            'prompt_tokens': self.prompt_tokens.stats()
+        }
@@ -0,0 +1,92 @@
+"""
+Factory condivisa dei client Amazon Bedrock per tutti i servizi di EnergyWise
+"""
+import os
+import logging
+import threading
+import boto3
+from botocore.config import Config
+from dotenv import load_dotenv
+from strands.models import BedrockModel
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione AWS Bedrock
+region = os.getenv('AWS_REGION', 'us-east-1')
+BEDROCK_READ_TIMEOUT = int(os.getenv('BEDROCK_READ_TIMEOUT', '120'))
+BEDROCK_CONNECT_TIMEOUT = int(os.getenv('BEDROCK_CONNECT_TIMEOUT', '60'))
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv('BEDROCK_MAX_POOL_CONNECTIONS', '50'))
+BEDROCK_RETRY_MODE = os.getenv('BEDROCK_RETRY_MODE', 'adaptive')  # 'adaptive', 'standard' o 'legacy'
+BEDROCK_MAX_ATTEMPTS = int(os.getenv('BEDROCK_MAX_ATTEMPTS', '3'))
+
+_session = None
+_runtime_client = None
+_lock = threading.Lock()
+
+def get_client_config() -> Config:
+    """
+    Configurazione comune dei client bedrock-runtime
+    
+    Returns:
+        Config: Timeout, pool di connessioni, keep-alive TCP e retry adattivi
+    """
+    return Config(
+        read_timeout=BEDROCK_READ_TIMEOUT,
+        connect_timeout=BEDROCK_CONNECT_TIMEOUT,
+        max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        retries={
+            'max_attempts': BEDROCK_MAX_ATTEMPTS,
+            'mode': BEDROCK_RETRY_MODE
+        }
+    )
+
+def get_boto_session() -> boto3.Session:
+    """Restituisce la sessione boto3 condivisa (le credenziali vengono risolte una sola volta)"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.Session(region_name=region)
+        return _session
+
+def get_bedrock_runtime():
+    """
+    Restituisce il client bedrock-runtime condiviso
+    
+    I client boto3 sono thread-safe: condividerne uno permette a richieste concorrenti e
+    funzioni di fallback di riutilizzare connessioni TLS già aperte.
+    """
+    global _runtime_client
+    session = get_boto_session()
+    with _lock:
+        if _runtime_client is None:
+            logger.info(f"Creazione del client Bedrock condiviso (pool di {BEDROCK_MAX_POOL_CONNECTIONS} connessioni)")
+            _runtime_client = session.client(service_name='bedrock-runtime', config=get_client_config())
+        return _runtime_client
+
+def create_bedrock_model(model_id: str, temperature: float) -> BedrockModel:
+    """
+    Crea un modello Strands che usa la sessione e il client Bedrock condivisi
+    
+    Args:
+        model_id: ID del modello Bedrock
+        temperature: Temperatura di campionamento
+        
+    Returns:
+        BedrockModel: Modello per gli agenti Strands
+    """
+    model = BedrockModel(
+        model_id=model_id,
+        boto_session=get_boto_session(),
+        boto_client_config=get_client_config(),
+        temperature=temperature
+    )
+    # Il modello crea un proprio client: lo sostituiamo con quello condiviso per riusarne il pool
+    if hasattr(model, 'client'):
+        model.client = get_bedrock_runtime()
+    return model
@@ -1,10 +1,15 @@
-import boto3
-from botocore.config import Config
 import json
 import os
 import logging
 from dotenv import load_dotenv
 
+from .bedrock_client import get_bedrock_runtime
+from .bill_extractor import (
+    BILL_EXTRACTION_MIN_CONFIDENCE, EXTRACTOR_VERSION,
+    build_narrative_prompt, extract_bill_fields, is_confident, merge_extraction
+)
+from .cache import get_analysis_cache, normalize_text
+
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -15,15 +20,12 @@ load_dotenv()
 region = os.getenv('AWS_REGION', 'us-east-1')
 model_id = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
 
-bedrock_runtime = boto3.client(
-    service_name='bedrock-runtime',
-    region_name=region,
-    config=Config(
-        read_timeout=120,  # Aumentato timeout a 120 secondi
-        connect_timeout=60,
-        retries={'max_attempts': 3}  # Aggiunto retry automatico
-    )
-)
+# Versioni dei prompt di analisi e confronto (da incrementare quando cambiano: invalidano la cache dei risultati)
+ANALYSIS_PROMPT_VERSION = '1'
+COMPARISON_PROMPT_VERSION = '1'
+
+# Client condiviso con gli altri servizi (pool di connessioni e retry adattivi)
+bedrock_runtime = get_bedrock_runtime()
 
 def analyze_bill(bill_text):
     """
@@ -40,7 +42,20 @@ def analyze_bill(bill_text):
             "error": "Il testo estratto dalla bolletta è insufficiente per l'analisi. Assicurati che il documento sia leggibile."
         }
     
-    prompt = f"""
+    # Stessa bolletta, stessi prompt e modello: il risultato salvato evita una nuova chiamata al modello.
+    # __name__ separa le voci da quelle di strands_agent, che usa prompt e percorsi diversi nella stessa cache
+    cache_parts = ('analyze_bill', __name__, ANALYSIS_PROMPT_VERSION, EXTRACTOR_VERSION, BILL_EXTRACTION_MIN_CONFIDENCE,
+                   model_id, normalize_text(bill_text))
+    return get_analysis_cache().get_or_compute(cache_parts, lambda: _analyze_bill(bill_text))
+
+def _analyze_bill(bill_text):
+    """Analisi di una bolletta con Bedrock, senza passare dalla cache"""
+    # Con i dati principali estratti localmente il modello scrive solo i campi descrittivi
+    extraction = extract_bill_fields(bill_text)
+    method = 'rules' if is_confident(extraction) else 'model'
+    logger.info(f"Estrazione locale della bolletta: confidenza {extraction['confidence']}, metodo {method}")
+    
+    prompt = build_narrative_prompt(extraction) if method == 'rules' else f"""
     Sei un assistente specializzato nell'analisi delle bollette elettriche spagnole. Analizza attentamente la seguente bolletta elettrica ed estrai SOLO i dati reali presenti nel testo. Non inventare o simulare dati non presenti.
 
     1. Estrai i dati principali (periodo di fatturazione, importo totale, consumi in kWh)
@@ -86,21 +101,21 @@ def analyze_bill(bill_text):
             # Cerca di estrarre il JSON dalla risposta
             if '```json' in result:
                 json_str = result.split('```json')[1].split('```')[0].strip()
-                return json.loads(json_str)
+                return merge_extraction(json.loads(json_str), extraction, method)
             else:
-                return json.loads(result)
+                return merge_extraction(json.loads(result), extraction, method)
         except json.JSONDecodeError:
             logger.error("Impossibile analizzare la risposta come JSON")
             # Se non riesce a decodificare il JSON, restituisci la risposta come testo
-            return {
+            return merge_extraction({
                 "error": "Impossibile analizzare la risposta come JSON", 
                 "raw_response": result,
                 "summary": "Errore nell'elaborazione della risposta. Controlla il testo estratto."
-            }
+            }, extraction, method)
             
     except Exception as e:
         logger.error(f"Errore durante l'analisi della bolletta: {e}")
-        return {"error": str(e)}
+        return merge_extraction({"error": str(e)}, extraction, method)
 
 def compare_with_previous(current_bill, previous_bill=None):
     """
@@ -119,6 +134,12 @@ def compare_with_previous(current_bill, previous_bill=None):
             "comparison": None
         }
     
+    cache_parts = ('compare_with_previous', __name__, COMPARISON_PROMPT_VERSION, model_id,
+                   json.dumps(current_bill, sort_keys=True), json.dumps(previous_bill, sort_keys=True))
+    return get_analysis_cache().get_or_compute(cache_parts, lambda: _compare_with_previous(current_bill, previous_bill))
+
+def _compare_with_previous(current_bill, previous_bill):
+    """Confronto tra due bollette con Bedrock, senza passare dalla cache"""
     prompt = f"""
     Sei un assistente specializzato nell'analisi delle bollette elettriche spagnole. Confronta la bolletta corrente con quella precedente e identifica SOLO differenze reali basate sui dati forniti. Non inventare o simulare dati non presenti.
 
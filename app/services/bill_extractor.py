@@ -0,0 +1,420 @@
+"""
+Estrazione deterministica (regole ed espressioni regolari) dei dati principali delle bollette
+spagnole e italiane, prima di qualsiasi chiamata al modello
+"""
+import os
+import re
+import json
+import logging
+import datetime
+from typing import Any, Dict, List, Optional
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Confidenza minima dell'estrazione per chiedere al modello solo i campi descrittivi
+BILL_EXTRACTION_MIN_CONFIDENCE = float(os.getenv('BILL_EXTRACTION_MIN_CONFIDENCE', '0.7'))
+
+# Versione delle regole di estrazione (da incrementare quando cambiano, invalida la cache delle analisi)
+EXTRACTOR_VERSION = '2'
+
+# Peso di ogni campo nel calcolo della confidenza (somma 1)
+FIELD_WEIGHTS = {
+    'total_amount': 0.3,
+    'billing_period': 0.2,
+    'consumption_kwh': 0.2,
+    'supply_point': 0.1,
+    'energy_term': 0.1,
+    'power_term': 0.05,
+    'taxes': 0.05,
+}
+
+# Numeri in formato europeo ("1.234,56", "45,3") o con il punto decimale ("45.30")
+NUMBER = r'\d{1,3}(?:\.\d{3})+(?:,\d{1,6})?|\d+(?:[.,]\d{1,6})?'
+
+# Importi: il valore deve avere il simbolo dell'euro o due decimali; i prezzi unitari (€/kWh) e le percentuali sono esclusi
+MONEY_RE = re.compile(
+    rf'(?P<prefix>€\s*)?(?P<value>{NUMBER})(?![\d.,])(?!\s*(?:€|eur\w*)?\s*/)(?!\s*%)(?P<currency>\s*(?:€|eur(?:os?)?\b))?',
+    re.IGNORECASE
+)
+KWH_RE = re.compile(rf'(?P<value>{NUMBER})\s*kwh\b(?!\s*/)', re.IGNORECASE)
+
+MONTHS = {
+    # Spagnolo
+    'enero': 1, 'febrero': 2, 'marzo': 3, 'abril': 4, 'mayo': 5, 'junio': 6, 'julio': 7, 'agosto': 8,
+    'septiembre': 9, 'setiembre': 9, 'octubre': 10, 'noviembre': 11, 'diciembre': 12,
+    # Italiano
+    'gennaio': 1, 'febbraio': 2, 'aprile': 4, 'maggio': 5, 'giugno': 6, 'luglio': 7,
+    'settembre': 9, 'ottobre': 10, 'novembre': 11, 'dicembre': 12,
+}
+DATE_RE = re.compile(
+    r'(?P<day>\d{1,2})[/.-](?P<month>\d{1,2})[/.-](?P<year>\d{4}|\d{2})\b'
+    r'|(?P<tday>\d{1,2})\s+(?:de\s+)?(?P<tmonth>' + '|'.join(MONTHS) + r')\s+(?:de\s+|del\s+)?(?P<tyear>\d{4})',
+    re.IGNORECASE
+)
+
+# Punti di fornitura: CUPS (Spagna), POD per l'elettricità e PDR per il gas (Italia)
+CUPS_RE = re.compile(r'\bES\s?(?:\d{4}\s?){4}[A-Z]{2}(?:\s?\d[FP])?\b')
+POD_RE = re.compile(r'\bIT\s?\d{3}\s?E\s?\d{8}[A-Z]?\b')
+PDR_RE = re.compile(r'\bPDR\b[^\d\n]{0,20}(?P<code>\d{14})\b', re.IGNORECASE)
+
+# Etichette generiche dei campi, per lingua (espressioni regolari, senza distinzione tra maiuscole e minuscole)
+GENERIC_LABELS = {
+    'es': {
+        'total_amount': [r'total\s+importe\s+factura', r'importe\s+total(?:\s+(?:de\s+la\s+)?factura)?', r'total\s+a\s+pagar',
+                         r'total\s+factura', r'importe\s+a\s+pagar'],
+        'billing_period': [r'periodo\s+de\s+facturaci[oó]n', r'per[ií]odo\s+facturado', r'periodo\s+de\s+consumo', r'per[ií]odo'],
+        'consumption_kwh': [r'consumo\s+total', r'consumo\s+(?:en\s+el\s+)?periodo', r'consumo\s+facturado', r'energ[ií]a\s+consumida',
+                            r'total\s+consumo', r'consumo'],
+        'power_term': [r't[eé]rmino\s+(?:fijo\s+)?(?:de\s+|por\s+)?potencia', r'por\s+potencia\s+contratada', r'potencia\s+facturada'],
+        'energy_term': [r't[eé]rmino\s+(?:variable\s+)?(?:de\s+|por\s+)?energ[ií]a', r'por\s+energ[ií]a\s+consumida', r'energ[ií]a\s+activa'],
+        'electricity_tax': [r'impuesto\s+(?:especial\s+)?(?:sobre\s+(?:la\s+)?)?electricidad', r'impuesto\s+el[eé]ctrico'],
+        'vat': [r'\biva\b', r'\bigic\b'],
+    },
+    'it': {
+        'total_amount': [r'totale\s+(?:da\s+)?pagare', r'totale\s+(?:della\s+)?bolletta', r'importo\s+(?:totale|da\s+pagare)', r'totale\s+fattura'],
+        'billing_period': [r'periodo\s+di\s+(?:fatturazione|riferimento|consumo)', r'periodo'],
+        'consumption_kwh': [r'consumo\s+(?:totale|fatturato|complessivo)', r'consumo\s+(?:nel|del)\s+periodo', r'energia\s+consumata',
+                            r'consumi?'],
+        'power_term': [r'quota\s+potenza', r'spesa\s+per\s+(?:la\s+)?potenza'],
+        'energy_term': [r'spesa\s+per\s+la\s+materia\s+energia', r'quota\s+energia', r'materia\s+energia'],
+        'electricity_tax': [r'accis[ae]', r'imposte\s+erariali', r'imposta\s+di\s+consumo', r'totale\s+imposte', r'\bimposte\b'],
+        'vat': [r'\biva\b'],
+    },
+}
+
+# Modelli per fornitore: riconoscimento e etichette specifiche, provate prima di quelle generiche
+SUPPLIER_TEMPLATES = {
+    'iberdrola': {
+        'name': 'Iberdrola', 'language': 'es', 'detect': r'\biberdrola\b',
+        'labels': {'total_amount': [r'total\s+importe\s+factura'], 'billing_period': [r'periodo\s+de\s+facturaci[oó]n']},
+    },
+    'endesa': {
+        'name': 'Endesa', 'language': 'es', 'detect': r'\bendesa\b',
+        'labels': {'total_amount': [r'total\s+a\s+pagar', r'importe\s+total'], 'consumption_kwh': [r'consumo\s+total']},
+    },
+    'naturgy': {
+        'name': 'Naturgy', 'language': 'es', 'detect': r'\bnaturgy\b|\bgas\s+natural\s+fenosa\b',
+        'labels': {'total_amount': [r'total\s+factura'], 'billing_period': [r'periodo\s+de\s+consumo']},
+    },
+    'repsol': {
+        'name': 'Repsol', 'language': 'es', 'detect': r'\brepsol\b',
+        'labels': {'total_amount': [r'importe\s+total\s+factura']},
+    },
+    'totalenergies': {
+        'name': 'TotalEnergies', 'language': 'es', 'detect': r'\btotal\s?energies\b',
+        'labels': {'total_amount': [r'total\s+importe']},
+    },
+    'enel': {
+        'name': 'Enel Energia', 'language': 'it', 'detect': r'\benel\s+energia\b|\benel\b',
+        'labels': {'total_amount': [r'totale\s+da\s+pagare'], 'consumption_kwh': [r'consumo\s+fatturato']},
+    },
+    'edison': {
+        'name': 'Edison Energia', 'language': 'it', 'detect': r'\bedison\b',
+        'labels': {'total_amount': [r'totale\s+bolletta']},
+    },
+    'a2a': {
+        'name': 'A2A Energia', 'language': 'it', 'detect': r'\ba2a\b',
+        'labels': {'total_amount': [r'importo\s+da\s+pagare']},
+    },
+    'hera': {
+        'name': 'Hera Comm', 'language': 'it', 'detect': r'\bhera\s*comm\b',
+        'labels': {'total_amount': [r'totale\s+da\s+pagare']},
+    },
+    'plenitude': {
+        'name': 'Eni Plenitude', 'language': 'it', 'detect': r'\bplenitude\b|\beni\s+gas\s+e\s+luce\b',
+        'labels': {'total_amount': [r'totale\s+da\s+pagare'], 'energy_term': [r'spesa\s+per\s+la\s+materia\s+energia']},
+    },
+}
+
+# Parole tipiche per riconoscere la lingua quando il fornitore non è noto
+LANGUAGE_HINTS = {
+    'es': r'\b(?:factura|importe|periodo\s+de|t[eé]rmino|cups|consumo\s+total|impuesto)\b',
+    'it': r'\b(?:bolletta|importo|periodo\s+di|spesa\s+per|pod|pdr|accise|fornitura)\b',
+}
+
+def parse_number(text: str) -> Optional[float]:
+    """
+    Converte un numero in formato europeo o anglosassone ("1.234,56", "45,30", "45.30", "1.234")
+    
+    Con un solo separatore il punto seguito da esattamente tre cifre è un separatore delle migliaia.
+    """
+    text = text.strip()
+    if ',' in text and '.' in text:
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif ',' in text:
+        text = text.replace(',', '.')
+    elif re.fullmatch(r'\d{1,3}(?:\.\d{3})+', text):
+        text = text.replace('.', '')
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def parse_date(match: re.Match) -> Optional[datetime.date]:
+    """Converte una corrispondenza di DATE_RE in una data"""
+    try:
+        if match.group('day'):
+            year = int(match.group('year'))
+            if year < 100:
+                year += 2000
+            return datetime.date(year, int(match.group('month')), int(match.group('day')))
+        return datetime.date(int(match.group('tyear')), MONTHS[match.group('tmonth').lower()], int(match.group('tday')))
+    except (ValueError, KeyError):
+        return None
+
+def _windows(text: str, labels: List[str]):
+    """Per ogni occorrenza delle etichette, il resto della riga e la riga successiva"""
+    for label in labels:
+        for match in re.finditer(label, text, re.IGNORECASE):
+            rest = text[match.end():]
+            line_end = rest.find('\n')
+            if line_end < 0:
+                yield rest, ''
+                continue
+            next_end = rest.find('\n', line_end + 1)
+            yield rest[:line_end], rest[line_end + 1:next_end if next_end >= 0 else None]
+
+def _money_values(window: str) -> List[float]:
+    values = []
+    for match in MONEY_RE.finditer(window):
+        raw = match.group('value')
+        # Senza simbolo di valuta solo i valori con due decimali sono importi
+        if not (match.group('prefix') or match.group('currency') or re.search(r'[.,]\d{2}$', raw)):
+            continue
+        value = parse_number(raw)
+        if value is not None:
+            values.append(value)
+    return values
+
+def _find_money(text: str, labels: List[str]) -> Optional[float]:
+    """
+    Importo associato a un'etichetta
+    
+    Si prende l'ultimo importo sulla stessa riga dell'etichetta (le righe del tipo "IVA 21% s/ 60,00 €
+    12,60 €" riportano prima l'imponibile e poi l'importo), altrimenti il primo della riga successiva.
+    """
+    for line, next_line in _windows(text, labels):
+        values = _money_values(line)
+        if values:
+            return values[-1]
+        values = _money_values(next_line)
+        if values:
+            return values[0]
+    return None
+
+def _find_kwh(text: str, labels: List[str]) -> Optional[float]:
+    for line, next_line in _windows(text, labels):
+        for window in (line, next_line):
+            match = KWH_RE.search(window)
+            if match:
+                return parse_number(match.group('value'))
+    return None
+
+def _find_period(text: str, labels: List[str]) -> Optional[Dict[str, Any]]:
+    """Periodo di fatturazione: le prime due date dopo l'etichetta, o in una forma "del/dal ... al ..." """
+    candidates = [line + '\n' + next_line for line, next_line in _windows(text, labels)]
+    candidates.extend(match.group(0) for match in re.finditer(r'\bdal?\b.{0,40}?\bal\b.{0,40}', text, re.IGNORECASE))
+    candidates.extend(match.group(0) for match in re.finditer(r'\bdel\b.{0,40}?\bal\b.{0,40}', text, re.IGNORECASE))
+    for window in candidates:
+        dates = [date for date in (parse_date(match) for match in DATE_RE.finditer(window)) if date]
+        if len(dates) >= 2:
+            start, end = dates[0], dates[1]
+            days = (end - start).days
+            # Periodi non plausibili (date invertite o più di un anno) indicano date lette male
+            if 0 < days <= 400:
+                return {'start': start.isoformat(), 'end': end.isoformat(), 'days': days + 1}
+    return None
+
+def _find_supply_point(text: str) -> Optional[Dict[str, str]]:
+    match = CUPS_RE.search(text)
+    if match:
+        return {'type': 'CUPS', 'code': re.sub(r'\s', '', match.group(0))}
+    match = POD_RE.search(text)
+    if match:
+        return {'type': 'POD', 'code': re.sub(r'\s', '', match.group(0))}
+    match = PDR_RE.search(text)
+    if match:
+        return {'type': 'PDR', 'code': match.group('code')}
+    return None
+
+def detect_supplier(text: str) -> Optional[str]:
+    """Chiave del modello del fornitore citato nella bolletta, o None"""
+    for key, template in SUPPLIER_TEMPLATES.items():
+        if re.search(template['detect'], text, re.IGNORECASE):
+            return key
+    return None
+
+def detect_language(text: str, supplier: Optional[str] = None) -> str:
+    """Lingua della bolletta ('es' o 'it'), dal fornitore, dal punto di fornitura o dalle parole tipiche"""
+    if supplier:
+        return SUPPLIER_TEMPLATES[supplier]['language']
+    if CUPS_RE.search(text):
+        return 'es'
+    if POD_RE.search(text):
+        return 'it'
+    scores = {language: len(re.findall(pattern, text, re.IGNORECASE)) for language, pattern in LANGUAGE_HINTS.items()}
+    return max(scores, key=scores.get)
+
+def _labels(field: str, language: str, supplier: Optional[str]) -> List[str]:
+    """Etichette di un campo: prima quelle del fornitore, poi quelle generiche della lingua e infine dell'altra lingua"""
+    labels = []
+    if supplier:
+        labels.extend(SUPPLIER_TEMPLATES[supplier]['labels'].get(field, []))
+    labels.extend(GENERIC_LABELS[language].get(field, []))
+    for other, other_labels in GENERIC_LABELS.items():
+        if other != language:
+            labels.extend(other_labels.get(field, []))
+    return labels
+
+def extract_bill_fields(bill_text: str) -> Dict[str, Any]:
+    """
+    Estrae i dati strutturati di una bolletta con regole ed espressioni regolari
+    
+    Args:
+        bill_text: Testo estratto dalla bolletta
+        
+    Returns:
+        dict: raw_data (solo i campi trovati), confidence (0-1), missing (campi non trovati),
+              supplier e language
+    """
+    text = bill_text or ''
+    supplier = detect_supplier(text)
+    language = detect_language(text, supplier)
+    
+    raw_data: Dict[str, Any] = {}
+    if supplier:
+        raw_data['supplier'] = SUPPLIER_TEMPLATES[supplier]['name']
+    supply_point = _find_supply_point(text)
+    if supply_point:
+        raw_data['supply_point'] = supply_point
+    period = _find_period(text, _labels('billing_period', language, supplier))
+    if period:
+        raw_data['billing_period'] = period
+    for field in ('total_amount', 'power_term', 'energy_term'):
+        value = _find_money(text, _labels(field, language, supplier))
+        if value is not None:
+            raw_data[field] = value
+    consumption = _find_kwh(text, _labels('consumption_kwh', language, supplier))
+    if consumption is not None:
+        raw_data['consumption_kwh'] = consumption
+    taxes = {}
+    for field in ('vat', 'electricity_tax'):
+        value = _find_money(text, _labels(field, language, supplier))
+        if value is not None:
+            taxes[field] = value
+    if taxes:
+        raw_data['taxes'] = taxes
+    if 'total_amount' in raw_data:
+        raw_data['currency'] = 'EUR'
+        
+    confidence = sum(weight for field, weight in FIELD_WEIGHTS.items() if field in raw_data)
+    # Voci che superano il totale indicano un importo letto dalla riga sbagliata
+    total = raw_data.get('total_amount')
+    components = [raw_data.get('power_term', 0), raw_data.get('energy_term', 0)] + list(taxes.values())
+    if total is not None and sum(components) > total * 1.05:
+        logger.warning("Le voci estratte superano il totale della bolletta: confidenza ridotta")
+        confidence *= 0.5
+        
+    return {
+        'raw_data': raw_data,
+        'confidence': round(confidence, 3),
+        'missing': [field for field in FIELD_WEIGHTS if field not in raw_data],
+        'supplier': supplier,
+        'language': language,
+    }
+
+def is_confident(extraction: Dict[str, Any]) -> bool:
+    """Indica se l'estrazione è abbastanza affidabile da chiedere al modello solo i campi descrittivi"""
+    return extraction.get('confidence', 0) >= BILL_EXTRACTION_MIN_CONFIDENCE
+
+def build_narrative_prompt(extraction: Dict[str, Any]) -> str:
+    """
+    Prompt per i soli campi descrittivi dell'analisi, a partire dai dati già estratti
+    
+    Il modello riceve i dati strutturati al posto del testo completo della bolletta e non deve
+    restituire raw_data, quindi sia l'input sia l'output sono molto più brevi.
+    """
+    return f"""
+    Questi sono i dati già estratti da una bolletta elettrica (importi in euro). Basati SOLO su questi dati, senza inventarne altri.
+    
+    {json.dumps(extraction['raw_data'], ensure_ascii=False, indent=2)}
+    
+    Rispondi in formato JSON con i seguenti campi:
+    - summary: riepilogo dei dati principali
+    - cost_breakdown: spiegazione delle voci di costo
+    - saving_tips: consigli per risparmiare basati sui dati
+    - anomalies: eventuali anomalie rilevate nei dati
+    Non includere il campo raw_data.
+    """
+
+def describe_extraction(extraction: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Analisi costruita solo dai dati estratti, usata quando il modello non è disponibile
+    
+    Returns:
+        dict: summary e cost_breakdown descrittivi, saving_tips e anomalies vuoti, raw_data
+              e degraded=True (risultato parziale, da non salvare nella cache)
+    """
+    raw_data = extraction['raw_data']
+    summary = []
+    if 'supplier' in raw_data:
+        summary.append(f"Fornitore: {raw_data['supplier']}.")
+    if 'billing_period' in raw_data:
+        period = raw_data['billing_period']
+        summary.append(f"Periodo di fatturazione dal {period['start']} al {period['end']} ({period['days']} giorni).")
+    if 'consumption_kwh' in raw_data:
+        summary.append(f"Consumo: {raw_data['consumption_kwh']:g} kWh.")
+    if 'total_amount' in raw_data:
+        summary.append(f"Importo totale: {raw_data['total_amount']:.2f} €.")
+    if 'supply_point' in raw_data:
+        summary.append(f"Punto di fornitura ({raw_data['supply_point']['type']}): {raw_data['supply_point']['code']}.")
+        
+    labels = {'power_term': 'Quota potenza', 'energy_term': 'Quota energia'}
+    cost_breakdown = [f"{label}: {raw_data[field]:.2f} €." for field, label in labels.items() if field in raw_data]
+    tax_labels = {'vat': 'IVA', 'electricity_tax': 'Imposte sull\'elettricità'}
+    cost_breakdown.extend(
+        f"{tax_labels[field]}: {value:.2f} €." for field, value in raw_data.get('taxes', {}).items()
+    )
+    return {
+        'summary': ' '.join(summary) or "Dato non disponibile",
+        'cost_breakdown': ' '.join(cost_breakdown) or "Dato non disponibile",
+        'saving_tips': [],
+        'anomalies': [],
+        'raw_data': raw_data,
+        'degraded': True
+    }
+
+def merge_extraction(result: Dict[str, Any], extraction: Dict[str, Any], method: str) -> Dict[str, Any]:
+    """
+    Unisce all'analisi del modello i dati estratti localmente
+    
+    Con method='rules' raw_data è quello dell'estrattore (il modello ha prodotto solo i campi
+    descrittivi); con method='model' resta quello del modello. In entrambi i casi l'esito
+    dell'estrazione viene riportato nel campo 'extraction'.
+    """
+    if not isinstance(result, dict):
+        return result
+    if method == 'rules':
+        if 'error' in result:
+            # Il modello non ha risposto: l'analisi si basa solo sui dati estratti
+            logger.warning(f"Analisi descrittiva non disponibile, uso dei soli dati estratti: {result['error']}")
+            result = describe_extraction(extraction)
+        else:
+            result['raw_data'] = extraction['raw_data']
+    result['extraction'] = {
+        'method': method,
+        'confidence': extraction['confidence'],
+        'supplier': extraction['supplier'],
+        'language': extraction['language'],
+        'missing': extraction['missing']
+    }
+    return result
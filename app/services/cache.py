@@ -0,0 +1,473 @@
+"""
+Cache condivise dai servizi di EnergyWise
+"""
+import os
+import re
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from dotenv import load_dotenv
+
+from .single_flight import SingleFlight
+
+try:
+    import redis
+except ImportError:  # Dipendenza opzionale
+    redis = None
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione della cache dei risultati delle analisi: 'memory', 'sqlite', 'redis' o 'none'
+ANALYSIS_CACHE_BACKEND = os.getenv('ANALYSIS_CACHE_BACKEND', 'memory')
+ANALYSIS_CACHE_TTL = int(os.getenv('ANALYSIS_CACHE_TTL', '604800'))  # Secondi (7 giorni)
+ANALYSIS_CACHE_SIZE = int(os.getenv('ANALYSIS_CACHE_SIZE', '256'))  # Voci della cache in memoria
+ANALYSIS_CACHE_DB = os.getenv('ANALYSIS_CACHE_DB', os.path.join(tempfile.gettempdir(), 'energywise_analysis_cache.sqlite'))
+ANALYSIS_CACHE_REDIS_URL = os.getenv('ANALYSIS_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Calcola lo SHA-256 del contenuto di un file leggendolo a blocchi"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DiskLRUCache:
+    """
+    Cache persistente di testi su disco locale, con limite di dimensione ed eviction LRU
+    
+    Ogni voce è un file nella directory della cache; il tempo di modifica del file viene
+    aggiornato a ogni lettura e le voci usate meno di recente vengono rimosse quando la
+    dimensione totale supera max_bytes. La directory può essere condivisa tra processi.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.txt")
+        
+    def get(self, key: str) -> Optional[str]:
+        """Restituisce il valore associato alla chiave, oppure None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = f.read()
+            # Segna la voce come usata di recente
+            os.utime(path, None)
+            return value
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Lettura dalla cache fallita per {key}: {e}")
+            return None
+            
+    def set(self, key: str, value: str) -> None:
+        """Salva un valore e applica il limite di dimensione"""
+        try:
+            # Scrittura atomica: un lettore concorrente vede il file completo o nessun file
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Scrittura nella cache fallita per {key}: {e}")
+            return
+        self._evict()
+        
+    def _evict(self) -> None:
+        """Rimuove le voci usate meno di recente finché la cache rientra nel limite"""
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.txt'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+                    
+            if total <= self.max_bytes:
+                return
+                
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            logger.info(f"Cache {self.directory} ridotta a {total} byte")
+            
+    def clear(self) -> None:
+        """Svuota la cache"""
+        with self._lock:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith('.txt'):
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+
+class TTLLRUCache:
+    """
+    Cache in memoria con numero massimo di voci, eviction LRU e scadenza (TTL)
+    
+    Thread-safe; conta hit e miss per valutarne l'efficacia.
+    """
+    
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self, key: str) -> Optional[Any]:
+        """Restituisce il valore associato alla chiave, oppure None se manca o è scaduto"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+            
+    def set(self, key: str, value: Any) -> None:
+        """Salva un valore, rimuovendo la voce usata meno di recente se la cache è piena"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                
+    def clear(self) -> None:
+        """Svuota la cache"""
+        with self._lock:
+            self._entries.clear()
+            
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche di utilizzo della cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class SQLiteCache:
+    """
+    Cache di valori binari con scadenza in un database SQLite locale
+    
+    Il file può essere condiviso da più processi (es. i worker di gunicorn) sulla stessa macchina:
+    ogni operazione apre una connessione breve e il database usa il journal WAL, così letture e
+    scritture concorrenti non si bloccano a vicenda.
+    """
+    
+    PURGE_EVERY = 100  # Scritture tra due pulizie delle voci scadute
+    
+    def __init__(self, path: str, ttl: float):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)')
+            
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5)
+        
+    def get(self, key: str) -> Optional[bytes]:
+        """Restituisce il valore associato alla chiave, oppure None se manca o è scaduto"""
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute(
+                    'SELECT value FROM entries WHERE key = ? AND expires_at > ?', (key, time.time())
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Lettura dalla cache {self.path} fallita: {e}")
+            row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+        
+    def set(self, key: str, value: bytes) -> None:
+        """Salva un valore; periodicamente rimuove le voci scadute"""
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % self.PURGE_EVERY == 0
+        now = time.time()
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries (key, value, expires_at) VALUES (?, ?, ?)',
+                    (key, value, now + self.ttl)
+                )
+                if purge:
+                    conn.execute('DELETE FROM entries WHERE expires_at <= ?', (now,))
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Scrittura nella cache {self.path} fallita: {e}")
+            
+    def clear(self) -> None:
+        """Svuota la cache"""
+        with self._connect() as conn:
+            conn.execute('DELETE FROM entries')
+        conn.close()
+        
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche di utilizzo della cache (contatori del processo corrente)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+class RedisCache:
+    """
+    Cache di valori binari con scadenza su Redis, condivisa tra processi e macchine
+    
+    Richiede il pacchetto opzionale redis. Gli errori di connessione vengono registrati e trattati
+    come miss, così un Redis non raggiungibile rallenta le analisi ma non le blocca.
+    """
+    
+    def __init__(self, url: str, ttl: float, prefix: str = 'energywise:'):
+        if redis is None:
+            raise RuntimeError("Il pacchetto redis non è installato")
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self._lock = threading.Lock()
+        
+    def get(self, key: str) -> Optional[bytes]:
+        """Restituisce il valore associato alla chiave, oppure None se manca o è scaduto"""
+        try:
+            value = self._client.get(self.prefix + key)
+        except redis.RedisError as e:
+            logger.warning(f"Lettura dalla cache Redis fallita: {e}")
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+        
+    def set(self, key: str, value: bytes) -> None:
+        """Salva un valore con scadenza"""
+        try:
+            self._client.set(self.prefix + key, value, ex=max(1, int(self.ttl)))
+        except redis.RedisError as e:
+            logger.warning(f"Scrittura nella cache Redis fallita: {e}")
+            
+    def clear(self) -> None:
+        """Rimuove le voci con il prefisso della cache"""
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+            
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche di utilizzo della cache (contatori del processo corrente)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizza un testo estratto per le chiavi di cache: forma Unicode NFC e spazi compattati,
+    così differenze di impaginazione dell'OCR non producono chiavi diverse
+    """
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text or '')).strip()
+
+class ResultCache:
+    """
+    Cache dei risultati JSON delle analisi (es. analyze_bill) su un backend intercambiabile
+    
+    La chiave è lo SHA-256 delle parti che determinano il risultato (nome dell'operazione,
+    versione del prompt, modello, testo normalizzato...). I valori vengono serializzati in JSON,
+    quindi ogni lettura restituisce una copia indipendente. I risultati con il campo 'error' non
+    vengono salvati, così come quelli parziali (degraded). Il backend deve offrire get, set, clear
+    e stats (TTLLRUCache, SQLiteCache o RedisCache); con backend None la cache è disattivata.
+    
+    Le richieste concorrenti con la stessa chiave vengono raggruppate: una sola esegue il calcolo,
+    le altre ne attendono il risultato.
+    """
+    
+    def __init__(self, backend: Optional[Any], name: str = 'memory'):
+        self.backend = backend
+        self.name = name
+        self.saved_seconds = 0.0
+        self._compute_seconds: Dict[str, float] = {}
+        self._flight = SingleFlight(f"cache {name}")
+        self._lock = threading.Lock()
+        
+    @staticmethod
+    def key(parts: Sequence[str]) -> str:
+        """Chiave di cache per le parti indicate"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('utf-8'))
+            digest.update(b'\x1f')
+        return digest.hexdigest()
+        
+    def cacheable(self, value: Any) -> bool:
+        """Indica se un risultato può essere salvato"""
+        return (self.backend is not None and isinstance(value, dict)
+                and 'error' not in value and not value.get('degraded'))
+                
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Risultato salvato per la chiave, oppure None"""
+        if self.backend is None:
+            return None
+        value = self.backend.get(key)
+        if value is None:
+            return None
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Voce della cache dei risultati illeggibile: {e}")
+            return None
+            
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """Salva un risultato (ignorato se contiene un errore o è parziale)"""
+        if not self.cacheable(value):
+            return
+        self.backend.set(key, json.dumps(value, ensure_ascii=False).encode('utf-8'))
+        
+    def get_or_compute(self, parts: Sequence[str], compute: Callable[[], Dict[str, Any]],
+                       on_reuse: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Restituisce il risultato salvato per le parti indicate, oppure lo calcola con compute e lo salva
+        
+        Se la stessa chiave è già in lavorazione in un altro thread, attende quel risultato invece di
+        ricalcolarlo (anche se è un errore, che quindi non viene ripetuto subito contro il modello).
+        
+        Args:
+            parts: Parti della chiave (operazione, modulo che la implementa, versione del prompt, modello,
+                   input normalizzati)
+            compute: Funzione senza argomenti che produce il risultato
+            on_reuse: Callback opzionale chiamata con 'cache' o 'shared' quando il risultato non è
+                      stato calcolato da questa chiamata (compute non viene eseguita)
+        """
+        key = self.key(parts)
+        (result, hit), shared = self._flight.do(key, lambda: self._lookup_or_compute(key, parts, compute))
+        if on_reuse and (shared or hit):
+            on_reuse('shared' if shared else 'cache')
+        # Chi ha atteso riceve una copia, come per le letture dalla cache
+        return copy.deepcopy(result) if shared else result
+        
+    def _lookup_or_compute(self, key: str, parts: Sequence[str],
+                           compute: Callable[[], Dict[str, Any]]) -> Tuple[Dict[str, Any], bool]:
+        """Risultato dalla cache o da compute, con un flag che indica se era in cache"""
+        cached = self.get(key)
+        if cached is not None:
+            with self._lock:
+                self.saved_seconds += self._compute_seconds.get(key, 0.0)
+            logger.info(f"Risultato trovato nella cache {self.name} ({parts[0]})")
+            return cached, True
+            
+        start = time.perf_counter()
+        result = compute()
+        elapsed = time.perf_counter() - start
+        if self.cacheable(result):
+            self.set(key, result)
+            with self._lock:
+                # Durata del calcolo, per stimare il tempo risparmiato dalle hit (solo in questo processo)
+                self._compute_seconds[key] = elapsed
+                if len(self._compute_seconds) > 10000:
+                    self._compute_seconds.clear()
+        return result, False
+        
+    def clear(self) -> None:
+        """Svuota la cache"""
+        if self.backend is not None:
+            self.backend.clear()
+            
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche della cache: backend, hit, miss, hit rate, secondi di calcolo risparmiati e richieste raggruppate"""
+        stats = {'backend': self.name}
+        if self.backend is not None:
+            stats.update(self.backend.stats())
+        stats['coalesced'] = self._flight.stats()['coalesced']
+        with self._lock:
+            stats['saved_seconds'] = round(self.saved_seconds, 3)
+        return stats
+
+def create_result_cache(backend: str = None) -> ResultCache:
+    """
+    Crea la cache dei risultati con il backend indicato (default: ANALYSIS_CACHE_BACKEND)
+    
+    Se il backend richiesto non è disponibile (es. Redis senza il pacchetto redis) si usa la cache in memoria.
+    """
+    backend = (backend or ANALYSIS_CACHE_BACKEND).lower()
+    try:
+        if backend == 'none':
+            return ResultCache(None, 'none')
+        if backend == 'sqlite':
+            return ResultCache(SQLiteCache(ANALYSIS_CACHE_DB, ANALYSIS_CACHE_TTL), 'sqlite')
+        if backend == 'redis':
+            return ResultCache(RedisCache(ANALYSIS_CACHE_REDIS_URL, ANALYSIS_CACHE_TTL), 'redis')
+        if backend != 'memory':
+            logger.warning(f"Backend della cache dei risultati sconosciuto: {backend}, uso della cache in memoria")
+    except Exception as e:
+        logger.warning(f"Cache dei risultati {backend} non disponibile, uso della cache in memoria: {e}")
+    return ResultCache(TTLLRUCache(ANALYSIS_CACHE_SIZE, ANALYSIS_CACHE_TTL), 'memory')
+
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+
+def get_analysis_cache() -> ResultCache:
+    """Restituisce (creandola se necessario) la cache dei risultati delle analisi condivisa dai servizi"""
+    global _analysis_cache
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            _analysis_cache = create_result_cache()
+        return _analysis_cache
@@ -0,0 +1,85 @@
+"""
+Indici di consultazione del catalogo di prodotti e offerte della knowledge base
+"""
+import bisect
+import logging
+import datetime
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class CatalogIndex:
+    """
+    Indici di prodotti e offerte costruiti una sola volta al caricamento
+    
+    - ID -> prodotto e tipo -> prodotti, per ricerche in tempo costante;
+    - offerte con scadenza ordinate per valid_until (già convertito in data), così le offerte
+      ancora valide sono un suffisso della lista trovato con una ricerca binaria;
+    - insieme delle offerte attive, ricalcolato solo quando cambia la data.
+    
+    Le offerte 'ongoing' (o con una data non interpretabile) sono sempre attive. Le liste
+    restituite mantengono l'ordine dei file della knowledge base e non vanno modificate.
+    """
+    
+    def __init__(self, products: List[Dict[str, Any]], offers: List[Dict[str, Any]]):
+        self.products_by_id: Dict[str, Dict[str, Any]] = {}
+        self.products_by_type: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for product in products:
+            # Con ID ripetuti vale il primo prodotto, come nella ricerca lineare
+            self.products_by_id.setdefault(product.get('id'), product)
+            self.products_by_type[product.get('type')].append(product)
+            
+        self.offers = list(offers)
+        self._ongoing: List[int] = []
+        dated = []
+        for position, offer in enumerate(self.offers):
+            valid_until = offer.get('valid_until', 'ongoing')
+            if valid_until == 'ongoing':
+                self._ongoing.append(position)
+                continue
+            try:
+                dated.append((datetime.date.fromisoformat(valid_until), position))
+            except (TypeError, ValueError):
+                logger.warning(f"Data di scadenza non valida per l'offerta {offer.get('id')}: {valid_until}, considerata sempre attiva")
+                self._ongoing.append(position)
+        dated.sort()
+        self._expiry_dates = [expiry for expiry, _ in dated]
+        self._expiry_positions = [position for _, position in dated]
+        
+        self._active_date: Optional[datetime.date] = None
+        self._active_offers: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        
+    def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """Prodotto con l'ID indicato, o None"""
+        return self.products_by_id.get(product_id)
+        
+    def get_products_by_type(self, product_type: str) -> List[Dict[str, Any]]:
+        """Prodotti di un tipo (es. 'electricity')"""
+        return self.products_by_type.get(product_type, [])
+        
+    def active_offers(self, today: Optional[datetime.date] = None) -> List[Dict[str, Any]]:
+        """
+        Offerte valide alla data indicata (default: oggi), con scadenza inclusa
+        
+        Per la data corrente il risultato viene ricalcolato solo al primo utilizzo dopo il cambio di data.
+        """
+        current = datetime.date.today()
+        today = today or current
+        if today != current:
+            return self._compute_active(today)
+            
+        with self._lock:
+            if self._active_date != today:
+                self._active_offers = self._compute_active(today)
+                self._active_date = today
+            return self._active_offers
+            
+    def _compute_active(self, today: datetime.date) -> List[Dict[str, Any]]:
+        start = bisect.bisect_left(self._expiry_dates, today)
+        positions = sorted(self._ongoing + self._expiry_positions[start:])
+        return [self.offers[position] for position in positions]
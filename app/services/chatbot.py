@@ -4,13 +4,11 @@ Chatbot per EnergyWise - Integrazione con Strands Agents e RAG
 import os
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Callable, Optional
 from dotenv import load_dotenv
-import boto3
-from botocore.config import Config
 from strands import Agent, tool
-from strands.models import BedrockModel
 
+from .bedrock_client import create_bedrock_model
 from .rag_system import RAGSystem
 from .strands_agent import analyze_bill
 
@@ -28,21 +26,23 @@ model_id = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-7-sonnet-20250219-v
 class EnergyWiseChatbot:
     """Chatbot per EnergyWise"""
     
-    def __init__(self):
-        """Inizializza il chatbot"""
+    def __init__(self, progress: Optional[Callable[..., None]] = None):
+        """
+        Inizializza il chatbot
+        
+        Args:
+            progress: Callback opzionale progress(stage, **details), inoltrata al sistema RAG
+        """
         try:
             # Inizializza il sistema RAG
-            self.rag_system = RAGSystem()
+            self.rag_system = RAGSystem(progress=progress)
             
             # Inizializza il modello Bedrock
-            self.bedrock_model = BedrockModel(
-                model_id=model_id,
-                region_name=region,
-                temperature=0.3,
-                timeout=120
-            )
+            self.bedrock_model = create_bedrock_model(model_id, temperature=0.3)
             
             # Inizializza l'agente con i tool
+            if progress:
+                progress('chatbot_agent')
             self.agent = self._create_agent()
             
             # Stato della conversazione
@@ -50,12 +50,9 @@ class EnergyWiseChatbot:
             
             logger.info("Chatbot inizializzato con successo")
         except Exception as e:
+            # L'errore arriva al BackgroundInitializer, che segnala lo stato 'failed' e riprova con backoff
             logger.error(f"Errore durante l'inizializzazione del chatbot: {e}")
-            # Fallback a un chatbot semplice senza RAG
-            self.rag_system = None
-            self.bedrock_model = None
-            self.agent = None
-            self.conversation_state = {}
+            raise
         
     def _create_agent(self) -> Agent:
         """Crea l'agente con i tool necessari"""
@@ -0,0 +1,102 @@
+"""
+Suddivisione dei documenti della knowledge base in chunk per l'embedding
+"""
+import os
+import re
+import logging
+from typing import List
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione del chunking (in caratteri)
+RAG_CHUNK_SIZE = int(os.getenv('RAG_CHUNK_SIZE', '800'))
+RAG_CHUNK_OVERLAP = int(os.getenv('RAG_CHUNK_OVERLAP', '150'))
+
+def split_unit(text: str, size: int) -> List[str]:
+    """
+    Divide una sezione più lunga di size, preferendo nell'ordine a capo, fine frase e spazi
+    
+    Le parti restituite sono le più piccole prodotte dal primo separatore utile (es. una riga
+    per ogni caratteristica): è chunk_sections a ricomporle, così anche la sovrapposizione tra
+    chunk può ripetere righe intere.
+    
+    Args:
+        text: Testo della sezione
+        size: Lunghezza massima di ogni parte
+        
+    Returns:
+        list: Parti della sezione, ognuna lunga al più size caratteri
+    """
+    text = text.strip()
+    if len(text) <= size:
+        return [text] if text else []
+        
+    for pattern in (r'\n', r'(?<=[.!?;])\s+', r'\s+'):
+        pieces = [piece for piece in re.split(pattern, text) if piece.strip()]
+        if len(pieces) > 1:
+            break
+    else:
+        # Nessun separatore utilizzabile: taglio netto
+        return [text[i:i + size] for i in range(0, len(text), size)]
+        
+    parts = []
+    for piece in pieces:
+        parts.extend(split_unit(piece, size))
+    return parts
+
+def chunk_sections(sections: List[str], title: str = '', size: int = None, overlap: int = None) -> List[str]:
+    """
+    Raggruppa le sezioni di un documento in chunk di dimensione limitata
+    
+    Le sezioni (una FAQ, l'elenco delle caratteristiche, il blocco prezzi, ...) non vengono
+    spezzate se entrano in un chunk; tra chunk consecutivi si ripetono le ultime sezioni intere
+    che stanno in overlap caratteri. Ogni chunk inizia con il titolo del documento, così resta
+    riconoscibile anche da solo.
+    
+    Args:
+        sections: Sezioni del documento, nell'ordine
+        title: Riga di intestazione ripetuta in ogni chunk
+        size: Lunghezza massima di un chunk (default: RAG_CHUNK_SIZE)
+        overlap: Sovrapposizione massima tra chunk consecutivi (default: RAG_CHUNK_OVERLAP)
+        
+    Returns:
+        list: Testi dei chunk
+    """
+    size = size or RAG_CHUNK_SIZE
+    overlap = RAG_CHUNK_OVERLAP if overlap is None else overlap
+    budget = max(1, size - (len(title) + 1 if title else 0))
+    
+    units = []
+    for section in sections:
+        units.extend(split_unit(section, budget))
+        
+    chunks = []
+    current: List[str] = []
+    length = 0
+    for unit in units:
+        if current and length + len(unit) + 1 > budget:
+            chunks.append(current)
+            # Sovrapposizione: le ultime sezioni intere del chunk precedente
+            carry: List[str] = []
+            carry_length = 0
+            for previous in reversed(current):
+                if carry_length + len(previous) + 1 > overlap:
+                    break
+                carry.insert(0, previous)
+                carry_length += len(previous) + 1
+            while carry and carry_length + len(unit) + 1 > budget:
+                carry_length -= len(carry.pop(0)) + 1
+            current, length = carry, carry_length
+        current.append(unit)
+        length += len(unit) + 1
+    if current:
+        chunks.append(current)
+        
+    prefix = f"{title}\n" if title else ''
+    return [prefix + '\n'.join(chunk) for chunk in chunks]
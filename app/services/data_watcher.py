@@ -0,0 +1,88 @@
+"""
+Sorveglianza dei file JSON della knowledge base per il ricaricamento a caldo
+"""
+import os
+import logging
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class DataDirectoryWatcher:
+    """
+    Controlla periodicamente i file .json di una directory e chiama on_change quando cambiano
+    
+    Il confronto usa data di modifica e dimensione dei file (nessuna lettura del contenuto), quindi
+    un controllo costa poche chiamate a stat. Un cambiamento viene segnalato solo quando la firma è
+    rimasta uguale per due controlli consecutivi, per non ricaricare file ancora in scrittura.
+    Le sottodirectory (es. l'archivio degli embedding) vengono ignorate.
+    """
+    
+    def __init__(self, directory: str, on_change: Callable[[], None], interval: float):
+        """
+        Inizializza il watcher
+        
+        Args:
+            directory: Directory dei file della knowledge base
+            on_change: Funzione chiamata (nel thread del watcher) quando i file cambiano
+            interval: Secondi tra due controlli
+        """
+        self.directory = directory
+        self.on_change = on_change
+        self.interval = interval
+        self._signature = self.signature()
+        self._pending: Optional[Dict[str, Tuple[int, int]]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        
+    def signature(self) -> Dict[str, Tuple[int, int]]:
+        """Firma della directory: (mtime in ns, dimensione) di ogni file .json"""
+        signature = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return signature
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            signature[name] = (stat.st_mtime_ns, stat.st_size)
+        return signature
+        
+    def check(self) -> bool:
+        """Esegue un controllo; restituisce True se ha chiamato on_change"""
+        signature = self.signature()
+        if signature == self._signature:
+            self._pending = None
+            return False
+        if signature != self._pending:
+            # Prima osservazione del cambiamento: si attende che i file smettano di cambiare
+            self._pending = signature
+            return False
+        self._signature = signature
+        self._pending = None
+        logger.info(f"Rilevate modifiche ai file della knowledge base in {self.directory}")
+        self.on_change()
+        return True
+        
+    def start(self) -> None:
+        """Avvia i controlli periodici in un thread daemon"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='knowledge-base-watcher', daemon=True)
+        self._thread.start()
+        
+    def stop(self) -> None:
+        self._stop.set()
+        
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Errore durante il ricaricamento della knowledge base: {e}")
@@ -1,20 +1,79 @@
 import os
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
+import hashlib
+import subprocess
 import tempfile
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
 import logging
+import threading
+import time
+import atexit
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from dotenv import load_dotenv
+
+from .cache import DiskLRUCache, hash_file
+from .ocr_backends import PytesseractBackend, get_ocr_backend, warm_ocr_worker
+from .ocr_preprocessing import OCR_PREPROCESS, OCR_PROBE_DPI, choose_dpi, preprocess_image
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def process_document(file_path):
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione OCR
+OCR_DPI = int(os.getenv('OCR_DPI', '300'))
+OCR_PARALLEL = os.getenv('OCR_PARALLEL', 'true').lower() in ('1', 'true', 'yes')
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', str(os.cpu_count() or 1)))
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', '120'))  # Budget in secondi per documento
+OCR_PAGE_WINDOW = int(os.getenv('OCR_PAGE_WINDOW', '1'))  # Pagine rasterizzate insieme in modalità sequenziale
+OCR_TEXT_LAYER = os.getenv('OCR_TEXT_LAYER', 'true').lower() in ('1', 'true', 'yes')
+TEXT_LAYER_MIN_CHARS = int(os.getenv('TEXT_LAYER_MIN_CHARS', '50'))  # Caratteri minimi per considerare utilizzabile una pagina
+TEXT_LAYER_TIMEOUT = 30  # Secondi
+OCR_LANG = os.getenv('OCR_LANG', 'spa+eng')  # Specifica combinata di tesseract
+OCR_LANG_MODE = os.getenv('OCR_LANG_MODE', 'detect')  # 'detect', 'combined' oppure 'cascade' (spa -> eng -> predefinita)
+
+# Configurazione della cache OCR su disco
+OCR_CACHE_ENABLED = os.getenv('OCR_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+OCR_CACHE_DIR = os.getenv('OCR_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'energywise_ocr_cache'))
+OCR_CACHE_MAX_MB = int(os.getenv('OCR_CACHE_MAX_MB', '256'))
+
+# Pool di processi per l'OCR parallelo, unico per il processo (OCR_WORKERS worker), creato su
+# richiesta e riutilizzato tra i documenti; ogni documento limita solo le pagine che vi sottomette
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+def _get_ocr_pool():
+    """Restituisce (creandolo se necessario) il pool di processi OCR con OCR_WORKERS worker"""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            workers = max(1, OCR_WORKERS)
+            logger.info(f"Creazione del pool OCR con {workers} worker")
+            # Ogni worker crea il backend OCR e precarica la lingua una sola volta, all'avvio
+            _ocr_pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_ocr_worker, initargs=(OCR_LANG,))
+        return _ocr_pool
+
+@atexit.register
+def shutdown_ocr_pools():
+    """Chiude il pool di processi OCR"""
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(wait=False, cancel_futures=True)
+            _ocr_pool = None
+
+def process_document(file_path, on_page=None, report=None):
     """
     Processa un documento (immagine o PDF) ed estrae il testo
     
     Args:
         file_path: Percorso del file da processare
+        on_page: Callback opzionale chiamata con il dizionario di ogni pagina appena estratta
+                 (vedi iter_pdf_pages); con un risultato dalla cache riceve source='cache'
+        report: Dizionario opzionale in cui registrare la lingua del documento ('lang', codice
+                tesseract o None con la cascata spa/eng) e, per i PDF, l'origine del testo per pagina
         
     Returns:
         str: Testo estratto dal documento
@@ -25,20 +84,160 @@ def process_document(file_path):
     
     file_extension = os.path.splitext(file_path)[1].lower()
     
-    if file_extension in ['.jpg', '.jpeg', '.png']:
-        return process_image(file_path)
-    elif file_extension == '.pdf':
-        return process_pdf(file_path)
-    else:
+    if file_extension not in ['.jpg', '.jpeg', '.png', '.pdf']:
         logger.error(f"Formato file non supportato: {file_extension}")
         return ""
+        
+    cache_key = None
+    if OCR_CACHE_ENABLED:
+        try:
+            cache_key = _ocr_cache_key(file_path)
+            cached_text = _get_ocr_cache().get(cache_key)
+            if cached_text is not None:
+                logger.info(f"Testo trovato nella cache OCR: {file_path}")
+                # La cache conserva solo il testo: la lingua si ricava di nuovo da quello, senza OCR
+                lang = detect_language(cached_text) if OCR_LANG_MODE == 'detect' else _initial_language()
+                if report is not None:
+                    report.update({'lang': lang, 'complete': True})
+                if on_page:
+                    on_page({'page': None, 'text': cached_text, 'source': 'cache', 'lang': lang})
+                return cached_text
+        except OSError as e:
+            logger.warning(f"Cache OCR non disponibile: {e}")
+            cache_key = None
+            
+    if report is None:
+        report = {}
+    report['complete'] = True
+    if file_extension == '.pdf':
+        text = process_pdf(file_path, report=report, on_page=on_page)
+    else:
+        text = process_image(file_path, report=report)
+        if on_page:
+            on_page({'page': 1, 'text': text, 'source': 'ocr', 'lang': report.get('lang')})
+        
+    # Non memorizza risultati vuoti o incompleti (budget di tempo esaurito), così un nuovo upload li riprova
+    if cache_key and report.get('complete') and text and len(text.strip()) >= 10:
+        _get_ocr_cache().set(cache_key, text)
+        
+    return text
+
+def _ocr_settings():
+    """Impostazioni che influenzano il testo estratto e fanno quindi parte della chiave di cache"""
+    return f"dpi={OCR_DPI};lang={OCR_LANG};lang_mode={OCR_LANG_MODE};text_layer={OCR_TEXT_LAYER};preprocess={OCR_PREPROCESS};engine={get_ocr_backend().name}"
+
+def _ocr_cache_key(file_path):
+    """Chiave della cache OCR: SHA-256 del contenuto del file più le impostazioni OCR"""
+    settings_hash = hashlib.sha256(_ocr_settings().encode('utf-8')).hexdigest()[:16]
+    return f"{hash_file(file_path)}-{settings_hash}"
+
+_ocr_cache = None
+_ocr_cache_lock = threading.Lock()
+
+def _get_ocr_cache():
+    """Restituisce (creandola se necessario) la cache OCR su disco"""
+    global _ocr_cache
+    with _ocr_cache_lock:
+        if _ocr_cache is None:
+            _ocr_cache = DiskLRUCache(OCR_CACHE_DIR, OCR_CACHE_MAX_MB * 1024 * 1024)
+        return _ocr_cache
+
+# Parole frequenti usate per riconoscere la lingua del testo estratto
+LANGUAGE_STOPWORDS = {
+    'spa': {'de', 'la', 'el', 'los', 'las', 'del', 'y', 'en', 'por', 'con', 'para', 'factura', 'importe', 'periodo', 'potencia', 'consumo'},
+    'eng': {'the', 'of', 'and', 'to', 'in', 'for', 'with', 'your', 'is', 'on', 'bill', 'amount', 'total', 'period', 'due'},
+    'ita': {'il', 'di', 'che', 'e', 'per', 'con', 'della', 'delle', 'gli', 'sono', 'bolletta', 'importo', 'consumi', 'fornitura'},
+}
+
+def detect_language(text):
+    """
+    Sceglie la lingua di tesseract più adatta al testo, tra quelle configurate in OCR_LANG
+    
+    Args:
+        text: Testo già estratto (livello di testo nativo o prima pagina OCR)
+        
+    Returns:
+        str: Codice lingua tesseract (es. 'spa'), oppure OCR_LANG se la lingua non è chiara
+    """
+    candidates = [lang for lang in OCR_LANG.split('+') if lang in LANGUAGE_STOPWORDS]
+    words = [word.strip('.,;:()[]"\'').lower() for word in text.split()]
+    scores = {lang: sum(1 for word in words if word in LANGUAGE_STOPWORDS[lang]) for lang in candidates}
+    if not scores:
+        return OCR_LANG
+        
+    ranking = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    best_lang, best_score = ranking[0]
+    runner_up = ranking[1][1] if len(ranking) > 1 else 0
+    # Serve un margine netto, altrimenti si mantiene la specifica combinata
+    if best_score < 5 or best_score < 2 * runner_up:
+        return OCR_LANG
+    return best_lang
+
+def _initial_language(hint_text=""):
+    """Lingua di partenza per un documento in base a OCR_LANG_MODE (None = da rilevare sulla prima pagina)"""
+    if OCR_LANG_MODE == 'cascade':
+        return None
+    if OCR_LANG_MODE == 'detect' and hint_text:
+        return detect_language(hint_text)
+    if OCR_LANG_MODE == 'detect':
+        return None
+    return OCR_LANG
+
+def _ocr_image_cascade(image, label):
+    """Esegue l'OCR provando spa, eng e infine la lingua predefinita (comportamento storico)"""
+    backend = get_ocr_backend()
+    languages = ['spa', 'eng']
+    text = ""
+    
+    for lang in languages:
+        try:
+            logger.info(f"Tentativo di OCR su {label} con lingua: {lang}")
+            text = backend.image_to_string(image, lang=lang)
+            if text and len(text.strip()) > 10:
+                logger.info(f"OCR riuscito su {label} con lingua: {lang}")
+                break
+        except Exception as e:
+            logger.warning(f"OCR fallito su {label} con lingua {lang}: {e}")
+            
+    if not text or len(text.strip()) < 10:
+        # Se tutte le lingue falliscono, prova senza specificare la lingua
+        logger.warning(f"Tentativo di OCR su {label} senza specificare la lingua")
+        text = backend.image_to_string(image)
+        
+    return text
 
-def process_image(image_path):
+def _ocr_image(image, label="immagine", lang=None):
+    """
+    Esegue l'OCR su un'immagine con un solo passaggio di tesseract
+    
+    Args:
+        image: Immagine PIL già convertita in scala di grigi
+        label: Descrizione dell'immagine usata nei log
+        lang: Lingua tesseract (default: OCR_LANG, oppure la cascata storica se OCR_LANG_MODE='cascade')
+        
+    Returns:
+        str: Testo estratto
+    """
+    if lang is None and OCR_LANG_MODE == 'cascade':
+        return _ocr_image_cascade(image, label)
+        
+    lang = lang or OCR_LANG
+    backend = get_ocr_backend()
+    try:
+        logger.info(f"OCR su {label} con lingua: {lang} ({backend.name})")
+        return backend.image_to_string(image, lang=lang)
+    except Exception as e:
+        # Tipicamente un pacchetto lingua non installato: un solo tentativo con pytesseract e la lingua predefinita
+        logger.warning(f"OCR fallito su {label} con lingua {lang} ({backend.name}): {e}")
+        return PytesseractBackend().image_to_string(image)
+
+def process_image(image_path, report=None):
     """
     Estrae il testo da un'immagine usando OCR
     
     Args:
         image_path: Percorso dell'immagine
+        report: Dizionario opzionale in cui registrare la lingua del testo ('lang')
         
     Returns:
         str: Testo estratto dall'immagine
@@ -48,27 +247,20 @@ def process_image(image_path):
         image = Image.open(image_path)
         
         # Migliora la qualità dell'immagine per OCR
-        # Converti in scala di grigi
-        image = image.convert('L')
-        
-        # Prova con diverse lingue in ordine di priorità
-        languages = ['spa', 'eng']
-        text = ""
-        
-        for lang in languages:
-            try:
-                logger.info(f"Tentativo di OCR con lingua: {lang}")
-                text = pytesseract.image_to_string(image, lang=lang)
-                if text and len(text.strip()) > 10:
-                    logger.info(f"OCR riuscito con lingua: {lang}")
-                    break
-            except Exception as e:
-                logger.warning(f"OCR fallito con lingua {lang}: {e}")
+        if OCR_PREPROCESS:
+            # Raddrizza, binarizza e riporta il testo a un'altezza di riga ottimale
+            image = preprocess_image(image)
+        else:
+            # Converti in scala di grigi
+            image = image.convert('L')
         
-        if not text or len(text.strip()) < 10:
-            # Se tutte le lingue falliscono, prova senza specificare la lingua
-            logger.warning("Tentativo di OCR senza specificare la lingua")
-            text = pytesseract.image_to_string(image)
+        lang = _initial_language()
+        text = _ocr_image(image, "immagine", lang)
+        if OCR_LANG_MODE == 'detect':
+            lang = detect_language(text)
+            logger.info(f"Lingua rilevata nell'immagine: {lang}")
+        if report is not None:
+            report['lang'] = lang
         
         if not text or len(text.strip()) < 10:
             logger.warning(f"Poco o nessun testo estratto dall'immagine: {image_path}")
@@ -80,60 +272,294 @@ def process_image(image_path):
         logger.error(f"Errore durante l'elaborazione dell'immagine: {e}")
         return ""
 
-def process_pdf(pdf_path):
+def _ocr_pdf_page(pdf_path, page_number, dpi=None, lang=None):
+    """
+    Rasterizza una singola pagina del PDF ed esegue l'OCR (eseguita anche nei worker del pool)
+    
+    Args:
+        pdf_path: Percorso del file PDF
+        page_number: Numero della pagina (a partire da 1)
+        dpi: Risoluzione di rasterizzazione (default: scelta con una rasterizzazione di prova
+             se OCR_PREPROCESS è attivo, altrimenti OCR_DPI)
+        lang: Lingua tesseract (vedi _ocr_image)
+        
+    Returns:
+        str: Testo estratto dalla pagina
+    """
+    if dpi is None:
+        dpi = _probe_page_dpi(pdf_path, page_number) if OCR_PREPROCESS else OCR_DPI
+        
+    images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number)
+    if not images:
+        return ""
+        
+    image = images.pop()
+    try:
+        return _ocr_image(_prepare_page(image), f"pagina {page_number}", lang)
+    finally:
+        image.close()
+
+def _probe_page_dpi(pdf_path, page_number):
+    """Sceglie i DPI di una pagina da una rasterizzazione di prova a bassa risoluzione"""
+    try:
+        probe = convert_from_path(pdf_path, dpi=OCR_PROBE_DPI, first_page=page_number, last_page=page_number, grayscale=True)
+        dpi = choose_dpi(probe[0], OCR_PROBE_DPI) if probe else None
+    except Exception as e:
+        logger.warning(f"Rasterizzazione di prova fallita sulla pagina {page_number}: {e}")
+        dpi = None
+    dpi = dpi or OCR_DPI
+    logger.info(f"DPI scelti per la pagina {page_number}: {dpi}")
+    return dpi
+
+def _prepare_page(image):
+    """Prepara una pagina rasterizzata per l'OCR (i DPI sono già stati scelti, quindi niente ridimensionamento)"""
+    if OCR_PREPROCESS:
+        return preprocess_image(image, rescale=False)
+    # Converti in scala di grigi per migliorare OCR
+    return image.convert('L')
+
+def _extract_text_layer(pdf_path):
+    """
+    Estrae il livello di testo nativo del PDF con pdftotext (Poppler), una voce per pagina
+    
+    Args:
+        pdf_path: Percorso del file PDF
+        
+    Returns:
+        list: Testo di ogni pagina, oppure None se pdftotext non è disponibile o fallisce
+    """
+    try:
+        result = subprocess.run(
+            ['pdftotext', '-layout', '-enc', 'UTF-8', pdf_path, '-'],
+            capture_output=True,
+            timeout=TEXT_LAYER_TIMEOUT,
+            check=True
+        )
+    except FileNotFoundError:
+        logger.warning("pdftotext non disponibile, uso solo OCR")
+        return None
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Estrazione del livello di testo fallita: {e}")
+        return None
+        
+    # pdftotext separa le pagine con un form feed
+    return result.stdout.decode('utf-8', errors='replace').split('\f')
+
+def _has_usable_text(text):
+    """Verifica se il testo nativo di una pagina è sufficiente per evitare l'OCR"""
+    stripped = "".join(text.split())
+    if len(stripped) < TEXT_LAYER_MIN_CHARS:
+        return False
+    # Un livello di testo corrotto (font senza mappatura Unicode) produce pochi caratteri alfanumerici
+    alnum = sum(1 for char in stripped if char.isalnum())
+    return alnum / len(stripped) >= 0.5
+
+def _page_windows(page_numbers, window):
+    """Raggruppa le pagine in finestre di pagine consecutive lunghe al massimo window"""
+    windows = []
+    for page_number in page_numbers:
+        if windows and page_number == windows[-1][-1] + 1 and len(windows[-1]) < window:
+            windows[-1].append(page_number)
+        else:
+            windows.append([page_number])
+    return windows
+
+def _iter_pages_sequential(pdf_path, page_numbers, window, deadline, lang):
+    """Rasterizza una finestra di pagine alla volta, ne esegue l'OCR e la libera prima della successiva"""
+    detect = lang is None and OCR_LANG_MODE == 'detect'
+    windows = _page_windows(page_numbers, window)
+    for index, pages in enumerate(windows):
+        if time.monotonic() > deadline:
+            missing = [page_number for pages in windows[index:] for page_number in pages]
+            logger.warning(f"Budget di tempo esaurito: pagine {missing} non elaborate")
+            for page_number in missing:
+                yield page_number, None, lang
+            return
+
+        if OCR_PREPROCESS:
+            # I DPI vengono scelti pagina per pagina, quindi si rasterizza una pagina alla volta
+            images = None
+        else:
+            images = convert_from_path(pdf_path, dpi=OCR_DPI, first_page=pages[0], last_page=pages[-1])
+        
+        for page_number in pages:
+            if images is None:
+                page_text = _ocr_pdf_page(pdf_path, page_number, lang=lang)
+            elif images:
+                image = images.pop(0)
+                page_text = _ocr_image(_prepare_page(image), f"pagina {page_number}", lang)
+                image.close()
+            else:
+                page_text = ""
+            if detect:
+                # La lingua scelta sulla prima pagina viene riutilizzata per tutte le successive
+                lang = detect_language(page_text)
+                detect = False
+                logger.info(f"Lingua del documento rilevata: {lang}")
+            yield page_number, page_text, lang
+
+def _iter_pages_parallel(pdf_path, page_numbers, max_workers, deadline, lang):
+    """
+    Distribuisce rasterizzazione e OCR delle pagine sul pool di processi e restituisce i testi in ordine
+    
+    Il documento tiene al più max_workers pagine nel pool condiviso: la pagina successiva viene
+    sottomessa solo quando la più vecchia è stata restituita, così documenti concorrenti si
+    dividono i worker invece di accodare tutte le loro pagine.
+    """
+    pool = _get_ocr_pool()
+    futures = []
+    
+    def submit(index):
+        if index < len(page_numbers):
+            futures.append(pool.submit(_ocr_pdf_page, pdf_path, page_numbers[index], None, lang))
+    
+    try:
+        if lang is None and OCR_LANG_MODE == 'detect':
+            # La lingua va scelta sulla prima pagina prima di distribuire le altre
+            lang = OCR_LANG
+            submit(0)
+            try:
+                first_text = futures[0].result(timeout=max(0.0, deadline - time.monotonic()))
+                lang = detect_language(first_text)
+                logger.info(f"Lingua del documento rilevata: {lang}")
+            except Exception:
+                # Errori e budget esaurito vengono gestiti nel ciclo sotto
+                pass
+        while len(futures) < min(max_workers, len(page_numbers)):
+            submit(len(futures))
+        
+        for index, page_number in enumerate(page_numbers):
+            try:
+                page_text = futures[index].result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                missing = page_numbers[index:]
+                logger.warning(f"Budget di tempo esaurito: pagine {missing} non elaborate")
+                for missing_page in missing:
+                    yield missing_page, None, lang
+                return
+            except Exception as e:
+                logger.warning(f"OCR fallito sulla pagina {page_number}: {e}")
+                page_text = ""
+            submit(len(futures))
+            yield page_number, page_text, lang
+    finally:
+        # Le pagine ancora in coda vengono annullate; quelle già in esecuzione in un worker non si
+        # possono interrompere e occupano il loro worker fino alla fine (al più max_workers pagine)
+        for future in futures:
+            future.cancel()
+        
+def iter_pdf_pages(pdf_path, max_workers=None, timeout=None, window=None, use_text_layer=None):
+    """
+    Estrae il testo di un PDF pagina per pagina, senza materializzare tutte le immagini in memoria
+    
+    Le pagine con un livello di testo nativo utilizzabile vengono lette direttamente con pdftotext;
+    solo le altre vengono rasterizzate e passate all'OCR. Il testo della prima pagina è disponibile
+    prima che l'ultima pagina sia rasterizzata.
+    
+    Args:
+        pdf_path: Percorso del file PDF
+        max_workers: Numero di processi per l'OCR parallelo (default: OCR_WORKERS, 1 = sequenziale)
+        timeout: Budget in secondi per l'intero documento (default: OCR_TIMEOUT)
+        window: Pagine rasterizzate insieme in modalità sequenziale (default: OCR_PAGE_WINDOW)
+        use_text_layer: Usa il livello di testo nativo quando presente (default: OCR_TEXT_LAYER)
+        
+    Yields:
+        dict: {'page': numero pagina, 'text': testo estratto, 'source': 'text_layer', 'ocr' o 'skipped',
+               'lang': lingua tesseract scelta per il documento}
+    """
+    if max_workers is None:
+        max_workers = OCR_WORKERS if OCR_PARALLEL else 1
+    if timeout is None:
+        timeout = OCR_TIMEOUT
+    if window is None:
+        window = OCR_PAGE_WINDOW
+    if use_text_layer is None:
+        use_text_layer = OCR_TEXT_LAYER
+    deadline = time.monotonic() + timeout
+    
+    page_count = pdfinfo_from_path(pdf_path).get('Pages', 0)
+    logger.info(f"Il PDF contiene {page_count} pagine")
+    if not page_count:
+        return
+        
+    text_layer = _extract_text_layer(pdf_path) if use_text_layer else None
+    native_pages = {}
+    if text_layer:
+        for page_number, page_text in enumerate(text_layer[:page_count], start=1):
+            if _has_usable_text(page_text):
+                native_pages[page_number] = page_text
+    ocr_pages = [page_number for page_number in range(1, page_count + 1) if page_number not in native_pages]
+    logger.info(f"Pagine con livello di testo: {sorted(native_pages)}, pagine da OCR: {ocr_pages}")
+    
+    # Se il documento ha già del testo nativo, la lingua si ricava da quello senza costi OCR
+    lang = _initial_language("\n".join(native_pages.values()))
+    
+    workers = min(max_workers, len(ocr_pages))
+    if workers > 1:
+        logger.info(f"OCR parallelo con {workers} worker")
+        ocr_results = _iter_pages_parallel(pdf_path, ocr_pages, workers, deadline, lang)
+    else:
+        ocr_results = _iter_pages_sequential(pdf_path, ocr_pages, max(1, window), deadline, lang)
+        
+    try:
+        for page_number in range(1, page_count + 1):
+            if page_number in native_pages:
+                yield {'page': page_number, 'text': native_pages[page_number], 'source': 'text_layer', 'lang': lang}
+            else:
+                # Le pagine OCR arrivano in ordine crescente
+                _, page_text, lang = next(ocr_results)
+                if page_text is None:
+                    # Pagina saltata per budget di tempo esaurito
+                    yield {'page': page_number, 'text': "", 'source': 'skipped', 'lang': lang}
+                else:
+                    yield {'page': page_number, 'text': page_text, 'source': 'ocr', 'lang': lang}
+    finally:
+        ocr_results.close()
+
+def process_pdf(pdf_path, max_workers=None, timeout=None, report=None, on_page=None):
     """
-    Converte un PDF in immagini ed estrae il testo usando OCR
+    Estrae il testo da un PDF usando il livello di testo nativo o, dove manca, l'OCR
     
     Args:
         pdf_path: Percorso del file PDF
+        max_workers: Numero di processi per l'OCR parallelo (default: OCR_WORKERS, 1 = sequenziale)
+        timeout: Budget in secondi per l'intero documento (default: OCR_TIMEOUT)
+        report: Dizionario opzionale in cui registrare origine del testo per pagina, lingua e completezza
+        on_page: Callback opzionale chiamata con il dizionario di ogni pagina appena estratta
         
     Returns:
         str: Testo estratto dal PDF
     """
     try:
         logger.info(f"Elaborazione PDF: {pdf_path}")
-        with tempfile.TemporaryDirectory() as path:
-            # Converti PDF in immagini
-            images = convert_from_path(pdf_path, output_folder=path, dpi=300)
             
-            if not images:
-                logger.warning(f"Nessuna immagine estratta dal PDF: {pdf_path}")
-                return ""
-            
-            logger.info(f"Estratte {len(images)} pagine dal PDF")
-            
-            text = ""
-            # Prova con diverse lingue in ordine di priorità
-            languages = ['spa', 'eng']
+        text = ""
+        sources = {}
+        lang = None
+        for page in iter_pdf_pages(pdf_path, max_workers=max_workers, timeout=timeout):
+            text += f"--- PAGINA {page['page']} ---\n{page['text']}\n\n"
+            sources[page['page']] = page['source']
+            lang = page['lang']
+            if on_page:
+                on_page(page)
             
-            for i, image in enumerate(images):
-                # Converti in scala di grigi per migliorare OCR
-                image = image.convert('L')
-                
-                page_text = ""
-                for lang in languages:
-                    try:
-                        logger.info(f"Tentativo di OCR sulla pagina {i+1} con lingua: {lang}")
-                        page_text = pytesseract.image_to_string(image, lang=lang)
-                        if page_text and len(page_text.strip()) > 10:
-                            logger.info(f"OCR riuscito sulla pagina {i+1} con lingua: {lang}")
-                            break
-                    except Exception as e:
-                        logger.warning(f"OCR fallito sulla pagina {i+1} con lingua {lang}: {e}")
-                
-                if not page_text or len(page_text.strip()) < 10:
-                    # Se tutte le lingue falliscono, prova senza specificare la lingua
-                    logger.warning(f"Tentativo di OCR sulla pagina {i+1} senza specificare la lingua")
-                    page_text = pytesseract.image_to_string(image)
-                
-                text += f"--- PAGINA {i+1} ---\n{page_text}\n\n"
+        if not text:
+            logger.warning(f"Nessuna immagine estratta dal PDF: {pdf_path}")
+            return ""
             
-            if not text or len(text.strip()) < 10:
-                logger.warning(f"Poco o nessun testo estratto dal PDF: {pdf_path}")
-            else:
-                logger.info(f"Testo estratto con successo dal PDF: {len(text)} caratteri")
+        logger.info(f"Origine del testo per pagina: {sources}, lingua: {lang or 'cascata spa/eng'}")
+        if report is not None:
+            report.update({
+                'sources': sources,
+                'lang': lang,
+                'complete': 'skipped' not in sources.values()
+            })
+        if len(text.strip()) < 10:
+            logger.warning(f"Poco o nessun testo estratto dal PDF: {pdf_path}")
+        else:
+            logger.info(f"Testo estratto con successo dal PDF: {len(text)} caratteri")
             
-            return text
+        return text
     except Exception as e:
         logger.error(f"Errore durante l'elaborazione del PDF: {e}")
         return ""
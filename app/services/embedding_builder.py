@@ -0,0 +1,176 @@
+"""
+Costruzione concorrente degli embedding della knowledge base, con backoff e checkpoint
+"""
+import os
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import numpy as np
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+from .embedding_store import EmbeddingStore, hash_text
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione della costruzione degli embedding
+RAG_EMBED_WORKERS = int(os.getenv('RAG_EMBED_WORKERS', '8'))
+RAG_EMBED_MAX_RETRIES = int(os.getenv('RAG_EMBED_MAX_RETRIES', '5'))
+RAG_EMBED_CHECKPOINT_EVERY = int(os.getenv('RAG_EMBED_CHECKPOINT_EVERY', '100'))  # Embedding generati tra due checkpoint
+BACKOFF_BASE = 1.0  # Secondi
+BACKOFF_MAX = 30.0  # Secondi
+
+# Errori di Bedrock per cui ha senso riprovare dopo una pausa
+RETRYABLE_ERRORS = ('ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                    'ModelNotReadyException', 'InternalServerException')
+
+def is_retryable(error: Exception) -> bool:
+    """Indica se un errore di Bedrock è dovuto a limiti di frequenza o a indisponibilità temporanea"""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in RETRYABLE_ERRORS
+    return False
+
+class EmbeddingBuilder:
+    """
+    Genera gli embedding mancanti di un insieme di documenti
+    
+    I documenti già presenti nell'archivio con lo stesso hash del testo vengono riusati; gli altri
+    vengono inviati a un pool limitato di thread. Quando Bedrock segnala un limite di frequenza
+    tutti i worker si fermano per l'intervallo di backoff (esponenziale con jitter), non solo
+    quello che ha ricevuto l'errore.
+    
+    Ogni RAG_EMBED_CHECKPOINT_EVERY embedding generati l'archivio viene salvato con quelli
+    completati fino a quel momento: una costruzione interrotta riparte da lì.
+    """
+    
+    def __init__(self, embed_fn: Callable[[str], List[float]], store: EmbeddingStore,
+                 workers: int = None, max_retries: int = None, checkpoint_every: int = None):
+        """
+        Inizializza il builder
+        
+        Args:
+            embed_fn: Funzione che restituisce l'embedding di un testo e solleva un'eccezione in caso di errore
+            store: Archivio persistente degli embedding
+            workers: Richieste di embedding concorrenti (default: RAG_EMBED_WORKERS)
+            max_retries: Tentativi aggiuntivi dopo un errore temporaneo (default: RAG_EMBED_MAX_RETRIES)
+            checkpoint_every: Embedding generati tra due salvataggi (default: RAG_EMBED_CHECKPOINT_EVERY)
+        """
+        self.embed_fn = embed_fn
+        self.store = store
+        self.workers = workers or RAG_EMBED_WORKERS
+        self.max_retries = max_retries if max_retries is not None else RAG_EMBED_MAX_RETRIES
+        self.checkpoint_every = checkpoint_every or RAG_EMBED_CHECKPOINT_EVERY
+        self.metrics: Dict[str, Any] = {}
+        self._pause_until = 0.0
+        self._lock = threading.Lock()
+        
+    def _embed(self, text: str) -> np.ndarray:
+        """Genera un embedding, riprovando con backoff dopo gli errori temporanei"""
+        for attempt in range(self.max_retries + 1):
+            # Rispetta la pausa impostata da un worker che ha ricevuto un errore di throttling
+            with self._lock:
+                wait = self._pause_until - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                embedding = self.embed_fn(text)
+                if len(embedding) == 0:
+                    raise ValueError("Embedding vuoto")
+                return np.asarray(embedding, dtype=np.float32)
+            except Exception as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                with self._lock:
+                    self.metrics['throttled'] = self.metrics.get('throttled', 0) + 1
+                    self._pause_until = max(self._pause_until, time.monotonic() + delay)
+                logger.warning(f"Bedrock ha limitato le richieste di embedding, nuovo tentativo tra {delay:.1f}s")
+                
+    def build(self, documents: List[Dict[str, Any]],
+              on_progress: Optional[Callable[[int, int], None]] = None) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        Restituisce i documenti indicizzabili e la matrice dei loro embedding, riga per riga allineati
+        
+        I documenti il cui embedding non è stato generato vengono esclusi e contati in metrics['failed']
+        (RAGSystem li riprova con backoff); l'archivio viene riscritto solo se qualcosa è cambiato.
+        
+        Args:
+            documents: Documenti con il campo 'text' (e 'id', 'type' per il manifest)
+            on_progress: Callback opzionale on_progress(completati, totale), chiamata dopo ogni embedding
+            
+        Returns:
+            tuple: (documenti, matrice float32 (n_documenti, dimensione))
+        """
+        start = time.perf_counter()
+        saved_entries, saved_matrix = self.store.load()
+        saved_rows = {entry['hash']: row for row, entry in enumerate(saved_entries)}
+        hashes = [hash_text(doc['text']) for doc in documents]
+        
+        vectors: Dict[int, np.ndarray] = {}
+        pending = []
+        for i, text_hash in enumerate(hashes):
+            row = saved_rows.get(text_hash)
+            if row is not None:
+                vectors[i] = saved_matrix[row]
+            else:
+                pending.append(i)
+                
+        self.metrics = {'documents': len(documents), 'reused': len(vectors), 'generated': 0, 'failed': 0, 'throttled': 0}
+        if on_progress:
+            on_progress(len(vectors), len(documents))
+        if pending:
+            logger.info(f"Generazione di {len(pending)} embedding con {self.workers} richieste concorrenti")
+            since_checkpoint = 0
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='embedding') as pool:
+                futures = {pool.submit(self._embed, documents[i]['text']): i for i in pending}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        vectors[i] = future.result()
+                        self.metrics['generated'] += 1
+                        since_checkpoint += 1
+                    except Exception as e:
+                        self.metrics['failed'] += 1
+                        logger.error(f"Embedding non disponibile per {documents[i].get('id')}, documento escluso dalla ricerca: {e}")
+                    if on_progress:
+                        on_progress(len(vectors) + self.metrics['failed'], len(documents))
+                    if since_checkpoint >= self.checkpoint_every:
+                        self._save(documents, hashes, vectors)
+                        since_checkpoint = 0
+                        
+        elapsed = time.perf_counter() - start
+        self.metrics['seconds'] = round(elapsed, 3)
+        self.metrics['docs_per_second'] = round(self.metrics['generated'] / elapsed, 2) if elapsed > 0 else 0.0
+        logger.info(
+            f"Embedding: {self.metrics['reused']} riutilizzati, {self.metrics['generated']} generati, "
+            f"{self.metrics['failed']} falliti in {elapsed:.1f}s ({self.metrics['docs_per_second']} doc/s)"
+        )
+        
+        kept = sorted(vectors)
+        kept_documents = [documents[i] for i in kept]
+        if not kept:
+            return kept_documents, np.zeros((0, 0), dtype=np.float32)
+            
+        # Se l'archivio corrisponde già ai documenti si usa direttamente la matrice in memory-map
+        if self.metrics['generated'] == 0 and [hashes[i] for i in kept] == [entry['hash'] for entry in saved_entries]:
+            return kept_documents, saved_matrix
+            
+        return kept_documents, self._save(documents, hashes, vectors)
+        
+    def _save(self, documents: List[Dict[str, Any]], hashes: List[str], vectors: Dict[int, np.ndarray]) -> np.ndarray:
+        """Salva nell'archivio gli embedding disponibili, nell'ordine dei documenti"""
+        kept = sorted(vectors)
+        matrix = np.vstack([vectors[i] for i in kept]).astype(np.float32)
+        self.store.save(
+            [{'id': documents[i].get('id'), 'type': documents[i].get('type'), 'hash': hashes[i]} for i in kept],
+            matrix
+        )
+        return matrix
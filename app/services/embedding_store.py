@@ -0,0 +1,107 @@
+"""
+Archivio persistente degli embedding della knowledge base
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+
+def hash_text(text: str) -> str:
+    """Calcola lo SHA-256 del testo di un documento"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class EmbeddingStore:
+    """
+    Matrice float32 degli embedding su disco, con un manifest dei documenti
+    
+    Il manifest registra l'ID del modello di embedding, la dimensione dei vettori, il file .npy
+    della matrice e, per ogni riga, ID, tipo e hash del testo del documento. La matrice viene
+    aperta in memory-map, quindi l'avvio non legge i vettori finché non servono.
+    
+    Ogni salvataggio scrive una nuova matrice con nome derivato dal contenuto e poi sostituisce
+    il manifest in modo atomico: un processo che sta leggendo vede sempre una coppia coerente.
+    """
+    
+    def __init__(self, directory: str, model_id: str):
+        self.directory = directory
+        self.model_id = model_id
+        
+    def load(self) -> Tuple[List[Dict[str, str]], Optional[np.ndarray]]:
+        """
+        Carica manifest e matrice salvati
+        
+        Returns:
+            tuple: (voci del manifest, matrice in memory-map); ([], None) se l'archivio manca,
+                   è illeggibile o è stato creato con un altro modello di embedding
+        """
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('model_id') != self.model_id:
+                logger.info(f"Embedding salvati con il modello {manifest.get('model_id')}, verranno rigenerati")
+                return [], None
+            matrix = np.load(os.path.join(self.directory, manifest['matrix']), mmap_mode='r')
+            entries = manifest.get('documents', [])
+            if matrix.ndim != 2 or matrix.shape[0] != len(entries):
+                logger.warning("Archivio degli embedding incoerente, verrà rigenerato")
+                return [], None
+            return entries, matrix
+        except FileNotFoundError:
+            return [], None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Lettura dell'archivio degli embedding fallita: {e}")
+            return [], None
+            
+    def save(self, entries: List[Dict[str, str]], matrix: np.ndarray) -> None:
+        """
+        Salva matrice e manifest, rimuovendo le matrici non più referenziate
+        
+        Args:
+            entries: Una voce per riga della matrice ({'id', 'type', 'hash'})
+            matrix: Matrice (n_documenti, dimensione) degli embedding
+        """
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        digest = hashlib.sha256(matrix.tobytes())
+        digest.update(json.dumps(entries, sort_keys=True).encode('utf-8'))
+        matrix_name = f"embeddings-{digest.hexdigest()[:16]}.npy"
+        manifest = {
+            'model_id': self.model_id,
+            'dim': int(matrix.shape[1]) if matrix.ndim == 2 else 0,
+            'matrix': matrix_name,
+            'documents': entries
+        }
+        
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            matrix_path = os.path.join(self.directory, matrix_name)
+            if not os.path.exists(matrix_path):
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, matrix)
+                os.replace(tmp_path, matrix_path)
+                
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, os.path.join(self.directory, MANIFEST_NAME))
+        except OSError as e:
+            logger.warning(f"Salvataggio dell'archivio degli embedding fallito: {e}")
+            return
+            
+        # Le matrici precedenti restano leggibili da chi le ha già in memory-map
+        for name in os.listdir(self.directory):
+            if name.startswith('embeddings-') and name.endswith('.npy') and name != matrix_name:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        logger.info(f"Archivio degli embedding salvato: {matrix.shape[0]} documenti")
@@ -0,0 +1,247 @@
+"""
+Coda di job in background per l'analisi delle bollette caricate
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione della coda: i due pool si dimensionano in modo indipendente
+JOB_OCR_WORKERS = int(os.getenv('JOB_OCR_WORKERS', '2'))
+JOB_ANALYSIS_WORKERS = int(os.getenv('JOB_ANALYSIS_WORKERS', '4'))
+JOB_TTL = int(os.getenv('JOB_TTL', '3600'))  # Secondi di conservazione dei job terminati
+JOB_MAX_WAIT = 60  # Secondi massimi di attesa per il long-polling
+
+# Stati di un job
+STATUS_QUEUED = 'queued'
+STATUS_OCR = 'ocr'
+STATUS_ANALYZING = 'analyzing'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+FINAL_STATUSES = (STATUS_COMPLETED, STATUS_FAILED)
+
+class BillJobQueue:
+    """
+    Esegue OCR e analisi delle bollette su pool di thread limitati, fuori dalle richieste Flask
+    
+    Un job passa per gli stati queued -> ocr -> analyzing -> completed/failed. Ogni cambio di
+    stato incrementa la versione del job, così i client possono fare long-polling chiedendo
+    di essere svegliati solo quando la versione che conoscono è superata.
+    
+    Un job può avere un listener che riceve gli eventi di avanzamento (event, data) man mano che
+    accadono: 'status', 'page' (pagina estratta), 'text' (estrazione completata), 'token' (testo
+    generato dal modello), 'reset' (i token inviati finora vanno scartati perché l'analisi riparte
+    su un percorso di fallback) e infine 'result' oppure 'error'. Se l'analisi arriva dalla cache o
+    da un'analisi identica già in corso non ci sono token: un evento 'status' lo indica con source.
+    """
+    
+    def __init__(self, ocr_fn: Callable[[str], str], analysis_fn: Callable[[str], Dict[str, Any]],
+                 ocr_workers: int = None, analysis_workers: int = None):
+        """
+        Inizializza la coda
+        
+        Args:
+            ocr_fn: Funzione che estrae il testo da un file (es. process_document); riceve report=dict
+                    in cui registra la lingua del documento e, con un listener, on_page=callback
+            analysis_fn: Funzione che analizza il testo estratto (es. analyze_bill); con un listener
+                         viene chiamata con callback_handler=callback
+            ocr_workers: Dimensione del pool OCR (default: JOB_OCR_WORKERS)
+            analysis_workers: Dimensione del pool di analisi (default: JOB_ANALYSIS_WORKERS)
+        """
+        self.ocr_fn = ocr_fn
+        self.analysis_fn = analysis_fn
+        self._ocr_pool = ThreadPoolExecutor(max_workers=ocr_workers or JOB_OCR_WORKERS, thread_name_prefix='job-ocr')
+        self._analysis_pool = ThreadPoolExecutor(max_workers=analysis_workers or JOB_ANALYSIS_WORKERS, thread_name_prefix='job-analysis')
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._listeners: Dict[str, Callable[[str, Dict[str, Any]], None]] = {}
+        self._condition = threading.Condition()
+        
+    def submit(self, file_path: str, filename: str,
+               listener: Optional[Callable[[str, Dict[str, Any]], None]] = None) -> str:
+        """
+        Accoda l'analisi di un file già salvato su disco
+        
+        Args:
+            file_path: Percorso del file caricato
+            filename: Nome univoco del file, restituito nel risultato
+            listener: Callback opzionale listener(event, data) per gli eventi di avanzamento
+            
+        Returns:
+            str: ID del job
+        """
+        self._cleanup()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._condition:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': STATUS_QUEUED,
+                'version': 0,
+                'filename': filename,
+                'created_at': now,
+                'updated_at': now,
+                'lang': None,
+                'result': None,
+                'error': None
+            }
+            if listener:
+                self._listeners[job_id] = listener
+        self._ocr_pool.submit(self._run_ocr, job_id, file_path)
+        logger.info(f"Job {job_id} accodato per il file {filename}")
+        return job_id
+        
+    def remove_listener(self, job_id: str) -> None:
+        """Stacca il listener del job (es. quando il client dello stream si disconnette)"""
+        with self._condition:
+            self._listeners.pop(job_id, None)
+        
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Restituisce una copia dello stato del job, oppure None se non esiste"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+            
+    def wait(self, job_id: str, version: int = -1, timeout: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Attende che il job superi la versione indicata o termini (long-polling)
+        
+        Args:
+            job_id: ID del job
+            version: Ultima versione nota al client
+            timeout: Secondi massimi di attesa (limitati a JOB_MAX_WAIT)
+            
+        Returns:
+            dict: Stato del job, oppure None se non esiste
+        """
+        deadline = time.monotonic() + min(max(timeout, 0), JOB_MAX_WAIT)
+        with self._condition:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if job['version'] > version or job['status'] in FINAL_STATUSES or remaining <= 0:
+                    return dict(job)
+                self._condition.wait(remaining)
+                
+    def _update(self, job_id: str, **changes) -> None:
+        """Aggiorna un job, sveglia i client in attesa e notifica il listener"""
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(changes)
+            job['version'] += 1
+            job['updated_at'] = time.time()
+            self._condition.notify_all()
+            status = job['status']
+            error = job['error']
+            result = job['result']
+            
+        if 'status' in changes:
+            self._emit(job_id, 'status', {'status': status})
+        if status == STATUS_COMPLETED:
+            self._emit(job_id, 'result', result)
+        elif status == STATUS_FAILED:
+            self._emit(job_id, 'error', {'error': error, **(result or {})})
+        if status in FINAL_STATUSES:
+            with self._condition:
+                self._listeners.pop(job_id, None)
+                
+    def _emit(self, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        """Inoltra un evento al listener del job, se presente"""
+        listener = self._listeners.get(job_id)
+        if listener is None:
+            return
+        try:
+            listener(event, data)
+        except Exception as e:
+            logger.warning(f"Errore nel listener del job {job_id}: {e}")
+            
+    def _run_ocr(self, job_id: str, file_path: str) -> None:
+        """Fase OCR, eseguita sul pool OCR"""
+        self._update(job_id, status=STATUS_OCR)
+        report = {}
+        try:
+            if job_id in self._listeners:
+                def on_page(page):
+                    self._emit(job_id, 'page', {
+                        'page': page['page'],
+                        'source': page['source'],
+                        'lang': page['lang'],
+                        'chars': len(page['text'] or '')
+                    })
+                extracted_text = self.ocr_fn(file_path, on_page=on_page, report=report)
+            else:
+                extracted_text = self.ocr_fn(file_path, report=report)
+        except Exception as e:
+            logger.error(f"Errore OCR nel job {job_id}: {e}")
+            self._update(job_id, status=STATUS_FAILED, error=str(e))
+            return
+            
+        lang = report.get('lang')
+        if not extracted_text or len(extracted_text.strip()) < 50:
+            logger.warning(f"Testo insufficiente estratto nel job {job_id}")
+            self._update(
+                job_id,
+                status=STATUS_FAILED,
+                lang=lang,
+                error='Impossibile estrarre testo sufficiente dal documento. Assicurati che il documento sia leggibile.',
+                result={'extracted_text': extracted_text}
+            )
+            return
+            
+        self._emit(job_id, 'text', {'chars': len(extracted_text), 'lang': lang, 'extracted_text': extracted_text})
+        
+        # L'analisi passa sul suo pool: i worker OCR restano liberi durante la chiamata al modello
+        self._update(job_id, status=STATUS_ANALYZING, lang=lang)
+        self._analysis_pool.submit(self._run_analysis, job_id, extracted_text)
+        
+    def _run_analysis(self, job_id: str, extracted_text: str) -> None:
+        """Fase di analisi, eseguita sul pool di analisi"""
+        try:
+            if job_id in self._listeners:
+                def on_model_event(**kwargs):
+                    if "data" in kwargs:
+                        self._emit(job_id, 'token', {'text': kwargs['data']})
+                    elif kwargs.get("reset"):
+                        self._emit(job_id, 'reset', {})
+                    elif "result_source" in kwargs:
+                        self._emit(job_id, 'status', {'status': STATUS_ANALYZING, 'source': kwargs['result_source']})
+                analysis_result = self.analysis_fn(extracted_text, callback_handler=on_model_event)
+            else:
+                analysis_result = self.analysis_fn(extracted_text)
+        except Exception as e:
+            logger.error(f"Errore di analisi nel job {job_id}: {e}")
+            self._update(job_id, status=STATUS_FAILED, error=str(e))
+            return
+            
+        if "error" in analysis_result:
+            logger.error(f"Errore nell'analisi del job {job_id}: {analysis_result['error']}")
+            self._update(job_id, status=STATUS_FAILED, error=analysis_result['error'])
+            return
+            
+        logger.info(f"Job {job_id} completato con successo")
+        self._update(job_id, status=STATUS_COMPLETED, result={'analysis': analysis_result})
+        
+    def _cleanup(self) -> None:
+        """Rimuove i job terminati da più di JOB_TTL secondi"""
+        cutoff = time.time() - JOB_TTL
+        with self._condition:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job['status'] in FINAL_STATUSES and job['updated_at'] < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -3,8 +3,17 @@ Knowledge Base per EnergyWise - Contiene informazioni sui prodotti e offerte
 """
 import json
 import os
+import logging
+import tempfile
 from typing import List, Dict, Any
 
+from .catalog_index import CatalogIndex
+from .lexical_index import BM25Index
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
 # Definizione dei prodotti e offerte di EnergyWise
 ENERGY_PRODUCTS = [
     {
@@ -309,6 +318,8 @@ class KnowledgeBase:
         self.offers = SPECIAL_OFFERS
         self.faq = GENERAL_FAQ
         self.company_info = COMPANY_INFO
+        self.catalog = CatalogIndex(self.products, self.offers)
+        self._build_search_index()
         
         # Crea directory per i dati se non esiste
         try:
@@ -325,68 +336,80 @@ class KnowledgeBase:
         data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
         
         # Salva prodotti
-        with open(os.path.join(data_dir, 'products.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.products, f, ensure_ascii=False, indent=2)
+        self._write_json(os.path.join(data_dir, 'products.json'), self.products)
             
         # Salva offerte
-        with open(os.path.join(data_dir, 'offers.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.offers, f, ensure_ascii=False, indent=2)
+        self._write_json(os.path.join(data_dir, 'offers.json'), self.offers)
             
         # Salva FAQ
-        with open(os.path.join(data_dir, 'faq.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.faq, f, ensure_ascii=False, indent=2)
+        self._write_json(os.path.join(data_dir, 'faq.json'), self.faq)
             
         # Salva info azienda
-        with open(os.path.join(data_dir, 'company_info.json'), 'w', encoding='utf-8') as f:
-            json.dump(self.company_info, f, ensure_ascii=False, indent=2)
+        self._write_json(os.path.join(data_dir, 'company_info.json'), self.company_info)
+        
+    def _write_json(self, path: str, data: Any) -> bool:
+        """
+        Scrive un file JSON solo se il contenuto è cambiato
+        
+        La scrittura passa da un file temporaneo sostituito in modo atomico, così il ricaricamento
+        a caldo del sistema RAG non legge mai un file a metà; lasciare intatti i file invariati
+        evita di far scattare ricaricamenti inutili.
+        
+        Returns:
+            bool: True se il file è stato scritto
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                if json.load(f) == data:
+                    return False
+        except (OSError, ValueError):
+            pass
+            
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        logger.info(f"File della knowledge base aggiornato: {os.path.basename(path)}")
+        return True
     
     def get_product_by_id(self, product_id: str) -> Dict[str, Any]:
         """Ottiene un prodotto dal suo ID"""
-        for product in self.products:
-            if product["id"] == product_id:
-                return product
-        return None
+        return self.catalog.get_product(product_id)
     
     def get_products_by_type(self, product_type: str) -> List[Dict[str, Any]]:
         """Ottiene tutti i prodotti di un determinato tipo"""
-        return [p for p in self.products if p["type"] == product_type]
+        return list(self.catalog.get_products_by_type(product_type))
     
     def get_active_offers(self) -> List[Dict[str, Any]]:
         """Ottiene tutte le offerte attive"""
-        import datetime
-        today = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        return [
-            offer for offer in self.offers 
-            if offer["valid_until"] == "ongoing" or offer["valid_until"] >= today
-        ]
+        return list(self.catalog.active_offers())
     
+    def _build_search_index(self):
+        """Costruisce l'indice BM25 su prodotti, offerte e FAQ"""
+        self._search_index = BM25Index()
+        self._search_documents = {}
+        for i, product in enumerate(self.products):
+            self._search_documents[f"products:{i}"] = ("products", product)
+            self._search_index.add(f"products:{i}", "\n".join(
+                [product["name"], product["description"]] + product["features"]
+            ))
+        for i, offer in enumerate(self.offers):
+            self._search_documents[f"offers:{i}"] = ("offers", offer)
+            self._search_index.add(f"offers:{i}", f"{offer['name']}\n{offer['description']}")
+        for i, faq in enumerate(self.faq):
+            self._search_documents[f"faq:{i}"] = ("faq", faq)
+            self._search_index.add(f"faq:{i}", f"{faq['question']}\n{faq['answer']}")
+            
     def search(self, query: str) -> Dict[str, List[Dict[str, Any]]]:
-        """Cerca nella knowledge base"""
-        query = query.lower()
+        """Cerca nella knowledge base, con i risultati di ogni categoria in ordine di pertinenza (BM25)"""
         results = {
             "products": [],
             "offers": [],
             "faq": []
         }
         
-        # Cerca nei prodotti
-        for product in self.products:
-            if (query in product["name"].lower() or 
-                query in product["description"].lower() or
-                any(query in feature.lower() for feature in product["features"])):
-                results["products"].append(product)
-                
-        # Cerca nelle offerte
-        for offer in self.offers:
-            if (query in offer["name"].lower() or 
-                query in offer["description"].lower()):
-                results["offers"].append(offer)
-                
-        # Cerca nelle FAQ
-        for faq in self.faq:
-            if (query in faq["question"].lower() or 
-                query in faq["answer"].lower()):
-                results["faq"].append(faq)
+        for key, _ in self._search_index.search(query, top_k=len(self._search_documents)):
+            category, item = self._search_documents[key]
+            results[category].append(item)
                 
         return results
@@ -0,0 +1,165 @@
+"""
+Indice invertito con punteggio BM25 per la ricerca testuale nella knowledge base (italiano e spagnolo)
+"""
+import os
+import re
+import copy
+import math
+import logging
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Parametri BM25 e della fusione dei risultati
+BM25_K1 = float(os.getenv('BM25_K1', '1.5'))
+BM25_B = float(os.getenv('BM25_B', '0.75'))
+RRF_K = int(os.getenv('RRF_K', '60'))  # Costante della reciprocal rank fusion
+MIN_STEM_LENGTH = 4
+
+# Parole vuote italiane e spagnole (senza accenti, come i token)
+STOPWORDS = {
+    # Italiano
+    'il', 'lo', 'la', 'i', 'gli', 'le', 'un', 'uno', 'una', 'di', 'a', 'da', 'in', 'con', 'su', 'per', 'tra', 'fra',
+    'del', 'dello', 'della', 'dei', 'degli', 'delle', 'al', 'allo', 'alla', 'ai', 'agli', 'alle', 'dal', 'dalla',
+    'dai', 'dalle', 'nel', 'nello', 'nella', 'nei', 'negli', 'nelle', 'sul', 'sulla', 'sui', 'sulle', 'e', 'ed',
+    'o', 'ma', 'che', 'chi', 'cui', 'non', 'si', 'se', 'come', 'piu', 'anche', 'ci', 'mi', 'ti', 'vi', 'ne', 'ho',
+    'ha', 'hanno', 'sono', 'essere', 'mio', 'mia', 'tuo', 'tua', 'suo', 'sua', 'questo', 'questa', 'quello',
+    'quella', 'qual', 'quale', 'quali', 'quanto', 'posso', 'puo', 'voglio', 'vorrei', 'c', 'l', 'un', 'all', 'dell',
+    'nell', 'sull', 'po',
+    # Spagnolo
+    'el', 'los', 'las', 'unos', 'unas', 'de', 'en', 'y', 'u', 'que', 'es', 'por', 'para', 'con', 'sin', 'sobre',
+    'mi', 'mis', 'tu', 'tus', 'su', 'sus', 'lo', 'al', 'como', 'mas', 'pero', 'se', 'le', 'les', 'este', 'esta',
+    'esto', 'ese', 'esa', 'cual', 'cuanto', 'cuanta', 'puedo', 'quiero', 'hay', 'son', 'ser', 'estar', 'muy',
+}
+
+# Suffissi flessivi e derivativi italiani e spagnoli, dal più lungo al più corto
+SUFFIXES = sorted({
+    # Italiano
+    'azioni', 'azione', 'amente', 'mente', 'menti', 'abile', 'abili', 'ibile', 'ibili', 'ista', 'iste', 'isti', 'ismo', 'ismi',
+    'ando', 'endo', 'are', 'ere', 'ire', 'ale', 'ali', 'ore', 'ori', 'ice', 'ici', 'oso', 'osa', 'osi', 'ose',
+    # Spagnolo
+    'aciones', 'acion', 'mente', 'idades', 'idad', 'ando', 'iendo', 'ar', 'er', 'ir', 'oso', 'osa', 'osos', 'osas',
+    'ales', 'es',
+    # Comuni (genere e numero)
+    'as', 'os', 'a', 'e', 'i', 'o', 's',
+}, key=len, reverse=True)
+
+def strip_accents(text: str) -> str:
+    """Rimuove gli accenti (es. 'attività' -> 'attivita', 'facturación' -> 'facturacion')"""
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+def stem(token: str) -> str:
+    """
+    Stemmer leggero per italiano e spagnolo: rimuove il suffisso più lungo lasciando almeno
+    MIN_STEM_LENGTH caratteri, così 'bollette'/'bolletta' e 'facturas'/'factura' coincidono
+    """
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+def tokenize(text: str) -> List[str]:
+    """Normalizza, divide in parole, rimuove le parole vuote e applica lo stemming"""
+    words = re.findall(r'[a-z0-9]+', strip_accents(text.lower()))
+    return [stem(word) for word in words if word not in STOPWORDS]
+
+class BM25Index:
+    """
+    Indice invertito con punteggio Okapi BM25
+    
+    Le posting list associano a ogni termine le frequenze nei documenti che lo contengono,
+    quindi una query visita solo i documenti che hanno almeno un suo termine. Inserimenti e
+    rimozioni sono incrementali.
+    """
+    
+    def __init__(self, k1: float = None, b: float = None):
+        self.k1 = BM25_K1 if k1 is None else k1
+        self.b = BM25_B if b is None else b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, List[str]] = {}
+        self._total_length = 0
+        
+    def __len__(self) -> int:
+        return len(self._lengths)
+        
+    def copy(self) -> 'BM25Index':
+        """Copia indipendente dell'indice, da modificare mentre l'originale continua a servire le ricerche"""
+        return copy.deepcopy(self)
+        
+    def add(self, key: str, text: str) -> None:
+        """Indicizza (o reindicizza) un documento"""
+        if key in self._lengths:
+            self.remove([key])
+        tokens = tokenize(text)
+        counts = Counter(tokens)
+        for term, count in counts.items():
+            self._postings[term][key] = count
+        self._lengths[key] = len(tokens)
+        self._terms[key] = list(counts)
+        self._total_length += len(tokens)
+        
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> None:
+        """Indicizza più documenti (coppie chiave, testo)"""
+        for key, text in items:
+            self.add(key, text)
+            
+    def remove(self, keys: Sequence[str]) -> None:
+        """Rimuove dei documenti dall'indice (le chiavi assenti vengono ignorate)"""
+        for key in keys:
+            if key not in self._lengths:
+                continue
+            for term in self._terms.pop(key):
+                postings = self._postings[term]
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+            self._total_length -= self._lengths.pop(key)
+            
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Cerca i documenti più pertinenti per una query
+        
+        Returns:
+            list: Coppie (chiave, punteggio BM25) in ordine decrescente, solo con punteggio positivo
+        """
+        n_documents = len(self._lengths)
+        if n_documents == 0:
+            return []
+        average_length = self._total_length / n_documents
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_documents - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[key] / average_length)
+                scores[key] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = None) -> List[Tuple[str, float]]:
+    """
+    Fonde più classifiche di chiavi con la reciprocal rank fusion: score = somma di 1 / (k + posizione)
+    
+    Args:
+        rankings: Classifiche da fondere, ognuna in ordine decrescente di pertinenza
+        k: Costante di smorzamento (default: RRF_K)
+        
+    Returns:
+        list: Coppie (chiave, punteggio fuso) in ordine decrescente
+    """
+    k = RRF_K if k is None else k
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for position, key in enumerate(ranking, start=1):
+            scores[key] += 1.0 / (k + position)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
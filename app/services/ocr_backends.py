@@ -0,0 +1,142 @@
+"""
+Backend OCR per EnergyWise: API tesseract in-process (tesserocr) con fallback a pytesseract
+"""
+import os
+import logging
+import threading
+from typing import Optional
+import pytesseract
+from dotenv import load_dotenv
+
+try:
+    import tesserocr
+except ImportError:  # Installazione senza le librerie di tesseract: resta disponibile pytesseract
+    tesserocr = None
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione del backend OCR: 'auto' usa tesserocr e ripiega su pytesseract solo se non è importabile
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'auto')
+TESSDATA_PREFIX = os.getenv('TESSDATA_PREFIX')
+
+class OCRBackend:
+    """Interfaccia comune dei backend OCR"""
+    
+    name = "base"
+    
+    def image_to_string(self, image, lang: Optional[str] = None) -> str:
+        """
+        Estrae il testo da un'immagine PIL
+        
+        Args:
+            image: Immagine PIL
+            lang: Specifica lingua di tesseract (es. 'spa+eng'); None = lingua predefinita
+            
+        Returns:
+            str: Testo estratto
+        """
+        raise NotImplementedError
+        
+    def warm_up(self, lang: Optional[str] = None) -> None:
+        """Precarica i modelli linguistici, così la prima pagina non ne paga il caricamento"""
+
+class PytesseractBackend(OCRBackend):
+    """Backend storico: un processo tesseract per ogni chiamata"""
+    
+    name = "pytesseract"
+    
+    def image_to_string(self, image, lang: Optional[str] = None) -> str:
+        if lang:
+            return pytesseract.image_to_string(image, lang=lang)
+        return pytesseract.image_to_string(image)
+
+class TesserocrBackend(OCRBackend):
+    """
+    Backend in-process basato sulle API C++ di tesseract
+    
+    Ogni thread mantiene un handle PyTessBaseAPI per lingua, con il traineddata già caricato:
+    le chiamate successive evitano sia il fork di un processo sia il caricamento del modello.
+    """
+    
+    name = "tesserocr"
+    
+    def __init__(self):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr non installato")
+        self._local = threading.local()
+        
+    def _get_api(self, lang: Optional[str]):
+        apis = getattr(self._local, 'apis', None)
+        if apis is None:
+            apis = self._local.apis = {}
+            
+        key = lang or 'default'
+        api = apis.get(key)
+        if api is None:
+            kwargs = {'lang': lang} if lang else {}
+            if TESSDATA_PREFIX:
+                kwargs['path'] = TESSDATA_PREFIX
+            logger.info(f"Caricamento del modello tesseract in-process: {key}")
+            api = tesserocr.PyTessBaseAPI(**kwargs)
+            apis[key] = api
+        return api
+        
+    def image_to_string(self, image, lang: Optional[str] = None) -> str:
+        api = self._get_api(lang)
+        api.SetImage(image)
+        try:
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            
+    def warm_up(self, lang: Optional[str] = None) -> None:
+        self._get_api(lang)
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_ocr_backend() -> OCRBackend:
+    """
+    Restituisce il backend OCR del processo corrente, creandolo alla prima chiamata
+    
+    Returns:
+        OCRBackend: tesserocr se richiesto (o disponibile con OCR_ENGINE='auto'), altrimenti pytesseract
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if OCR_ENGINE in ('auto', 'tesserocr'):
+                try:
+                    _backend = TesserocrBackend()
+                except RuntimeError as e:
+                    # Con pytesseract ogni pagina avvia un processo tesseract e ricarica il modello
+                    logger.warning(f"Backend tesserocr non disponibile, uso pytesseract (un processo per pagina): {e}")
+                    _backend = PytesseractBackend()
+            else:
+                _backend = PytesseractBackend()
+            logger.info(f"Backend OCR in uso: {_backend.name}")
+        return _backend
+
+def warm_ocr_worker(lang: Optional[str] = None) -> None:
+    """
+    Inizializzatore dei processi del pool OCR: crea il backend e precarica le lingue indicate
+    
+    Args:
+        lang: Specifica lingua da precaricare; per una specifica combinata (es. 'spa+eng')
+              vengono precaricate anche le singole lingue, usate dopo il rilevamento
+    """
+    specs = [lang]
+    if lang and '+' in lang:
+        specs += lang.split('+')
+    try:
+        backend = get_ocr_backend()
+        for spec in specs:
+            backend.warm_up(spec)
+    except Exception as e:
+        # Un errore qui non deve impedire l'avvio del worker: l'OCR riproverà alla prima pagina
+        logger.warning(f"Preriscaldamento del worker OCR fallito: {e}")
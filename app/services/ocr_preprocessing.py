@@ -0,0 +1,154 @@
+"""
+Preprocessing delle immagini prima dell'OCR: raddrizzamento, binarizzazione e normalizzazione della scala
+"""
+import os
+import logging
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione del preprocessing
+OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'true').lower() in ('1', 'true', 'yes')
+OCR_TARGET_LINE_HEIGHT = int(os.getenv('OCR_TARGET_LINE_HEIGHT', '32'))  # Altezza di riga ottimale per tesseract, in pixel
+OCR_PROBE_DPI = int(os.getenv('OCR_PROBE_DPI', '50'))  # Risoluzione della rasterizzazione di prova
+OCR_MIN_DPI = int(os.getenv('OCR_MIN_DPI', '150'))
+OCR_MAX_DPI = int(os.getenv('OCR_MAX_DPI', '400'))
+MAX_SKEW_ANGLE = 5.0  # Gradi
+SKEW_STEP = 0.5  # Gradi
+SKEW_ANALYSIS_WIDTH = 800  # Larghezza dell'immagine ridotta usata per stimare l'inclinazione
+
+def otsu_threshold(pixels: np.ndarray) -> int:
+    """
+    Calcola la soglia di binarizzazione di Otsu per un'immagine in scala di grigi
+    
+    Args:
+        pixels: Array uint8 dei pixel
+        
+    Returns:
+        int: Soglia (i pixel minori o uguali alla soglia sono inchiostro; su una pagina
+             bianca e nera pura la soglia è 0)
+    """
+    hist = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    weights = np.cumsum(hist) / pixels.size
+    means = np.cumsum(hist * np.arange(256)) / pixels.size
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between_variance = (means[-1] * weights - means) ** 2 / (weights * (1.0 - weights))
+    between_variance = np.nan_to_num(between_variance, nan=0.0, posinf=0.0)
+    return int(np.argmax(between_variance))
+
+def estimate_line_height(ink: np.ndarray):
+    """
+    Stima l'altezza mediana delle righe di testo dal profilo di proiezione orizzontale
+    
+    Args:
+        ink: Array booleano (True = inchiostro)
+        
+    Returns:
+        float: Altezza mediana delle righe in pixel, oppure None se non ci sono abbastanza righe
+    """
+    rows = ink.mean(axis=1) > 0.01
+    # Lunghezze delle sequenze consecutive di righe con inchiostro
+    edges = np.diff(np.concatenate(([0], rows.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    runs = ends - starts
+    runs = runs[runs >= 2]
+    if len(runs) < 3:
+        return None
+    return float(np.median(runs))
+
+def estimate_skew(ink: np.ndarray) -> float:
+    """
+    Stima l'inclinazione del testo cercando l'angolo che rende più netto il profilo delle righe
+    
+    Args:
+        ink: Array booleano (True = inchiostro)
+        
+    Returns:
+        float: Angolo in gradi da applicare con Image.rotate per raddrizzare il testo
+    """
+    image = Image.fromarray(ink.astype(np.uint8) * 255)
+    if image.width > SKEW_ANALYSIS_WIDTH:
+        ratio = SKEW_ANALYSIS_WIDTH / image.width
+        image = image.resize((SKEW_ANALYSIS_WIDTH, max(1, int(image.height * ratio))), Image.NEAREST)
+        
+    def sharpness(angle):
+        rotated = np.asarray(image.rotate(angle, resample=Image.NEAREST, fillcolor=0), dtype=np.float64)
+        return float(np.sum(np.diff(rotated.sum(axis=1)) ** 2))
+    
+    # Si parte dall'immagine non ruotata: senza un miglioramento netto non si ruota
+    best_angle = 0.0
+    best_score = sharpness(0.0)
+    for angle in np.arange(-MAX_SKEW_ANGLE, MAX_SKEW_ANGLE + SKEW_STEP, SKEW_STEP):
+        score = sharpness(float(angle))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+def choose_dpi(probe_image: Image.Image, probe_dpi: int = None) -> int:
+    """
+    Sceglie la risoluzione di rasterizzazione di una pagina partendo da una rasterizzazione di prova
+    
+    Args:
+        probe_image: Pagina rasterizzata a bassa risoluzione
+        probe_dpi: Risoluzione della rasterizzazione di prova (default: OCR_PROBE_DPI)
+        
+    Returns:
+        int: DPI tali che le righe di testo abbiano un'altezza vicina a OCR_TARGET_LINE_HEIGHT,
+             oppure None se l'altezza delle righe non è stimabile
+    """
+    probe_dpi = probe_dpi or OCR_PROBE_DPI
+    pixels = np.asarray(probe_image.convert('L'))
+    line_height = estimate_line_height(pixels <= otsu_threshold(pixels))
+    if not line_height:
+        return None
+    dpi = probe_dpi * OCR_TARGET_LINE_HEIGHT / line_height
+    return int(min(OCR_MAX_DPI, max(OCR_MIN_DPI, dpi)))
+
+def preprocess_image(image: Image.Image, rescale: bool = True) -> Image.Image:
+    """
+    Prepara un'immagine per l'OCR
+    
+    Converte in scala di grigi, riporta le righe di testo all'altezza ottimale (solo se rescale),
+    raddrizza il testo inclinato e binarizza con la soglia di Otsu.
+    
+    Args:
+        image: Immagine PIL da elaborare
+        rescale: Ridimensiona l'immagine verso OCR_TARGET_LINE_HEIGHT (da disattivare se i DPI
+                 sono già stati scelti con choose_dpi)
+                 
+    Returns:
+        Image.Image: Immagine binarizzata in modalità 'L'
+    """
+    gray = image.convert('L')
+    pixels = np.asarray(gray)
+    threshold = otsu_threshold(pixels)
+    ink = pixels <= threshold
+    
+    if rescale:
+        line_height = estimate_line_height(ink)
+        if line_height:
+            scale = min(2.0, max(0.25, OCR_TARGET_LINE_HEIGHT / line_height))
+            # Piccole differenze di scala non valgono il costo del ricampionamento
+            if scale < 0.8 or scale > 1.25:
+                size = (max(1, int(gray.width * scale)), max(1, int(gray.height * scale)))
+                logger.info(f"Ridimensionamento per OCR: {gray.size} -> {size}")
+                gray = gray.resize(size, Image.LANCZOS)
+                # Il ricampionamento introduce grigi (es. su pagine bianco/nero): soglia ricalcolata
+                threshold = otsu_threshold(np.asarray(gray))
+                ink = np.asarray(gray) <= threshold
+                
+    angle = estimate_skew(ink)
+    if abs(angle) >= SKEW_STEP:
+        logger.info(f"Raddrizzamento per OCR: {angle:.1f} gradi")
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+        threshold = otsu_threshold(np.asarray(gray))
+        
+    return gray.point(lambda value: 255 if value > threshold else 0)
@@ -2,15 +2,28 @@
 Sistema RAG (Retrieval-Augmented Generation) per EnergyWise
 """
 import os
+import re
 import json
+import time
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Callable, Optional
 from dotenv import load_dotenv
-import boto3
-from botocore.config import Config
 import numpy as np
 from strands import Agent, tool
-from strands.models import BedrockModel
+from strands.agent.conversation_manager import NullConversationManager
+
+from .agent_pool import SUMMARY_SYSTEM_PROMPT, PromptTokenStats, SessionAgentPool, input_tokens
+from .bedrock_client import create_bedrock_model, get_bedrock_runtime
+from .cache import SQLiteCache, TTLLRUCache
+from .catalog_index import CatalogIndex
+from .chunker import chunk_sections
+from .data_watcher import DataDirectoryWatcher
+from .embedding_builder import EmbeddingBuilder
+from .embedding_store import EmbeddingStore, hash_text
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+from .single_flight import SingleFlight
+from .vector_index import ExactIndex, VectorIndex, create_vector_index
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,52 +37,129 @@ region = os.getenv('AWS_REGION', 'us-east-1')
 embedding_model_id = os.getenv('BEDROCK_EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v1')
 model_id = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-7-sonnet-20250219-v1:0')
 
+# Soglia minima di similarità dei documenti recuperati con la ricerca vettoriale
+MIN_SIMILARITY = 0.5
+
+# Candidati presi da ciascuna ricerca (vettoriale e BM25) prima della fusione
+FUSION_CANDIDATES = 20
+
+# File JSON della knowledge base e intervallo di controllo per il ricaricamento a caldo (0 = disattivato)
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+RAG_RELOAD_INTERVAL = float(os.getenv('RAG_RELOAD_INTERVAL', '30'))  # Secondi
+
+# Archivio persistente degli embedding della knowledge base
+RAG_EMBEDDINGS_DIR = os.getenv('RAG_EMBEDDINGS_DIR', os.path.join(os.path.dirname(__file__), '..', 'data', 'embeddings'))
+
+# Nuovi tentativi per i chunk il cui embedding è fallito: l'attesa raddoppia a ogni tentativo fallito (0 = disattivati)
+RAG_EMBED_RETRY_BASE = float(os.getenv('RAG_EMBED_RETRY_BASE', '30'))  # Secondi
+RAG_EMBED_RETRY_MAX = float(os.getenv('RAG_EMBED_RETRY_MAX', '600'))  # Secondi
+
+# Cache degli embedding delle query: in memoria e, se RAG_QUERY_CACHE_DB è impostato, condivisa tra processi
+RAG_QUERY_CACHE_SIZE = int(os.getenv('RAG_QUERY_CACHE_SIZE', '1024'))
+RAG_QUERY_CACHE_TTL = int(os.getenv('RAG_QUERY_CACHE_TTL', '86400'))  # Secondi
+RAG_QUERY_CACHE_DB = os.getenv('RAG_QUERY_CACHE_DB', '')
+
+def normalize_query(query: str) -> str:
+    """Normalizza una query per la cache: minuscole e spazi compattati"""
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+def document_key(doc: Dict[str, Any]) -> str:
+    """Chiave di un documento negli indici di ricerca"""
+    return f"{doc['type']}:{doc['id']}"
+
 class RAGSystem:
     """Sistema RAG per EnergyWise"""
     
-    def __init__(self):
-        """Inizializza il sistema RAG"""
+    def __init__(self, progress: Optional[Callable[..., None]] = None):
+        """
+        Inizializza il sistema RAG
+        
+        Args:
+            progress: Callback opzionale progress(stage, **details) per seguire l'avanzamento
+                      dell'inizializzazione (es. da un BackgroundInitializer)
+                      
+        Gli errori di inizializzazione vengono propagati. Gli embedding falliti invece non sono un
+        errore: i chunk restano cercabili con BM25 e vengono riprovati in background.
+        """
+        self._progress = progress
+        self.embedding_metrics = {}
+        self.version = 0
+        self.loaded_at = None
+        self.last_reload: Dict[str, Any] = {}
+        self.watcher = None
+        # Chunk esclusi dalla ricerca vettoriale perché il loro embedding è fallito, riprovati con backoff
+        self.failed_embeddings: List[Dict[str, Any]] = []
+        self._embedding_retry: Optional[threading.Timer] = None
+        self._embedding_retry_at: Optional[float] = None
+        self._embedding_retry_delay = RAG_EMBED_RETRY_BASE
+        self._retry_lock = threading.Lock()
+        # _swap_lock rende atomica la sostituzione dello stato, _reload_lock serializza i ricaricamenti
+        self._swap_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.query_cache = TTLLRUCache(RAG_QUERY_CACHE_SIZE, RAG_QUERY_CACHE_TTL)
+        self.shared_query_cache = None
+        # Richieste di embedding identiche e concorrenti (es. la stessa domanda da più utenti) fanno una sola chiamata
+        self.embedding_flight = SingleFlight('embedding')
+        if RAG_QUERY_CACHE_DB:
+            try:
+                self.shared_query_cache = SQLiteCache(RAG_QUERY_CACHE_DB, RAG_QUERY_CACHE_TTL)
+            except Exception as e:
+                logger.warning(f"Cache condivisa delle query non disponibile: {e}")
+                
         try:
-            self.bedrock_runtime = boto3.client(
-                service_name='bedrock-runtime',
-                region_name=region,
-                config=Config(
-                    read_timeout=120,
-                    connect_timeout=60,
-                    retries={'max_attempts': 3}
-                )
-            )
+            self.bedrock_runtime = get_bedrock_runtime()
             
             # Carica i dati della knowledge base
+            self._report('knowledge_base')
             self.knowledge_base = self._load_knowledge_base()
+            self.catalog = self._build_catalog(self.knowledge_base)
+            
+            # Suddivide i documenti in chunk e li indicizza per parole chiave (nessuna chiamata a Bedrock)
+            self._report('lexical_index')
+            self.parents, self.chunks = self._generate_chunks(self.knowledge_base)
+            self.documents_by_key = {document_key(doc): doc for doc in self.chunks}
+            self.lexical_index = BM25Index()
+            self.lexical_index.add_many((key, doc['text']) for key, doc in self.documents_by_key.items())
             
             # Genera embedding per i documenti
-            self.documents, self.embeddings = self._generate_embeddings()
+            self.documents, self.embeddings = self._generate_embeddings(
+                self.chunks,
+                on_progress=lambda done, total: self._report('embedding', done=done, total=total)
+            )
+            self.failed_embeddings = self._missing_embeddings(self.chunks, self.documents)
+            self._report('vector_index', documents=len(self.documents))
+            self.index = self._build_index(self.documents, self.embeddings)
+            self.version = 1
+            self.loaded_at = time.time()
             
             # Inizializza il modello Bedrock
-            self.bedrock_model = BedrockModel(
-                model_id=model_id,
-                region_name=region,
-                temperature=0.2,
-                timeout=120
-            )
+            self._report('agent')
+            self.bedrock_model = create_bedrock_model(model_id, temperature=0.2)
+            
+            # Agenti con i tool: uno nuovo per ogni domanda singola, uno per sessione per le conversazioni
+            self.chat_sessions = SessionAgentPool(self._create_agent, self._create_summary_agent)
+            self.prompt_tokens = PromptTokenStats()
             
-            # Inizializza l'agente con i tool
-            self.agent = self._create_agent()
+            # Ricarica la knowledge base quando cambiano i file JSON
+            if RAG_RELOAD_INTERVAL > 0:
+                self.watcher = DataDirectoryWatcher(DATA_DIR, self.reload, RAG_RELOAD_INTERVAL)
+                self.watcher.start()
+            self._schedule_embedding_retry()
             
             logger.info("Sistema RAG inizializzato con successo")
         except Exception as e:
+            # Nessuno stato vuoto di ripiego: chi costruisce il sistema (es. il BackgroundInitializer) riprova
             logger.error(f"Errore durante l'inizializzazione del sistema RAG: {e}")
-            self.bedrock_runtime = None
-            self.knowledge_base = {}
-            self.documents = []
-            self.embeddings = []
-            self.bedrock_model = None
-            self.agent = None
+            raise
+            
+    def _report(self, stage: str, **details: Any) -> None:
+        """Segnala una fase dell'inizializzazione alla callback di avanzamento, se presente"""
+        if self._progress:
+            self._progress(stage, **details)
         
     def _load_knowledge_base(self) -> Dict[str, Any]:
         """Carica i dati della knowledge base"""
-        data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
+        data_dir = DATA_DIR
         knowledge_base = {}
         
         # Carica prodotti
@@ -101,257 +191,513 @@ class RAGSystem:
             knowledge_base['company_info'] = {}
             
         return knowledge_base
+        
+    def _build_catalog(self, knowledge_base: Dict[str, Any]) -> CatalogIndex:
+        """Costruisce gli indici di prodotti e offerte usati dai tool dell'agente"""
+        return CatalogIndex(knowledge_base.get('products', []), knowledge_base.get('offers', []))
     
-    def _generate_document_text(self, doc_type: str, doc: Dict[str, Any]) -> str:
-        """Genera il testo del documento per l'embedding"""
+    def _generate_document_sections(self, doc_type: str, doc: Dict[str, Any]) -> tuple:
+        """
+        Genera il titolo e le sezioni di un documento per il chunking
+        
+        Ogni sezione è un'unità di significato che il chunker non spezza se possibile:
+        una singola FAQ, l'elenco delle caratteristiche, il blocco prezzi.
+        
+        Returns:
+            tuple: (titolo, lista delle sezioni)
+        """
         if doc_type == 'products':
-            features = "\n".join([f"- {feature}" for feature in doc.get('features', [])])
-            faq_text = ""
-            for faq in doc.get('faq', []):
-                faq_text += f"Q: {faq.get('question', '')}\nA: {faq.get('answer', '')}\n"
+            sections = [
+                f"Tipo: {doc.get('type', '')}\nDescrizione: {doc.get('description', '')}",
+                "Caratteristiche:\n" + "\n".join([f"- {feature}" for feature in doc.get('features', [])])
+            ]
             
             price_text = ""
             if isinstance(doc.get('price'), dict):
                 if 'electricity' in doc['price'] and 'gas' in doc['price']:
                     # Dual fuel
-                    price_text = f"""
-                    Elettricità:
-                    - Componente fissa: {doc['price']['electricity'].get('fixed_component', '')}
-                    - Componente variabile: {doc['price']['electricity'].get('variable_component', '')}
-                    
-                    Gas:
-                    - Componente fissa: {doc['price']['gas'].get('fixed_component', '')}
-                    - Componente variabile: {doc['price']['gas'].get('variable_component', '')}
-                    
-                    Sconto dual: {doc['price'].get('discount_dual', '')}
-                    """
+                    price_text = (
+                        f"Elettricità:\n"
+                        f"- Componente fissa: {doc['price']['electricity'].get('fixed_component', '')}\n"
+                        f"- Componente variabile: {doc['price']['electricity'].get('variable_component', '')}\n"
+                        f"Gas:\n"
+                        f"- Componente fissa: {doc['price']['gas'].get('fixed_component', '')}\n"
+                        f"- Componente variabile: {doc['price']['gas'].get('variable_component', '')}\n"
+                        f"Sconto dual: {doc['price'].get('discount_dual', '')}"
+                    )
                 else:
                     # Single service
-                    for key, value in doc['price'].items():
-                        price_text += f"- {key.replace('_', ' ').title()}: {value}\n"
-            
-            return f"""
-            Prodotto: {doc.get('name', '')}
-            Tipo: {doc.get('type', '')}
-            Descrizione: {doc.get('description', '')}
-            
-            Caratteristiche:
-            {features}
+                    price_text = "\n".join([f"- {key.replace('_', ' ').title()}: {value}" for key, value in doc['price'].items()])
+            sections.append(f"Prezzo:\n{price_text}")
+            sections.append(f"Target: {doc.get('target', '')}\nRequisiti: {doc.get('requirements', '')}")
             
-            Prezzo:
-            {price_text}
-            
-            Target: {doc.get('target', '')}
-            Requisiti: {doc.get('requirements', '')}
+            for faq in doc.get('faq', []):
+                sections.append(f"Q: {faq.get('question', '')}\nA: {faq.get('answer', '')}")
             
-            FAQ:
-            {faq_text}
-            """
+            return f"Prodotto: {doc.get('name', '')}", sections
         
         elif doc_type == 'offers':
-            return f"""
-            Offerta: {doc.get('name', '')}
-            Descrizione: {doc.get('description', '')}
-            Valida fino: {doc.get('valid_until', '')}
-            Prodotti applicabili: {', '.join(doc.get('applicable_products', []))}
-            Termini e condizioni: {doc.get('terms', '')}
-            """
+            return f"Offerta: {doc.get('name', '')}", [
+                f"Descrizione: {doc.get('description', '')}\n"
+                f"Valida fino: {doc.get('valid_until', '')}\n"
+                f"Prodotti applicabili: {', '.join(doc.get('applicable_products', []))}",
+                f"Termini e condizioni: {doc.get('terms', '')}"
+            ]
         
         elif doc_type == 'faq':
-            return f"""
-            Domanda: {doc.get('question', '')}
-            Risposta: {doc.get('answer', '')}
-            """
+            return "", [f"Domanda: {doc.get('question', '')}\nRisposta: {doc.get('answer', '')}"]
         
         elif doc_type == 'company_info':
-            values = "\n".join([f"- {value}" for value in doc.get('values', [])])
-            certifications = "\n".join([f"- {cert}" for cert in doc.get('certifications', [])])
-            
-            return f"""
-            Nome azienda: {doc.get('name', '')}
-            Fondata: {doc.get('founded', '')}
-            Sede: {doc.get('headquarters', '')}
-            Missione: {doc.get('mission', '')}
-            
-            Valori:
-            {values}
+            contact = doc.get('contact', {})
+            return f"Nome azienda: {doc.get('name', '')}", [
+                f"Fondata: {doc.get('founded', '')}\nSede: {doc.get('headquarters', '')}\nMissione: {doc.get('mission', '')}",
+                "Valori:\n" + "\n".join([f"- {value}" for value in doc.get('values', [])]),
+                "Certificazioni:\n" + "\n".join([f"- {cert}" for cert in doc.get('certifications', [])]),
+                f"Contatti:\n"
+                f"- Servizio clienti: {contact.get('customer_service', '')}\n"
+                f"- Email: {contact.get('email', '')}\n"
+                f"- Sito web: {contact.get('website', '')}"
+            ]
             
-            Certificazioni:
-            {certifications}
+        return "", [json.dumps(doc)]
+    
+    def _generate_chunks(self, knowledge_base: Dict[str, Any]) -> tuple:
+        """
+        Suddivide i documenti della knowledge base in chunk
+        
+        Returns:
+            tuple: (documenti di origine per "tipo:id", lista dei chunk)
+        """
+        parents = []
+        for product in knowledge_base.get('products', []):
+            parents.append(('products', product.get('id'), product))
+        for offer in knowledge_base.get('offers', []):
+            parents.append(('offers', offer.get('id'), offer))
+        for i, faq in enumerate(knowledge_base.get('faq', [])):
+            parents.append(('faq', f'faq_{i}', faq))
+        company_info = knowledge_base.get('company_info', {})
+        if company_info:
+            parents.append(('company_info', 'company_info', company_info))
             
-            Contatti:
-            - Servizio clienti: {doc.get('contact', {}).get('customer_service', '')}
-            - Email: {doc.get('contact', {}).get('email', '')}
-            - Sito web: {doc.get('contact', {}).get('website', '')}
-            """
+        # Ogni chunk conserva il riferimento al documento di origine
+        documents = []
+        parent_documents = {}
+        for doc_type, parent_id, data in parents:
+            parent_documents[f"{doc_type}:{parent_id}"] = data
+            title, sections = self._generate_document_sections(doc_type, data)
+            for n, text in enumerate(chunk_sections(sections, title=title)):
+                documents.append({
+                    'type': doc_type,
+                    'id': f"{parent_id}#{n}",
+                    'parent_id': parent_id,
+                    'chunk': n,
+                    'text': text
+                })
+        logger.info(f"Knowledge base suddivisa in {len(documents)} chunk da {len(parents)} documenti")
+        return parent_documents, documents
         
-        return json.dumps(doc)
+    def _generate_embeddings(self, chunks: List[Dict[str, Any]],
+                             on_progress: Optional[Callable[[int, int], None]] = None) -> tuple:
+        """Genera gli embedding dei chunk della knowledge base"""
+        # Genera solo gli embedding mancanti dall'archivio, con richieste concorrenti
+        builder = EmbeddingBuilder(self._invoke_embedding, EmbeddingStore(RAG_EMBEDDINGS_DIR, embedding_model_id))
+        documents, embeddings = builder.build(chunks, on_progress=on_progress)
+        self.embedding_metrics = builder.metrics
+        return documents, embeddings
     
-    def _generate_embeddings(self) -> tuple:
-        """Genera gli embedding per i documenti della knowledge base"""
-        documents = []
+    @staticmethod
+    def _missing_embeddings(chunks: List[Dict[str, Any]], documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Chunk senza embedding, cioè assenti dai documenti indicizzabili"""
+        indexed = {document_key(doc) for doc in documents}
+        return [chunk for chunk in chunks if document_key(chunk) not in indexed]
         
-        # Prodotti
-        for product in self.knowledge_base.get('products', []):
-            doc_text = self._generate_document_text('products', product)
-            documents.append({
-                'type': 'products',
-                'id': product.get('id'),
-                'text': doc_text,
-                'data': product
-            })
+    def retry_failed_embeddings(self) -> Dict[str, Any]:
+        """
+        Rigenera gli embedding dei chunk rimasti esclusi dalla ricerca vettoriale
         
-        # Offerte
-        for offer in self.knowledge_base.get('offers', []):
-            doc_text = self._generate_document_text('offers', offer)
-            documents.append({
-                'type': 'offers',
-                'id': offer.get('id'),
-                'text': doc_text,
-                'data': offer
-            })
+        Gli embedding già in archivio vengono riusati, quindi a Bedrock arrivano solo i chunk falliti;
+        quelli recuperati vengono aggiunti a una copia dell'indice, che sostituisce quella in uso.
         
-        # FAQ
-        for i, faq in enumerate(self.knowledge_base.get('faq', [])):
-            doc_text = self._generate_document_text('faq', faq)
-            documents.append({
-                'type': 'faq',
-                'id': f'faq_{i}',
-                'text': doc_text,
-                'data': faq
-            })
+        Returns:
+            dict: Chunk riprovati e chunk ancora senza embedding
+        """
+        with self._reload_lock:
+            retried = len(self.failed_embeddings)
+            if not retried:
+                return {'retried': 0, 'failed': 0}
+            documents, embeddings = self._generate_embeddings(self.chunks)
+            failed = self._missing_embeddings(self.chunks, documents)
+            if len(failed) < retried:
+                index = self._update_index(documents, embeddings, set())
+                with self._swap_lock:
+                    self.documents = documents
+                    self.embeddings = embeddings
+                    self.index = index
+                    self.failed_embeddings = failed
+            logger.info(f"Nuovo tentativo sugli embedding: {retried - len(failed)} recuperati, {len(failed)} ancora falliti")
+            return {'retried': retried, 'failed': len(failed)}
+            
+    def _schedule_embedding_retry(self) -> None:
+        """Programma un nuovo tentativo sugli embedding falliti, se ce ne sono e non è già programmato"""
+        with self._retry_lock:
+            if not self.failed_embeddings:
+                self._embedding_retry_delay = RAG_EMBED_RETRY_BASE
+                self._embedding_retry_at = None
+                return
+            if self._embedding_retry is not None or RAG_EMBED_RETRY_BASE <= 0:
+                return
+            delay = self._embedding_retry_delay
+            self._embedding_retry_delay = min(delay * 2, RAG_EMBED_RETRY_MAX)
+            self._embedding_retry_at = time.monotonic() + delay
+            self._embedding_retry = threading.Timer(delay, self._run_embedding_retry)
+            self._embedding_retry.name = 'embedding-retry'
+            self._embedding_retry.daemon = True
+            self._embedding_retry.start()
+        logger.warning(f"{len(self.failed_embeddings)} chunk senza embedding, nuovo tentativo tra {delay:.0f}s")
         
-        # Info azienda
-        company_info = self.knowledge_base.get('company_info', {})
-        if company_info:
-            doc_text = self._generate_document_text('company_info', company_info)
-            documents.append({
-                'type': 'company_info',
-                'id': 'company_info',
-                'text': doc_text,
-                'data': company_info
-            })
+    def _run_embedding_retry(self) -> None:
+        with self._retry_lock:
+            self._embedding_retry = None
+        try:
+            self.retry_failed_embeddings()
+        except Exception as e:
+            logger.error(f"Nuovo tentativo sugli embedding non riuscito: {e}")
+        self._schedule_embedding_retry()
         
-        # Genera embedding per ogni documento
-        embeddings = []
-        for doc in documents:
-            try:
-                embedding = self._get_embedding(doc['text'])
-                embeddings.append(embedding)
-            except Exception as e:
-                logger.error(f"Errore durante la generazione dell'embedding per {doc['id']}: {e}")
+    def _index_location(self, index: VectorIndex, documents: List[Dict[str, Any]]) -> tuple:
+        """Percorso e tag (hash dei testi indicizzati) dell'indice salvato su disco"""
+        path = os.path.join(RAG_EMBEDDINGS_DIR, f"index-{index.name}.npz")
+        tag = hash_text(''.join(hash_text(doc['text']) for doc in documents))
+        return path, tag
+        
+    def _build_index(self, documents: List[Dict[str, Any]], embeddings: np.ndarray) -> VectorIndex:
+        """
+        Indicizza gli embedding dei documenti con il backend configurato
+        
+        Gli indici approssimati vengono salvati accanto all'archivio degli embedding, così l'addestramento
+        si ripete solo quando cambiano i documenti.
+        """
+        keys = [document_key(doc) for doc in documents]
+        index = create_vector_index(len(keys))
+        if not keys:
+            return index
+            
+        persist = index.name != ExactIndex.name
+        if persist:
+            path, tag = self._index_location(index, documents)
+            saved = type(index).load(path, tag=tag)
+            if saved is not None:
+                logger.info(f"Indice {index.name} caricato da {path}")
+                return saved
+                
+        index.add(keys, embeddings)
+        if persist:
+            index.save(path, tag=tag)
+        logger.info(f"Indice {index.name} costruito su {len(index)} documenti")
+        return index
+        
+    def _update_index(self, documents: List[Dict[str, Any]], embeddings: np.ndarray,
+                      changed: set) -> VectorIndex:
+        """
+        Applica a una copia dell'indice corrente solo le differenze con i nuovi documenti
+        
+        L'indice in uso non viene modificato, quindi le ricerche in corso continuano su di esso;
+        si ricostruisce da zero solo se cambia il backend scelto per il numero di documenti.
+        
+        Args:
+            documents: Documenti indicizzabili, allineati alle righe di embeddings
+            embeddings: Matrice degli embedding
+            changed: Chiavi dei documenti il cui testo è cambiato
+        """
+        if len(self.index) == 0 or create_vector_index(len(documents)).name != self.index.name:
+            return self._build_index(documents, embeddings)
+            
+        keys = [document_key(doc) for doc in documents]
+        targets = set(keys)
+        index = self.index.copy()
+        index.remove([key for key in index.keys if key not in targets])
+        rows = [row for row, key in enumerate(keys) if key in changed or key not in index]
+        if rows:
+            index.add([keys[row] for row in rows], np.asarray(embeddings[rows]))
+        if index.name != ExactIndex.name:
+            path, tag = self._index_location(index, documents)
+            index.save(path, tag=tag)
+        logger.info(f"Indice {index.name} aggiornato: {len(rows)} vettori inseriti, {len(index)} documenti")
+        return index
+        
+    def reload(self) -> Dict[str, Any]:
+        """
+        Ricarica la knowledge base dai file JSON senza interrompere le ricerche
+        
+        I nuovi chunk vengono confrontati con quelli in uso tramite l'hash del testo: solo quelli
+        aggiunti o modificati vengono inviati a Bedrock per l'embedding (gli altri vengono riletti
+        dall'archivio), e gli indici BM25 e vettoriale vengono aggiornati in modo incrementale su
+        una copia. Lo stato viene poi sostituito tutto insieme: una ricerca vede sempre o la
+        versione precedente o quella nuova. Se la lettura dei file fallisce resta in uso la
+        versione corrente.
+        
+        Returns:
+            dict: Versione, numero di chunk aggiunti, modificati e rimossi, metriche degli embedding
+        """
+        with self._reload_lock:
+            start = time.perf_counter()
+            knowledge_base = self._load_knowledge_base()
+            catalog = self._build_catalog(knowledge_base)
+            parents, chunks = self._generate_chunks(knowledge_base)
+            documents_by_key = {document_key(doc): doc for doc in chunks}
+            
+            old_hashes = {key: hash_text(doc['text']) for key, doc in self.documents_by_key.items()}
+            new_hashes = {key: hash_text(doc['text']) for key, doc in documents_by_key.items()}
+            added = [key for key in new_hashes if key not in old_hashes]
+            removed = [key for key in old_hashes if key not in new_hashes]
+            changed = {key for key in new_hashes if key in old_hashes and new_hashes[key] != old_hashes[key]}
+            
+            summary = {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+            if not added and not removed and not changed:
+                with self._swap_lock:
+                    # Stessi chunk: cambiano al più i campi non indicizzati (es. la data di un'offerta)
+                    self.knowledge_base = knowledge_base
+                    self.catalog = catalog
+                    self.parents = parents
+                summary.update(version=self.version, seconds=round(time.perf_counter() - start, 3))
+                self.last_reload = summary
+                logger.info("Knowledge base ricaricata: nessun chunk modificato")
+                return summary
+                
+            lexical_index = self.lexical_index.copy()
+            lexical_index.remove(removed + list(changed))
+            lexical_index.add_many((key, documents_by_key[key]['text']) for key in added + list(changed))
+            
+            documents, embeddings = self._generate_embeddings(chunks)
+            failed_embeddings = self._missing_embeddings(chunks, documents)
+            index = self._update_index(documents, embeddings, changed)
+            
+            with self._swap_lock:
+                self.knowledge_base = knowledge_base
+                self.catalog = catalog
+                self.parents = parents
+                self.chunks = chunks
+                self.documents_by_key = documents_by_key
+                self.lexical_index = lexical_index
+                self.documents = documents
+                self.embeddings = embeddings
+                self.index = index
+                self.failed_embeddings = failed_embeddings
+                self.version += 1
+                self.loaded_at = time.time()
+            self._schedule_embedding_retry()
+                
+            summary.update(
+                version=self.version,
+                embeddings=self.embedding_metrics,
+                seconds=round(time.perf_counter() - start, 3)
+            )
+            self.last_reload = summary
+            logger.info(
+                f"Knowledge base ricaricata (versione {self.version}): {len(added)} chunk aggiunti, "
+                f"{len(changed)} modificati, {len(removed)} rimossi in {summary['seconds']}s"
+            )
+            return summary
+            
+    def knowledge_status(self) -> Dict[str, Any]:
+        """Versione della knowledge base in uso, chunk senza embedding e risultato dell'ultimo ricaricamento"""
+        status = {
+            'version': self.version,
+            'loaded_at': self.loaded_at,
+            'documents': len(self.parents),
+            'chunks': len(self.documents_by_key),
+            'indexed': len(self.index),
+            'embedding_failed': len(self.failed_embeddings),
+            'last_reload': self.last_reload
+        }
+        retry_at = self._embedding_retry_at
+        if retry_at is not None:
+            status['embedding_retry_in_seconds'] = round(max(0.0, retry_at - time.monotonic()), 1)
+        return status
+        
+    def _invoke_embedding(self, text: str) -> List[float]:
+        """Chiama Amazon Bedrock per l'embedding di un testo; gli errori vengono propagati"""
+        if self.bedrock_runtime is None:
+            raise RuntimeError("Client Bedrock non inizializzato")
+                
+        response = self.bedrock_runtime.invoke_model(
+            modelId=embedding_model_id,
+            body=json.dumps({
+                "inputText": text[:8000]  # Limita il testo a 8000 caratteri
+            })
+        )
+            
+        response_body = json.loads(response.get('body').read())
+        return response_body.get('embedding', [])
         
-        return documents, embeddings
-    
     def _get_embedding(self, text: str) -> List[float]:
         """Ottiene l'embedding per un testo utilizzando Amazon Bedrock"""
         try:
             if self.bedrock_runtime is None:
                 logger.warning("Client Bedrock non inizializzato, ritorno embedding vuoto")
                 return []
-                
-            response = self.bedrock_runtime.invoke_model(
-                modelId=embedding_model_id,
-                body=json.dumps({
-                    "inputText": text[:8000]  # Limita il testo a 8000 caratteri
-                })
+            embedding, shared = self.embedding_flight.do(
+                (embedding_model_id, text), lambda: self._invoke_embedding(text)
             )
-            
-            response_body = json.loads(response.get('body').read())
-            embedding = response_body.get('embedding', [])
-            return embedding
+            return list(embedding) if shared else embedding
         except Exception as e:
             logger.error(f"Errore durante la generazione dell'embedding: {e}")
             return []
     
-    def _cosine_similarity(self, a: List[float], b: List[float]) -> float:
-        """Calcola la similarità del coseno tra due vettori"""
-        if not a or not b:
-            return 0.0
+    def _get_query_embedding(self, query: str) -> List[float]:
+        """
+        Ottiene l'embedding di una query passando dalle cache
+        
+        Le query vengono normalizzate, così varianti di maiuscole e spazi condividono la stessa voce;
+        gli embedding vuoti (errori) non vengono salvati.
+        """
+        key = f"{embedding_model_id}:{normalize_query(query)}"
+        embedding = self.query_cache.get(key)
+        if embedding is not None:
+            return embedding
             
-        a = np.array(a)
-        b = np.array(b)
+        if self.shared_query_cache is not None:
+            value = self.shared_query_cache.get(key)
+            if value is not None:
+                embedding = np.frombuffer(value, dtype=np.float32)
+                self.query_cache.set(key, embedding)
+                return embedding
+                
+        embedding = self._get_embedding(query)
+        if len(embedding) > 0:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            self.query_cache.set(key, embedding)
+            if self.shared_query_cache is not None:
+                self.shared_query_cache.set(key, embedding.tobytes())
+        return embedding
+        
+    def cache_stats(self) -> Dict[str, Any]:
+        """Statistiche delle cache degli embedding delle query"""
+        stats = {'query_cache': self.query_cache.stats()}
+        if self.shared_query_cache is not None:
+            stats['shared_query_cache'] = self.shared_query_cache.stats()
+        stats['embedding_requests'] = self.embedding_flight.stats()
+        return stats
         
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    def get_parent_document(self, chunk: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Restituisce il documento completo da cui proviene un chunk"""
+        return self.parents.get(f"{chunk['type']}:{chunk['parent_id']}")
+        
+    def _fallback_documents(self, query: str) -> List[Dict[str, Any]]:
+        """Crea una risposta di fallback basata sulla query, usata quando non ci sono documenti indicizzati"""
+        if "tariffa" in query.lower() or "prezzo" in query.lower() or "costo" in query.lower():
+            return [{
+                'type': 'products',
+                'id': 'basic-home',
+                'text': "EnergyWise offre diverse tariffe, tra cui la tariffa base 'EnergyWise Casa Basic' a 9,90€/mese con un costo di 0,12€/kWh e la tariffa premium 'EnergyWise Eco Plus' con energia 100% rinnovabile a 12,90€/mese.",
+                'similarity': 0.95
+            }]
+        elif "eco" in query.lower() or "verde" in query.lower() or "rinnovabile" in query.lower():
+            return [{
+                'type': 'products',
+                'id': 'eco-plus',
+                'text': "Il piano 'EnergyWise Eco Plus' offre energia certificata 100% da fonti rinnovabili, report mensile di efficienza energetica, consulenza energetica gratuita e un programma fedeltà con punti convertibili in sconti.",
+                'similarity': 0.95
+            }]
+        elif "business" in query.lower() or "azienda" in query.lower() or "impresa" in query.lower():
+            return [{
+                'type': 'products',
+                'id': 'business-flex',
+                'text': "Il piano 'EnergyWise Business Flex' è pensato per piccole e medie imprese con tariffe differenziate per fasce orarie, assistenza prioritaria 24/7 e dashboard analitica avanzata.",
+                'similarity': 0.95
+            }]
+        elif "solare" in query.lower() or "pannelli" in query.lower() or "fotovoltaico" in query.lower():
+            return [{
+                'type': 'products',
+                'id': 'solar-home',
+                'text': "La soluzione 'EnergyWise Solar Home' include pannelli solari di ultima generazione, installazione e manutenzione incluse, sistema di monitoraggio in tempo reale e gestione pratiche per incentivi fiscali.",
+                'similarity': 0.95
+            }]
+        elif "offerta" in query.lower() or "promozione" in query.lower() or "sconto" in query.lower():
+            return [{
+                'type': 'offers',
+                'id': 'summer-promo-2025',
+                'text': "La 'Promozione Estate 2025' offre uno sconto del 30% per i primi 3 mesi attivando una fornitura entro il 31/07/2025.",
+                'similarity': 0.95
+            }]
+        else:
+            return [{
+                'type': 'company_info',
+                'id': 'company_info',
+                'text': "EnergyWise è un fornitore di energia elettrica e gas fondato nel 2015 con sede a Milano. La nostra missione è fornire energia sostenibile e accessibile, aiutando i clienti a ottimizzare i consumi e ridurre l'impatto ambientale.",
+                'similarity': 0.95
+            }]
     
     def retrieve_relevant_documents(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
         """Recupera i documenti più rilevanti per una query"""
-        if not self.documents or not self.embeddings:
+        return self.retrieve_relevant_documents_batch([query], top_k=top_k)[0]
+        
+    def retrieve_relevant_documents_batch(self, queries: List[str], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Recupera i documenti più rilevanti per più query con ricerca ibrida
+        
+        I risultati della ricerca vettoriale (un'unica ricerca sull'indice per tutte le query) e
+        quelli di BM25 vengono fusi con la reciprocal rank fusion. Se gli embedding non sono
+        disponibili la ricerca prosegue solo con BM25, senza chiamate a Bedrock.
+        
+        Args:
+            queries: Le query di ricerca
+            top_k: Numero massimo di documenti per query
+            
+        Returns:
+            list: Per ogni query, i documenti in ordine decrescente di punteggio fuso ('score'),
+                  con la similarità del coseno ('similarity') se trovati anche dalla ricerca vettoriale
+        """
+        # Riferimenti a una sola versione della knowledge base, anche se nel frattempo viene ricaricata
+        with self._swap_lock:
+            documents_by_key, lexical_index, index = self.documents_by_key, self.lexical_index, self.index
+            
+        if not documents_by_key:
             # Fallback con risposte predefinite se non ci sono documenti
             logger.warning("Nessun documento disponibile per la ricerca")
-            
-            # Crea una risposta di fallback basata sulla query
-            if "tariffa" in query.lower() or "prezzo" in query.lower() or "costo" in query.lower():
-                return [{
-                    'type': 'products',
-                    'id': 'basic-home',
-                    'text': "EnergyWise offre diverse tariffe, tra cui la tariffa base 'EnergyWise Casa Basic' a 9,90€/mese con un costo di 0,12€/kWh e la tariffa premium 'EnergyWise Eco Plus' con energia 100% rinnovabile a 12,90€/mese.",
-                    'similarity': 0.95
-                }]
-            elif "eco" in query.lower() or "verde" in query.lower() or "rinnovabile" in query.lower():
-                return [{
-                    'type': 'products',
-                    'id': 'eco-plus',
-                    'text': "Il piano 'EnergyWise Eco Plus' offre energia certificata 100% da fonti rinnovabili, report mensile di efficienza energetica, consulenza energetica gratuita e un programma fedeltà con punti convertibili in sconti.",
-                    'similarity': 0.95
-                }]
-            elif "business" in query.lower() or "azienda" in query.lower() or "impresa" in query.lower():
-                return [{
-                    'type': 'products',
-                    'id': 'business-flex',
-                    'text': "Il piano 'EnergyWise Business Flex' è pensato per piccole e medie imprese con tariffe differenziate per fasce orarie, assistenza prioritaria 24/7 e dashboard analitica avanzata.",
-                    'similarity': 0.95
-                }]
-            elif "solare" in query.lower() or "pannelli" in query.lower() or "fotovoltaico" in query.lower():
-                return [{
-                    'type': 'products',
-                    'id': 'solar-home',
-                    'text': "La soluzione 'EnergyWise Solar Home' include pannelli solari di ultima generazione, installazione e manutenzione incluse, sistema di monitoraggio in tempo reale e gestione pratiche per incentivi fiscali.",
-                    'similarity': 0.95
-                }]
-            elif "offerta" in query.lower() or "promozione" in query.lower() or "sconto" in query.lower():
-                return [{
-                    'type': 'offers',
-                    'id': 'summer-promo-2025',
-                    'text': "La 'Promozione Estate 2025' offre uno sconto del 30% per i primi 3 mesi attivando una fornitura entro il 31/07/2025.",
-                    'similarity': 0.95
-                }]
-            else:
-                return [{
-                    'type': 'company_info',
-                    'id': 'company_info',
-                    'text': "EnergyWise è un fornitore di energia elettrica e gas fondato nel 2015 con sede a Milano. La nostra missione è fornire energia sostenibile e accessibile, aiutando i clienti a ottimizzare i consumi e ridurre l'impatto ambientale.",
-                    'similarity': 0.95
-                }]
-            
-        # Genera embedding per la query
-        try:
-            query_embedding = self._get_embedding(query)
-        except Exception as e:
-            logger.error(f"Errore durante la generazione dell'embedding per la query: {e}")
-            return []
+            return [self._fallback_documents(query) for query in queries]
+            
+        vector_hits = [[] for _ in queries]
+        if len(index) > 0:
+            # Genera embedding per le query; una query senza embedding resta a zero e non produce risultati
+            query_matrix = np.zeros((len(queries), index.dim), dtype=np.float32)
+            for i, query in enumerate(queries):
+                try:
+                    query_embedding = self._get_query_embedding(query)
+                except Exception as e:
+                    logger.error(f"Errore durante la generazione dell'embedding per la query: {e}")
+                    continue
+                if len(query_embedding) == index.dim:
+                    query_matrix[i] = query_embedding
         
-        # Calcola similarità con tutti i documenti
-        similarities = []
-        for i, doc_embedding in enumerate(self.embeddings):
-            similarity = self._cosine_similarity(query_embedding, doc_embedding)
-            similarities.append((i, similarity))
-        
-        # Ordina per similarità decrescente
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        
-        # Prendi i top_k documenti più rilevanti
-        relevant_docs = []
-        for i, similarity in similarities[:top_k]:
-            if similarity > 0.5:  # Soglia minima di similarità
-                doc = self.documents[i].copy()
-                doc['similarity'] = similarity
+            vector_hits = [
+                [(key, similarity) for key, similarity in hits if similarity > MIN_SIMILARITY]
+                for hits in index.search(query_matrix, FUSION_CANDIDATES)
+            ]
+            
+        results = []
+        for query, hits in zip(queries, vector_hits):
+            lexical_hits = lexical_index.search(query, FUSION_CANDIDATES)
+            similarities = dict(hits)
+            fused = reciprocal_rank_fusion([[key for key, _ in hits], [key for key, _ in lexical_hits]])
+            
+            relevant_docs = []
+            for key, score in fused[:top_k]:
+                doc = documents_by_key[key].copy()
+                doc['score'] = score
+                if key in similarities:
+                    doc['similarity'] = similarities[key]
                 relevant_docs.append(doc)
-        
-        return relevant_docs
+            results.append(relevant_docs)
+        return results
     
-    def _create_agent(self) -> Agent:
-        """Crea l'agente con i tool necessari"""
+    def _create_agent(self, conversation_manager=None) -> Agent:
+        """
+        Crea un agente con i tool della knowledge base: il modello Bedrock è condiviso, la cronologia no
+        
+        Args:
+            conversation_manager: Gestione della cronologia (default: nessuna, per le domande singole)
+        """
         
         @tool
         def search_knowledge_base(query: str) -> str:
@@ -388,12 +734,12 @@ class RAGSystem:
             Returns:
                 str: Dettagli del prodotto in formato JSON
             """
-            for product in self.knowledge_base.get('products', []):
-                if product.get('id') == product_id:
-                    return json.dumps({
-                        "status": "success",
-                        "product": product
-                    })
+            product = self.catalog.get_product(product_id)
+            if product is not None:
+                return json.dumps({
+                    "status": "success",
+                    "product": product
+                })
             
             return json.dumps({
                 "status": "not_found",
@@ -408,17 +754,9 @@ class RAGSystem:
             Returns:
                 str: Offerte attive in formato JSON
             """
-            import datetime
-            today = datetime.datetime.now().strftime("%Y-%m-%d")
-            
-            active_offers = [
-                offer for offer in self.knowledge_base.get('offers', [])
-                if offer.get("valid_until") == "ongoing" or offer.get("valid_until", "") >= today
-            ]
-            
             return json.dumps({
                 "status": "success",
-                "offers": active_offers
+                "offers": self.catalog.active_offers()
             })
         
         # Definizione del prompt di sistema per l'agente
@@ -453,18 +791,33 @@ class RAGSystem:
             model=self.bedrock_model,
             tools=[search_knowledge_base, get_product_details, get_active_offers],
             system_prompt=SYSTEM_PROMPT,
-            callback_handler=callback_handler
+            callback_handler=callback_handler,
+            conversation_manager=conversation_manager or NullConversationManager()
         )
         
         return agent
     
-    def answer_question(self, question: str, bill_analysis: Optional[Dict[str, Any]] = None) -> str:
+    def _create_summary_agent(self) -> Agent:
+        """Agente senza tool che riassume la cronologia delle sessioni"""
+        return Agent(model=self.bedrock_model, system_prompt=SUMMARY_SYSTEM_PROMPT, callback_handler=None)
+        
+    def agent_stats(self) -> Dict[str, Any]:
+        """Sessioni di conversazione e token di prompt delle domande singole"""
+        return {
+            'chat_sessions': self.chat_sessions.stats(),
+            'one_shot': self.prompt_tokens.stats()
+        }
+        
+    def answer_question(self, question: str, bill_analysis: Optional[Dict[str, Any]] = None,
+                        session_id: Optional[str] = None) -> str:
         """
         Risponde a una domanda utilizzando il sistema RAG
         
         Args:
             question: La domanda dell'utente
             bill_analysis: Analisi della bolletta (opzionale)
+            session_id: ID della conversazione emesso dal server (opzionale); senza ID la domanda
+                        viene posta a un agente nuovo, senza cronologia condivisa con altri utenti
             
         Returns:
             str: Risposta alla domanda
@@ -490,8 +843,12 @@ class RAGSystem:
         try:
             logger.info("Invio richiesta all'agente RAG")
             
-            # Utilizziamo l'agente RAG
-            response = self.agent(prompt)
+            if session_id:
+                response = self.chat_sessions.run(session_id, prompt)
+            else:
+                agent = self._create_agent()
+                response = agent(prompt)
+                self.prompt_tokens.record(input_tokens(agent))
             result = response.message
             
             logger.info("Risposta ricevuta dall'agente RAG")
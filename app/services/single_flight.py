@@ -0,0 +1,71 @@
+"""
+Raggruppamento delle chiamate concorrenti identiche (single flight)
+"""
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Esegue una sola volta le chiamate con la stessa chiave che si sovrappongono nel tempo
+    
+    Il primo chiamante esegue la funzione; chi arriva con la stessa chiave mentre è in corso attende
+    lo stesso Future e riceve lo stesso risultato (o la stessa eccezione). Terminata la chiamata la
+    chiave viene liberata: le chiamate successive ripartono da capo (il riuso dei risultati è
+    compito delle cache). Il raggruppamento vale tra i thread dello stesso processo.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.executions = 0
+        self.coalesced = 0
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Esegue fn, oppure attende l'esecuzione già in corso con la stessa chiave
+        
+        Returns:
+            tuple: (risultato, shared) con shared=True se il risultato è stato prodotto da un'altra chiamata
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self._calls[key] = future
+                self.executions += 1
+                leader = True
+                
+        if not leader:
+            logger.info(f"Chiamata {self.name} già in corso, attesa del risultato condiviso")
+            return future.result(), True
+            
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+                
+    def stats(self) -> Dict[str, Any]:
+        """Esecuzioni effettive, chiamate raggruppate e chiamate in corso"""
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
@@ -1,9 +1,19 @@
 import os
+import sys
 import json
+import time
 import logging
 from dotenv import load_dotenv
 from strands import Agent, tool
-from strands.models import BedrockModel
+from strands.agent.conversation_manager import NullConversationManager
+
+from .agent_pool import SUMMARY_SYSTEM_PROMPT, PromptTokenStats, SessionAgentPool, input_tokens
+from .bedrock_client import create_bedrock_model, get_bedrock_runtime
+from .bill_extractor import (
+    BILL_EXTRACTION_MIN_CONFIDENCE, EXTRACTOR_VERSION,
+    build_narrative_prompt, extract_bill_fields, is_confident, merge_extraction
+)
+from .cache import get_analysis_cache, normalize_text
 
 # Configurazione del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -16,6 +26,20 @@ load_dotenv()
 region = os.getenv('AWS_REGION', 'us-east-1')
 model_id = os.getenv('BEDROCK_MODEL_ID', 'anthropic.claude-3-5-sonnet-20240620-v1:0')
 
+# Versioni dei prompt di analisi e confronto (da incrementare quando cambiano: invalidano la cache dei risultati)
+ANALYSIS_PROMPT_VERSION = '1'
+COMPARISON_PROMPT_VERSION = '1'
+
+# Modalità di analisi delle bollette: 'structured' (una sola chiamata Converse con output vincolato
+# allo schema JSON) o 'agent' (agente Strands con i tool); in caso di errore 'structured' passa all'agente
+ANALYSIS_MODE = os.getenv('ANALYSIS_MODE', 'structured')
+
+# Tool fittizio con cui il modello restituisce l'analisi in modalità 'structured'
+ANALYSIS_TOOL_NAME = 'record_bill_analysis'
+
+# Tipi Python corrispondenti ai tipi JSON Schema usati negli schemi di output
+JSON_TYPES = {'string': str, 'array': list, 'object': dict}
+
 # Definizione dei tool personalizzati per l'agente
 @tool
 def extract_bill_data(bill_text: str) -> str:
@@ -161,13 +185,8 @@ Quando confronti due bollette, devi:
 Rispondi sempre in formato JSON strutturato e ben formattato.
 """
 
-# Creazione del modello Bedrock con timeout aumentato
-bedrock_model = BedrockModel(
-    model_id=model_id,
-    region_name=region,
-    temperature=0.2,  # Temperatura bassa per risposte più deterministiche
-    timeout=120  # Timeout aumentato a 120 secondi
-)
+# Creazione del modello Bedrock sul client condiviso (timeout, pool e retry in bedrock_client)
+bedrock_model = create_bedrock_model(model_id, temperature=0.2)  # Temperatura bassa per risposte più deterministiche
 
 # Creazione dell'agente con callback per il logging
 def callback_handler(**kwargs):
@@ -177,20 +196,194 @@ def callback_handler(**kwargs):
         tool = kwargs["current_tool_use"]
         logger.info(f"Strands Agent using tool: {tool.get('name')}")
 
-# Creazione dell'agente
-bill_analyzer_agent = Agent(
-    model=bedrock_model,
-    tools=[extract_bill_data, analyze_consumption, generate_saving_tips, detect_anomalies, compare_bills_data],
-    system_prompt=SYSTEM_PROMPT,
-    callback_handler=callback_handler
-)
+def create_bill_agent(conversation_manager=None, handler=None):
+    """
+    Crea un agente per le bollette: il modello Bedrock è condiviso, la cronologia no
+    
+    Args:
+        conversation_manager: Gestione della cronologia (default: nessuna, per le chiamate singole)
+        handler: Callback degli eventi del modello (default: logging)
+    """
+    return Agent(
+        model=bedrock_model,
+        tools=[extract_bill_data, analyze_consumption, generate_saving_tips, detect_anomalies, compare_bills_data],
+        system_prompt=SYSTEM_PROMPT,
+        callback_handler=handler or callback_handler,
+        conversation_manager=conversation_manager or NullConversationManager()
+    )
+
+def _create_summary_agent():
+    """Agente senza tool che riassume la cronologia delle sessioni di chat"""
+    return Agent(model=bedrock_model, system_prompt=SUMMARY_SYSTEM_PROMPT, callback_handler=None)
+
+# Conversazioni di chat: un agente per sessione, con cronologia limitata e riassunta
+chat_sessions = SessionAgentPool(create_bill_agent, _create_summary_agent)
+
+# Token di prompt delle chiamate singole, eseguite con agenti nuovi senza cronologia
+prompt_token_stats = {name: PromptTokenStats() for name in ('analyze_bill', 'compare_with_previous', 'chat')}
+
+def _run_stateless(operation, prompt, handler=None):
+    """Esegue una chiamata singola con un agente nuovo e ne registra i token di prompt"""
+    agent = create_bill_agent(handler=handler)
+    response = agent(prompt)
+    prompt_token_stats[operation].record(input_tokens(agent))
+    return response
+
+def agent_stats():
+    """Statistiche degli agenti: sessioni di chat e token di prompt delle chiamate singole"""
+    return {
+        'chat_sessions': chat_sessions.stats(),
+        'one_shot': {name: stats.stats() for name, stats in prompt_token_stats.items()}
+    }
+
+def _analysis_prompt(bill_text):
+    """
+    Prompt di analisi di una bolletta, dopo l'estrazione locale dei dati
+    
+    Se l'estrattore deterministico ha trovato i dati principali con confidenza sufficiente, il
+    modello riceve solo quelli e scrive i campi descrittivi; altrimenti riceve il testo completo
+    ed estrae anche raw_data.
+    
+    Returns:
+        tuple: (prompt, risultato dell'estrazione, metodo 'rules' o 'model')
+    """
+    extraction = extract_bill_fields(bill_text)
+    if is_confident(extraction):
+        logger.info(f"Dati della bolletta estratti localmente (confidenza {extraction['confidence']}), al modello solo i campi descrittivi")
+        return build_narrative_prompt(extraction), extraction, 'rules'
+        
+    logger.info(f"Estrazione locale insufficiente (confidenza {extraction['confidence']}), analisi completa con il modello")
+    prompt = f"""
+    Analizza attentamente la seguente bolletta elettrica ed estrai SOLO i dati reali presenti nel testo. Non inventare o simulare dati non presenti.
+    
+    Ecco il testo della bolletta:
+    {bill_text}
+    
+    Rispondi in formato JSON con i seguenti campi:
+    - summary: riepilogo dei dati principali effettivamente trovati
+    - cost_breakdown: spiegazione delle voci di costo identificate nel testo
+    - saving_tips: consigli per risparmiare basati sui dati reali
+    - anomalies: eventuali anomalie rilevate nei dati
+    - raw_data: dati strutturati estratti (periodo, importo, consumi, etc.)
+    """
+    return prompt, extraction, 'model'
+
+def _analysis_schema(include_raw_data):
+    """
+    Schema JSON dell'analisi di una bolletta
+    
+    Args:
+        include_raw_data: True se il modello deve restituire anche i dati estratti (metodo 'model')
+    """
+    properties = {
+        "summary": {"type": "string", "description": "Riepilogo dei dati principali effettivamente trovati"},
+        "cost_breakdown": {"type": "string", "description": "Spiegazione delle voci di costo identificate"},
+        "saving_tips": {"type": "array", "items": {"type": "string"}, "description": "Consigli per risparmiare basati sui dati reali"},
+        "anomalies": {"type": "array", "items": {"type": "string"}, "description": "Anomalie rilevate nei dati (lista vuota se nessuna)"}
+    }
+    if include_raw_data:
+        properties["raw_data"] = {"type": "object", "description": "Dati strutturati estratti (periodo, importo, consumi, etc.)"}
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+def _validate_structured(data, schema):
+    """
+    Verifica l'output strutturato del modello rispetto allo schema
+    
+    Controlla i campi obbligatori e i tipi di primo livello (e degli elementi delle liste); una
+    stringa al posto di una lista di stringhe viene accettata come lista di un elemento. I campi
+    non previsti dallo schema vengono scartati.
+    
+    Raises:
+        ValueError: Se l'output non rispetta lo schema
+    """
+    if not isinstance(data, dict):
+        raise ValueError("L'output strutturato non è un oggetto JSON")
+    missing = [field for field in schema["required"] if field not in data]
+    if missing:
+        raise ValueError(f"Campi mancanti nell'output strutturato: {', '.join(missing)}")
+        
+    result = {}
+    for field, spec in schema["properties"].items():
+        if field not in data:
+            continue
+        value = data[field]
+        if spec["type"] == "array" and isinstance(value, str):
+            value = [value] if value.strip() else []
+        if not isinstance(value, JSON_TYPES[spec["type"]]):
+            raise ValueError(f"Tipo non valido per il campo {field}: atteso {spec['type']}")
+        if spec["type"] == "array" and not all(isinstance(item, JSON_TYPES[spec["items"]["type"]]) for item in value):
+            raise ValueError(f"Elementi non validi nel campo {field}")
+        result[field] = value
+    return result
+
+def _converse_structured(prompt, schema, callback_handler=None):
+    """
+    Una sola chiamata Bedrock Converse con output vincolato allo schema, senza ciclo agentico
+    
+    Il modello è obbligato (toolChoice) a "chiamare" un tool il cui input è lo schema dell'analisi,
+    quindi la risposta è già un oggetto JSON. Con un callback_handler la risposta viene letta in
+    streaming e i frammenti del JSON vengono passati al callback come data=...
+    
+    Returns:
+        tuple: (output validato, utilizzo dei token di Bedrock con inputTokens/outputTokens/totalTokens)
+        
+    Raises:
+        ValueError: Se il modello non restituisce un output conforme allo schema
+    """
+    bedrock_runtime = get_bedrock_runtime()
+    request = {
+        "modelId": model_id,
+        "system": [{"text": SYSTEM_PROMPT}],
+        "messages": [{"role": "user", "content": [{"text": prompt}]}],
+        "inferenceConfig": {"maxTokens": 4096, "temperature": 0.2},
+        "toolConfig": {
+            "tools": [{
+                "toolSpec": {
+                    "name": ANALYSIS_TOOL_NAME,
+                    "description": "Registra l'analisi della bolletta elettrica",
+                    "inputSchema": {"json": schema}
+                }
+            }],
+            "toolChoice": {"tool": {"name": ANALYSIS_TOOL_NAME}}
+        }
+    }
+    
+    if callback_handler:
+        response = bedrock_runtime.converse_stream(**request)
+        chunks = []
+        usage = {}
+        for event in response.get('stream'):
+            if 'contentBlockDelta' in event:
+                text = event['contentBlockDelta']['delta'].get('toolUse', {}).get('input', '')
+                if text:
+                    chunks.append(text)
+                    callback_handler(data=text)
+            elif 'metadata' in event:
+                usage = event['metadata'].get('usage', {})
+        try:
+            data = json.loads("".join(chunks))
+        except json.JSONDecodeError:
+            raise ValueError("L'output strutturato ricevuto in streaming non è JSON valido")
+    else:
+        response = bedrock_runtime.converse(**request)
+        usage = response.get('usage', {})
+        content = response.get('output', {}).get('message', {}).get('content', [])
+        data = next((block['toolUse']['input'] for block in content if 'toolUse' in block), None)
+        if data is None:
+            raise ValueError("Il modello non ha restituito l'output strutturato")
+            
+    return _validate_structured(data, schema), usage
 
-def analyze_bill(bill_text):
+def analyze_bill(bill_text, callback_handler=None):
     """
     Analizza il testo di una bolletta elettrica utilizzando l'agente Strands
     
     Args:
         bill_text: Testo estratto dalla bolletta
+        callback_handler: Callback opzionale che riceve gli eventi del modello man mano che
+                          arrivano (il testo generato è nella chiave 'data'); se il risultato viene
+                          dalla cache o da un'analisi identica in corso riceve solo result_source
+                          ('cache' o 'shared')
         
     Returns:
         dict: Risultato dell'analisi
@@ -200,25 +393,57 @@ def analyze_bill(bill_text):
             "error": "Il testo estratto dalla bolletta è insufficiente per l'analisi. Assicurati che il documento sia leggibile."
         }
     
-    prompt = f"""
-    Analizza attentamente la seguente bolletta elettrica ed estrai SOLO i dati reali presenti nel testo. Non inventare o simulare dati non presenti.
-
-    Ecco il testo della bolletta:
-    {bill_text}
+    # Stessa bolletta, stessi prompt e modello: il risultato salvato evita una nuova chiamata al modello.
+    # __name__ separa le voci da quelle di bill_analyzer, che usa prompt e percorsi diversi nella stessa cache
+    cache_parts = ('analyze_bill', __name__, ANALYSIS_PROMPT_VERSION, ANALYSIS_MODE, EXTRACTOR_VERSION,
+                   BILL_EXTRACTION_MIN_CONFIDENCE, model_id, normalize_text(bill_text))
+    on_reuse = (lambda source: callback_handler(result_source=source)) if callback_handler else None
+    return get_analysis_cache().get_or_compute(cache_parts, lambda: _analyze_bill(bill_text, callback_handler), on_reuse)
 
-    Rispondi in formato JSON con i seguenti campi:
-    - summary: riepilogo dei dati principali effettivamente trovati
-    - cost_breakdown: spiegazione delle voci di costo identificate nel testo
-    - saving_tips: consigli per risparmiare basati sui dati reali
-    - anomalies: eventuali anomalie rilevate nei dati
-    - raw_data: dati strutturati estratti (periodo, importo, consumi, etc.)
+class _StreamTracker:
+    """
+    Inoltra gli eventi di streaming al callback ricordando se è già stato inviato del testo
+    
+    Quando un percorso di analisi fallisce dopo aver emesso dei frammenti, reset() invia
+    reset=True al callback prima che il percorso successivo ricominci a trasmettere,
+    così il client può scartare la risposta parziale invece di concatenarla alla nuova.
     """
     
+    def __init__(self, handler):
+        self.handler = handler
+        self.emitted = False
+        
+    def __call__(self, **kwargs):
+        if kwargs.get('data'):
+            self.emitted = True
+        self.handler(**kwargs)
+        
+    def reset(self):
+        if self.emitted:
+            self.handler(reset=True)
+            self.emitted = False
+
+def _analyze_bill(bill_text, callback_handler=None):
+    """Analisi di una bolletta (chiamata strutturata o agente Strands), senza passare dalla cache"""
+    prompt, extraction, method = _analysis_prompt(bill_text)
+    tracker = _StreamTracker(callback_handler) if callback_handler else None
+    
+    if ANALYSIS_MODE == 'structured':
+        try:
+            result, usage = _converse_structured(prompt, _analysis_schema(method == 'model'), tracker)
+            prompt_token_stats['analyze_bill'].record(usage.get('inputTokens', 0))
+            logger.info(f"Analisi strutturata completata: {usage.get('inputTokens')} token in ingresso, {usage.get('outputTokens')} in uscita")
+            return merge_extraction(result, extraction, method)
+        except Exception as e:
+            logger.error(f"Analisi strutturata non riuscita, uso dell'agente Strands: {e}")
+            if tracker:
+                tracker.reset()
+    
     try:
         logger.info("Invio richiesta all'agente Strands per analisi bolletta")
         
-        # Utilizziamo l'agente Strands
-        response = bill_analyzer_agent(prompt)
+        # Utilizziamo un agente Strands senza cronologia
+        response = _run_stateless('analyze_bill', prompt, tracker)
         result = response.message
         
         logger.info("Risposta ricevuta dall'agente Strands")
@@ -228,24 +453,26 @@ def analyze_bill(bill_text):
             # Cerca di estrarre il JSON dalla risposta
             if '```json' in result:
                 json_str = result.split('```json')[1].split('```')[0].strip()
-                return json.loads(json_str)
+                return merge_extraction(json.loads(json_str), extraction, method)
             else:
-                return json.loads(result)
+                return merge_extraction(json.loads(result), extraction, method)
         except json.JSONDecodeError:
             logger.error("Impossibile analizzare la risposta come JSON")
             # Se non riesce a decodificare il JSON, restituisci la risposta come testo
-            return {
+            return merge_extraction({
                 "error": "Impossibile analizzare la risposta come JSON", 
                 "raw_response": result,
                 "summary": "Errore nell'elaborazione della risposta. Controlla il testo estratto."
-            }
+            }, extraction, method)
             
     except Exception as e:
         logger.error(f"Errore durante l'analisi della bolletta con Strands Agent: {e}")
         
         # Fallback a boto3 diretto in caso di errore
         logger.info("Fallback a boto3 diretto")
-        return fallback_analyze_bill(bill_text)
+        if tracker:
+            tracker.reset()
+        return fallback_analyze_bill(bill_text, tracker)
 
 def compare_with_previous(current_bill, previous_bill=None):
     """
@@ -264,6 +491,12 @@ def compare_with_previous(current_bill, previous_bill=None):
             "comparison": None
         }
     
+    cache_parts = ('compare_with_previous', __name__, COMPARISON_PROMPT_VERSION, model_id,
+                   json.dumps(current_bill, sort_keys=True), json.dumps(previous_bill, sort_keys=True))
+    return get_analysis_cache().get_or_compute(cache_parts, lambda: _compare_with_previous(current_bill, previous_bill))
+
+def _compare_with_previous(current_bill, previous_bill):
+    """Confronto tra due bollette con l'agente Strands, senza passare dalla cache"""
     prompt = f"""
     Confronta la bolletta corrente con quella precedente e identifica SOLO differenze reali basate sui dati forniti. Non inventare o simulare dati non presenti.
 
@@ -284,8 +517,8 @@ def compare_with_previous(current_bill, previous_bill=None):
     try:
         logger.info("Invio richiesta all'agente Strands per confronto bollette")
         
-        # Utilizziamo l'agente Strands
-        response = bill_analyzer_agent(prompt)
+        # Utilizziamo un agente Strands senza cronologia
+        response = _run_stateless('compare_with_previous', prompt)
         result = response.message
         
         logger.info("Risposta ricevuta dall'agente Strands")
@@ -314,13 +547,15 @@ def compare_with_previous(current_bill, previous_bill=None):
         logger.info("Fallback a boto3 diretto")
         return fallback_compare_with_previous(current_bill, previous_bill)
 
-def chat_with_assistant(user_input, bill_analysis=None):
+def chat_with_assistant(user_input, bill_analysis=None, session_id=None):
     """
     Chatta con l'assistente per ottenere informazioni sulla bolletta utilizzando l'agente Strands
     
     Args:
         user_input: Domanda dell'utente
         bill_analysis: Risultato dell'analisi della bolletta (opzionale)
+        session_id: ID della conversazione (opzionale); con un ID l'assistente ricorda le domande
+                    precedenti della stessa sessione, senza ID risponde a una domanda singola
         
     Returns:
         str: Risposta dell'assistente
@@ -342,8 +577,11 @@ def chat_with_assistant(user_input, bill_analysis=None):
     try:
         logger.info("Invio richiesta all'agente Strands per chat con assistente")
         
-        # Utilizziamo l'agente Strands
-        response = bill_analyzer_agent(prompt)
+        # Agente della sessione (cronologia limitata) o agente senza cronologia per le domande singole
+        if session_id:
+            response = chat_sessions.run(session_id, prompt)
+        else:
+            response = _run_stateless('chat', prompt)
         result = response.message
         
         logger.info("Risposta ricevuta dall'agente Strands")
@@ -357,80 +595,67 @@ def chat_with_assistant(user_input, bill_analysis=None):
         return fallback_chat_with_assistant(user_input, bill_analysis)
 
 # Funzioni di fallback che utilizzano boto3 direttamente
-def fallback_analyze_bill(bill_text):
+def fallback_analyze_bill(bill_text, callback_handler=None):
     """
     Funzione di fallback che utilizza boto3 direttamente per analizzare la bolletta
-    """
-    import boto3
-    from botocore.config import Config
     
-    prompt = f"""
-    Analizza attentamente la seguente bolletta elettrica ed estrai SOLO i dati reali presenti nel testo. Non inventare o simulare dati non presenti.
-
-    Ecco il testo della bolletta:
-    {bill_text}
-
-    Rispondi in formato JSON con i seguenti campi:
-    - summary: riepilogo dei dati principali effettivamente trovati
-    - cost_breakdown: spiegazione delle voci di costo identificate nel testo
-    - saving_tips: consigli per risparmiare basati sui dati reali
-    - anomalies: eventuali anomalie rilevate nei dati
-    - raw_data: dati strutturati estratti (periodo, importo, consumi, etc.)
+    Con un callback_handler la risposta viene letta in streaming e ogni frammento di testo
+    viene passato al callback come data=...
     """
+    prompt, extraction, method = _analysis_prompt(bill_text)
     
     try:
-        bedrock_runtime = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=region,
-            config=Config(
-                read_timeout=120,
-                connect_timeout=60,
-                retries={'max_attempts': 3}
-            )
-        )
+        bedrock_runtime = get_bedrock_runtime()
         
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4096,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            })
-        )
+        request_body = json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 4096,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ]
+        })
         
-        response_body = json.loads(response.get('body').read())
-        result = response_body.get('content')[0].get('text')
+        if callback_handler:
+            # Streaming dei token: il chiamante li riceve appena generati
+            response = bedrock_runtime.invoke_model_with_response_stream(modelId=model_id, body=request_body)
+            chunks = []
+            for event in response.get('body'):
+                chunk = json.loads(event['chunk']['bytes'])
+                if chunk.get('type') == 'content_block_delta':
+                    text = chunk.get('delta', {}).get('text', '')
+                    chunks.append(text)
+                    callback_handler(data=text)
+            result = "".join(chunks)
+        else:
+            response = bedrock_runtime.invoke_model(modelId=model_id, body=request_body)
+            response_body = json.loads(response.get('body').read())
+            result = response_body.get('content')[0].get('text')
         
         # Estrai il JSON dalla risposta
         try:
             if '```json' in result:
                 json_str = result.split('```json')[1].split('```')[0].strip()
-                return json.loads(json_str)
+                return merge_extraction(json.loads(json_str), extraction, method)
             else:
-                return json.loads(result)
+                return merge_extraction(json.loads(result), extraction, method)
         except json.JSONDecodeError:
-            return {
+            return merge_extraction({
                 "error": "Impossibile analizzare la risposta come JSON", 
                 "raw_response": result,
                 "summary": "Errore nell'elaborazione della risposta. Controlla il testo estratto."
-            }
+            }, extraction, method)
             
     except Exception as e:
         logger.error(f"Errore durante l'analisi della bolletta con fallback: {e}")
-        return {"error": str(e)}
+        return merge_extraction({"error": str(e)}, extraction, method)
 
 def fallback_compare_with_previous(current_bill, previous_bill=None):
     """
     Funzione di fallback che utilizza boto3 direttamente per confrontare le bollette
     """
-    import boto3
-    from botocore.config import Config
-    
     if not previous_bill:
         return {
             "message": "Nessuna bolletta precedente disponibile per il confronto",
@@ -455,15 +680,7 @@ def fallback_compare_with_previous(current_bill, previous_bill=None):
     """
     
     try:
-        bedrock_runtime = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=region,
-            config=Config(
-                read_timeout=120,
-                connect_timeout=60,
-                retries={'max_attempts': 3}
-            )
-        )
+        bedrock_runtime = get_bedrock_runtime()
         
         response = bedrock_runtime.invoke_model(
             modelId=model_id,
@@ -504,9 +721,6 @@ def fallback_chat_with_assistant(user_input, bill_analysis=None):
     """
     Funzione di fallback che utilizza boto3 direttamente per chattare con l'assistente
     """
-    import boto3
-    from botocore.config import Config
-    
     context = ""
     if bill_analysis:
         context = f"Analisi della bolletta: {json.dumps(bill_analysis, indent=2)}\n\n"
@@ -522,15 +736,7 @@ def fallback_chat_with_assistant(user_input, bill_analysis=None):
     """
     
     try:
-        bedrock_runtime = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=region,
-            config=Config(
-                read_timeout=120,
-                connect_timeout=60,
-                retries={'max_attempts': 3}
-            )
-        )
+        bedrock_runtime = get_bedrock_runtime()
         
         response = bedrock_runtime.invoke_model(
             modelId=model_id,
@@ -553,3 +759,57 @@ def fallback_chat_with_assistant(user_input, bill_analysis=None):
     except Exception as e:
         logger.error(f"Errore durante la chat con l'assistente con fallback: {e}")
         return f"Mi dispiace, si è verificato un errore: {str(e)}"
+
+def benchmark(bill_texts):
+    """
+    Confronta l'analisi strutturata (una chiamata Converse) con l'agente Strands sulle stesse bollette
+    
+    Entrambi i percorsi ricevono lo stesso prompt e nessuno dei due passa dalla cache dei risultati;
+    l'agente viene ricreato per ogni bolletta, così la conversazione precedente non ne gonfia il prompt.
+    
+    Args:
+        bill_texts: Testi estratti dalle bollette
+        
+    Returns:
+        list: Una riga per bolletta e modalità con latenza (s), token in ingresso e in uscita e
+              numero di chiamate al modello
+    """
+    rows = []
+    for index, bill_text in enumerate(bill_texts):
+        prompt, extraction, method = _analysis_prompt(bill_text)
+        
+        start = time.perf_counter()
+        _, usage = _converse_structured(prompt, _analysis_schema(method == 'model'))
+        rows.append({
+            'bill': index,
+            'mode': 'structured',
+            'seconds': time.perf_counter() - start,
+            'input_tokens': usage.get('inputTokens', 0),
+            'output_tokens': usage.get('outputTokens', 0),
+            'model_calls': 1
+        })
+        
+        agent = create_bill_agent()
+        start = time.perf_counter()
+        response = agent(prompt)
+        elapsed = time.perf_counter() - start
+        usage = response.metrics.accumulated_usage
+        rows.append({
+            'bill': index,
+            'mode': 'agent',
+            'seconds': elapsed,
+            'input_tokens': usage.get('inputTokens', 0),
+            'output_tokens': usage.get('outputTokens', 0),
+            'model_calls': response.metrics.cycle_count
+        })
+    return rows
+
+if __name__ == '__main__':
+    # python -m app.services.strands_agent bolletta1.txt [bolletta2.txt ...] (testi già estratti dall'OCR)
+    texts = []
+    for path in sys.argv[1:]:
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+    for result in benchmark(texts):
+        print(f"bolletta {result['bill']} {result['mode']:>10} {result['seconds']:7.2f} s  "
+              f"in={result['input_tokens']:<6} out={result['output_tokens']:<5} chiamate={result['model_calls']}")
@@ -0,0 +1,424 @@
+"""
+Indici vettoriali per la ricerca nella knowledge base: esatto (forza bruta) e approssimato (IVF)
+"""
+import os
+import copy
+import json
+import time
+import logging
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Configurazione dell'indice: 'auto' usa l'indice approssimato solo oltre RAG_ANN_MIN_DOCS documenti
+RAG_INDEX = os.getenv('RAG_INDEX', 'auto')  # 'auto', 'exact' o 'ivf'
+RAG_ANN_MIN_DOCS = int(os.getenv('RAG_ANN_MIN_DOCS', '5000'))
+RAG_IVF_LISTS = int(os.getenv('RAG_IVF_LISTS', '0'))  # 0 = circa la radice quadrata del numero di documenti
+RAG_IVF_NPROBE = int(os.getenv('RAG_IVF_NPROBE', '8'))  # Liste visitate per query: più liste, più recall e più latenza
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 20000  # Vettori massimi usati per l'addestramento dei centroidi
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Restituisce una copia contigua float32 della matrice con righe di norma unitaria (le righe nulle restano nulle)"""
+    matrix = np.array(matrix, dtype=np.float32, order='C')
+    if matrix.size == 0:
+        return matrix
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix /= norms
+    return matrix
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indici dei top_k punteggi più alti in ordine decrescente, senza ordinare l'intero vettore"""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.array([], dtype=np.intp)
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates])]
+
+class VectorIndex:
+    """
+    Interfaccia comune degli indici vettoriali
+    
+    I vettori sono identificati da chiavi stringa e confrontati con la similarità del coseno;
+    add sostituisce i vettori di chiavi già presenti, quindi serve sia per inserire sia per aggiornare.
+    """
+    
+    name = "base"
+    
+    def __init__(self):
+        self.keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        
+    def __len__(self) -> int:
+        return len(self.keys)
+        
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+        
+    def copy(self) -> 'VectorIndex':
+        """Copia indipendente dell'indice, da modificare mentre l'originale continua a servire le ricerche"""
+        return copy.deepcopy(self)
+        
+    @property
+    def dim(self) -> int:
+        return self.vectors.shape[1] if self.vectors.ndim == 2 else 0
+        
+    def add(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        """Inserisce o sostituisce i vettori associati alle chiavi"""
+        vectors = normalize_rows(vectors)
+        if len(keys) != len(vectors):
+            raise ValueError("Numero di chiavi e di vettori diverso")
+        if len(keys) == 0:
+            return
+        if len(self) == 0:
+            self.vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimensione dei vettori {vectors.shape[1]} diversa da quella dell'indice {self.dim}")
+            
+        new_rows = []
+        # Con chiavi ripetute nello stesso inserimento vale l'ultimo vettore
+        for key, vector in dict(zip(keys, vectors)).items():
+            row = self._rows.get(key)
+            if row is None:
+                self._rows[key] = len(self.keys) + len(new_rows)
+                new_rows.append((key, vector))
+            else:
+                self.vectors[row] = vector
+                self._on_update(row)
+        if new_rows:
+            start = len(self.keys)
+            self.keys.extend(key for key, _ in new_rows)
+            self.vectors = np.vstack([self.vectors, np.stack([vector for _, vector in new_rows])])
+            self._on_append(start)
+            
+    def remove(self, keys: Sequence[str]) -> None:
+        """Rimuove le chiavi indicate (le chiavi assenti vengono ignorate)"""
+        rows = sorted((self._rows[key] for key in keys if key in self._rows), reverse=True)
+        for row in rows:
+            # L'ultima riga prende il posto di quella rimossa: nessuna copia della matrice
+            last = len(self.keys) - 1
+            removed_key = self.keys[row]
+            if row != last:
+                self.vectors[row] = self.vectors[last]
+                self.keys[row] = self.keys[last]
+                self._rows[self.keys[row]] = row
+            self._on_move(last, row)
+            self.keys.pop()
+            del self._rows[removed_key]
+            self.vectors = self.vectors[:last]
+            
+    def search(self, queries: np.ndarray, top_k: int) -> List[List[Tuple[str, float]]]:
+        """
+        Cerca i vettori più simili a ciascuna query
+        
+        Args:
+            queries: Matrice (n_query, dimensione) delle query
+            top_k: Numero massimo di risultati per query
+            
+        Returns:
+            list: Per ogni query, coppie (chiave, similarità) in ordine decrescente
+        """
+        raise NotImplementedError
+        
+    def train(self) -> None:
+        """Prepara l'indice per la ricerca (nessuna operazione per gli indici che non si addestrano)"""
+        
+    def _on_append(self, start: int) -> None:
+        """Notifica l'aggiunta delle righe da start in poi"""
+        
+    def _on_update(self, row: int) -> None:
+        """Notifica la sostituzione del vettore di una riga"""
+        
+    def _on_move(self, source: int, target: int) -> None:
+        """Notifica lo spostamento della riga source in target (source viene poi eliminata)"""
+        
+    def _state(self) -> Dict[str, np.ndarray]:
+        """Array aggiuntivi da salvare con l'indice"""
+        return {}
+        
+    def _load_state(self, arrays) -> None:
+        """Ripristina gli array aggiuntivi salvati da _state"""
+        
+    def save(self, path: str, tag: str = '') -> None:
+        """
+        Salva l'indice in un file .npz, con scrittura atomica
+        
+        Args:
+            path: Percorso del file
+            tag: Etichetta libera per riconoscere i dati indicizzati (es. un hash dei documenti)
+        """
+        meta = {'backend': self.name, 'keys': self.keys, 'tag': tag, 'params': self._params()}
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, vectors=self.vectors, meta=np.array(json.dumps(meta)), **self._state())
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Salvataggio dell'indice {path} fallito: {e}")
+            
+    def _params(self) -> Dict[str, int]:
+        return {}
+        
+    @classmethod
+    def load(cls, path: str, tag: Optional[str] = None) -> Optional['VectorIndex']:
+        """
+        Carica un indice salvato con save
+        
+        Returns:
+            VectorIndex: L'indice, oppure None se il file manca, è di un altro backend o ha un tag diverso
+        """
+        try:
+            with np.load(path) as arrays:
+                meta = json.loads(str(arrays['meta']))
+                if meta.get('backend') != cls.name or (tag is not None and meta.get('tag') != tag):
+                    return None
+                index = cls(**meta.get('params', {}))
+                index.vectors = np.array(arrays['vectors'], dtype=np.float32, order='C')
+                index.keys = list(meta['keys'])
+                index._rows = {key: row for row, key in enumerate(index.keys)}
+                index._load_state(arrays)
+                return index
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Lettura dell'indice {path} fallita: {e}")
+            return None
+            
+    def _results(self, scores: np.ndarray, rows: np.ndarray, top_k: int) -> List[Tuple[str, float]]:
+        """Converte i punteggi di un insieme di righe candidate nei top_k risultati"""
+        return [(self.keys[rows[i]], float(scores[i])) for i in top_k_indices(scores, top_k)]
+
+class ExactIndex(VectorIndex):
+    """Ricerca esatta: un prodotto matriciale con tutti i vettori indicizzati"""
+    
+    name = "exact"
+    
+    def search(self, queries: np.ndarray, top_k: int) -> List[List[Tuple[str, float]]]:
+        queries = normalize_rows(queries)
+        if len(self) == 0:
+            return [[] for _ in range(len(queries))]
+        all_rows = np.arange(len(self))
+        return [self._results(row, all_rows, top_k) for row in queries @ self.vectors.T]
+
+class IVFIndex(VectorIndex):
+    """
+    Ricerca approssimata a file invertiti (IVF)
+    
+    I vettori sono raggruppati con k-means sferico in n_lists liste; una query confronta i
+    centroidi e poi solo i vettori delle n_probe liste più vicine. n_probe regola il compromesso
+    tra recall e latenza: con n_probe = n_lists la ricerca è esatta.
+    
+    I centroidi vengono addestrati al primo inserimento e riaddestrati quando l'indice è cresciuto
+    oltre il doppio rispetto all'ultimo addestramento; nel frattempo i nuovi vettori sono assegnati
+    al centroide più vicino. Addestramento e riordino delle liste avvengono in add, remove e train,
+    quindi sulla copia che RAGSystem modifica prima dello scambio: search non modifica l'indice e
+    può essere eseguita da più thread contemporaneamente.
+    """
+    
+    name = "ivf"
+    
+    def __init__(self, n_lists: int = None, n_probe: int = None):
+        super().__init__()
+        self.n_lists = n_lists if n_lists is not None else RAG_IVF_LISTS
+        self.n_probe = n_probe or RAG_IVF_NPROBE
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self._trained_size = 0
+        self._lists: Optional[np.ndarray] = None
+        
+    def _params(self) -> Dict[str, int]:
+        return {'n_lists': self.n_lists, 'n_probe': self.n_probe}
+        
+    def _state(self) -> Dict[str, np.ndarray]:
+        return {
+            'centroids': self.centroids,
+            'assignments': self.assignments,
+            'trained_size': np.array(self._trained_size)
+        }
+        
+    def _load_state(self, arrays) -> None:
+        self.centroids = np.array(arrays['centroids'], dtype=np.float32)
+        self.assignments = np.array(arrays['assignments'], dtype=np.int32)
+        self._trained_size = int(arrays['trained_size'])
+        self._compact()
+        
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if len(self.centroids) == 0:
+            return np.zeros(len(vectors), dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        
+    def _on_append(self, start: int) -> None:
+        self.assignments = np.concatenate([self.assignments, self._assign(self.vectors[start:])])
+        self._lists = None
+        
+    def _on_update(self, row: int) -> None:
+        self.assignments[row] = self._assign(self.vectors[row:row + 1])[0]
+        self._lists = None
+        
+    def _on_move(self, source: int, target: int) -> None:
+        self.assignments[target] = self.assignments[source]
+        self.assignments = self.assignments[:source]
+        self._lists = None
+        
+    def add(self, keys: Sequence[str], vectors: np.ndarray) -> None:
+        super().add(keys, vectors)
+        self._refresh()
+        
+    def remove(self, keys: Sequence[str]) -> None:
+        super().remove(keys)
+        self._refresh()
+        
+    def train(self) -> None:
+        """Addestra i centroidi con k-means sferico e riassegna tutti i vettori"""
+        n = len(self)
+        if n == 0:
+            return
+        n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+        n_lists = max(1, min(n_lists, n))
+        rng = np.random.default_rng(0)
+        sample = self.vectors
+        if n > KMEANS_SAMPLE:
+            sample = self.vectors[rng.choice(n, KMEANS_SAMPLE, replace=False)]
+            
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(labels, kind='stable')
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            present = counts > 0
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+            sums[present] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = ~present
+            # Le liste rimaste vuote ripartono da vettori casuali
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = normalize_rows(sums)
+            
+        self.centroids = centroids
+        self.assignments = self._assign(self.vectors)
+        self._trained_size = n
+        logger.info(f"Indice IVF addestrato: {n} vettori in {n_lists} liste")
+        self._compact()
+        
+    def _refresh(self) -> None:
+        """Dopo una modifica: riaddestra se l'indice è raddoppiato, altrimenti riordina le liste"""
+        if len(self) > 2 * self._trained_size or (len(self) > 0 and len(self.centroids) == 0):
+            self.train()
+        else:
+            self._compact()
+            
+    def _compact(self) -> None:
+        """
+        Riordina le righe per lista e ricalcola i limiti delle liste nella matrice dei vettori
+        
+        Ogni lista diventa una porzione contigua della matrice, così la ricerca non deve copiare i
+        vettori candidati.
+        """
+        if len(self) == 0 or len(self.centroids) == 0:
+            self._lists = None
+            return
+        order = np.argsort(self.assignments, kind='stable')
+        if np.any(order != np.arange(len(order))):
+            self.vectors = self.vectors[order]
+            self.assignments = self.assignments[order]
+            self.keys = [self.keys[row] for row in order]
+            self._rows = {key: row for row, key in enumerate(self.keys)}
+        self._lists = np.searchsorted(self.assignments, np.arange(len(self.centroids) + 1))
+        
+    def search(self, queries: np.ndarray, top_k: int, n_probe: int = None) -> List[List[Tuple[str, float]]]:
+        """
+        Cerca i vettori più simili a ciascuna query
+        
+        Args:
+            queries: Matrice (n_query, dimensione) delle query
+            top_k: Numero massimo di risultati per query
+            n_probe: Liste da visitare (default: self.n_probe)
+        """
+        queries = normalize_rows(queries)
+        bounds = self._lists
+        if len(self) == 0 or bounds is None:
+            return [[] for _ in range(len(queries))]
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        
+        results = []
+        for query, centroid_scores in zip(queries, queries @ self.centroids.T):
+            probed = top_k_indices(centroid_scores, n_probe)
+            rows = np.concatenate([np.arange(bounds[i], bounds[i + 1]) for i in probed])
+            scores = np.concatenate([self.vectors[bounds[i]:bounds[i + 1]] @ query for i in probed])
+            results.append(self._results(scores, rows, top_k))
+        return results
+
+INDEX_BACKENDS = {
+    ExactIndex.name: ExactIndex,
+    IVFIndex.name: IVFIndex
+}
+
+def create_vector_index(n_documents: int = 0, backend: str = None) -> VectorIndex:
+    """
+    Crea un indice vuoto del backend configurato
+    
+    Args:
+        n_documents: Numero di documenti previsto, usato dalla modalità 'auto'
+        backend: 'exact', 'ivf' o 'auto' (default: RAG_INDEX)
+    """
+    backend = backend or RAG_INDEX
+    if backend == 'auto':
+        backend = IVFIndex.name if n_documents >= RAG_ANN_MIN_DOCS else ExactIndex.name
+    if backend not in INDEX_BACKENDS:
+        logger.warning(f"Indice vettoriale sconosciuto '{backend}', uso la ricerca esatta")
+        backend = ExactIndex.name
+    return INDEX_BACKENDS[backend]()
+
+def benchmark(n_documents: int = 50000, dim: int = 1536, n_queries: int = 200, top_k: int = 3,
+              n_probes: Sequence[int] = (1, 4, 8, 16, 32)) -> List[Dict[str, float]]:
+    """
+    Confronta latenza e recall dell'indice IVF con la ricerca esatta su dati sintetici raggruppati
+    
+    Returns:
+        list: Una riga per configurazione con latenza media per query (ms) e recall@top_k
+    """
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(max(1, n_documents // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n_documents)] + 1.5 * rng.normal(size=(n_documents, dim)).astype(np.float32)
+    queries = centers[rng.integers(len(centers), size=n_queries)] + 1.5 * rng.normal(size=(n_queries, dim)).astype(np.float32)
+    keys = [str(i) for i in range(n_documents)]
+    
+    exact = ExactIndex()
+    exact.add(keys, vectors)
+    # Le query vengono cercate una alla volta, come nelle richieste della chat
+    start = time.perf_counter()
+    truth = [exact.search(query[None, :], top_k)[0] for query in queries]
+    rows = [{'backend': 'exact', 'n_probe': 0, 'ms_per_query': (time.perf_counter() - start) * 1000 / n_queries, 'recall': 1.0}]
+    
+    ivf = IVFIndex()
+    start = time.perf_counter()
+    ivf.add(keys, vectors)
+    logger.info(f"Addestramento IVF: {time.perf_counter() - start:.2f}s")
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        found = [ivf.search(query[None, :], top_k, n_probe=n_probe)[0] for query in queries]
+        elapsed = time.perf_counter() - start
+        hits = sum(len({key for key, _ in f} & {key for key, _ in t}) for f, t in zip(found, truth))
+        rows.append({
+            'backend': 'ivf',
+            'n_probe': n_probe,
+            'ms_per_query': elapsed * 1000 / n_queries,
+            'recall': hits / max(1, sum(len(t) for t in truth))
+        })
+    return rows
+
+if __name__ == '__main__':
+    # python -m app.services.vector_index
+    for result in benchmark():
+        print(f"{result['backend']:>6} n_probe={result['n_probe']:<3} {result['ms_per_query']:8.3f} ms/query  recall={result['recall']:.3f}")
@@ -0,0 +1,167 @@
+"""
+Inizializzazione in background dei componenti lenti da costruire (RAG, chatbot)
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+from dotenv import load_dotenv
+
+# Configurazione del logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Carica le variabili d'ambiente
+load_dotenv()
+
+# Attesa prima di ritentare una costruzione fallita: raddoppia a ogni tentativo fino al massimo
+WARMUP_RETRY_BASE = float(os.getenv('WARMUP_RETRY_BASE', '5'))
+WARMUP_RETRY_MAX = float(os.getenv('WARMUP_RETRY_MAX', '300'))
+
+# Stati dell'inizializzazione
+STATE_PENDING = 'pending'
+STATE_WARMING = 'warming'
+STATE_READY = 'ready'
+STATE_FAILED = 'failed'
+
+class BackgroundInitializer:
+    """
+    Costruisce un oggetto in un thread separato e ne espone l'avanzamento
+    
+    La factory riceve una funzione progress(stage, **details) con cui segnalare la fase in corso
+    (es. 'embedding' con done/total); finché non ha terminato get() restituisce None, così chi
+    serve le richieste può rispondere subito invece di attendere la costruzione.
+    
+    Se la costruzione fallisce lo stato diventa 'failed' e lo stesso thread la ritenta dopo un'attesa
+    che raddoppia a ogni tentativo (da retry_base fino a retry_max secondi), finché non riesce.
+    """
+    
+    def __init__(self, factory: Callable[[Callable[..., None]], Any], name: str,
+                 retry_base: float = None, retry_max: float = None):
+        """
+        Inizializza il costruttore in background
+        
+        Args:
+            factory: Funzione che riceve la callback di avanzamento e restituisce l'oggetto
+            name: Nome del componente, usato nei log e nello stato
+            retry_base: Secondi di attesa prima del primo nuovo tentativo (default: WARMUP_RETRY_BASE)
+            retry_max: Attesa massima tra due tentativi (default: WARMUP_RETRY_MAX)
+        """
+        self.factory = factory
+        self.name = name
+        self.retry_base = WARMUP_RETRY_BASE if retry_base is None else retry_base
+        self.retry_max = WARMUP_RETRY_MAX if retry_max is None else retry_max
+        self._instance: Optional[Any] = None
+        self._state = STATE_PENDING
+        self._stage: Optional[str] = None
+        self._details: Dict[str, Any] = {}
+        self._error: Optional[str] = None
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._attempts = 0
+        self._retry_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        
+    def start(self) -> None:
+        """Avvia la costruzione (le chiamate successive non hanno effetto)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._state = STATE_WARMING
+            self._started_at = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name=f"warmup-{self.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Inizializzazione di {self.name} avviata in background")
+        
+    def _progress(self, stage: str, **details: Any) -> None:
+        """Registra la fase in corso; i dettagli restano finché la fase non cambia"""
+        with self._lock:
+            if stage != self._stage:
+                self._stage = stage
+                self._details = {}
+            self._details.update(details)
+            
+    def _run(self) -> None:
+        delay = self.retry_base
+        while True:
+            with self._lock:
+                self._attempts += 1
+            try:
+                instance = self.factory(self._progress)
+            except Exception as e:
+                with self._lock:
+                    self._state = STATE_FAILED
+                    self._error = str(e)
+                    self._finished_at = time.monotonic()
+                    self._retry_at = self._finished_at + delay
+                logger.error(f"Inizializzazione di {self.name} fallita (tentativo {self._attempts}), nuovo tentativo tra {delay:.0f}s: {e}")
+                # Chi attende con wait() viene sbloccato anche dal fallimento
+                self._done.set()
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+                with self._lock:
+                    self._done.clear()
+                    self._state = STATE_WARMING
+                    self._stage = None
+                    self._details = {}
+                    self._retry_at = None
+                    self._started_at = time.monotonic()
+                    self._finished_at = None
+                continue
+                
+            with self._lock:
+                self._instance = instance
+                self._state = STATE_READY
+                self._error = None
+                self._finished_at = time.monotonic()
+            logger.info(f"{self.name} pronto in {self._finished_at - self._started_at:.1f}s")
+            self._done.set()
+            return
+            
+    @property
+    def ready(self) -> bool:
+        return self._state == STATE_READY
+        
+    def get(self) -> Optional[Any]:
+        """Restituisce l'oggetto se pronto, altrimenti None (avviando la costruzione se necessario)"""
+        if self._thread is None:
+            self.start()
+        return self._instance
+        
+    def wait(self, timeout: Optional[float] = None) -> Optional[Any]:
+        """Attende la fine del tentativo in corso per al più timeout secondi e restituisce l'oggetto"""
+        if self._thread is None:
+            self.start()
+        self._done.wait(timeout)
+        return self._instance
+        
+    def status(self) -> Dict[str, Any]:
+        """
+        Stato dell'inizializzazione
+        
+        Returns:
+            dict: name, state (pending/warming/ready/failed), stage, details della fase, attempts,
+                  elapsed_seconds del tentativo corrente e, se l'ultimo è fallito, error e
+                  retry_in_seconds (attesa prima del prossimo tentativo)
+        """
+        with self._lock:
+            if self._started_at is None:
+                elapsed = 0.0
+            else:
+                elapsed = (self._finished_at or time.monotonic()) - self._started_at
+            status = {
+                'name': self.name,
+                'state': self._state,
+                'stage': self._stage,
+                'details': dict(self._details),
+                'attempts': self._attempts,
+                'elapsed_seconds': round(elapsed, 3)
+            }
+            if self._error:
+                status['error'] = self._error
+            if self._retry_at is not None:
+                status['retry_in_seconds'] = round(max(0.0, self._retry_at - time.monotonic()), 1)
+            return status
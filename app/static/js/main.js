@@ -77,7 +77,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const formData = new FormData();
         formData.append('file', file);
         
-        const response = await fetch('/upload', {
+        // Upload asincrono: il server restituisce subito l'ID del job di analisi
+        const response = await fetch('/upload?async=1', {
             method: 'POST',
             body: formData
         });
@@ -87,7 +88,29 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         const data = await response.json();
-        return data.analysis;
+        return await waitForJob(data.job_id);
+    }
+    
+    // Funzione per attendere il completamento di un job (long-polling)
+    async function waitForJob(jobId) {
+        let version = -1;
+        
+        while (true) {
+            const response = await fetch(`/api/jobs/${jobId}?wait=30&version=${version}`);
+            
+            if (!response.ok) {
+                throw new Error('Errore durante il recupero dello stato dell\'analisi');
+            }
+            
+            const job = await response.json();
+            if (job.status === 'completed') {
+                return job.result.analysis;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Analisi non riuscita');
+            }
+            version = job.version;
+        }
     }
     
     // Funzione per confrontare due bollette
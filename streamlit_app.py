@@ -1,15 +1,12 @@
 import streamlit as st
 import os
 import tempfile
-import json
+import uuid
 import logging
 from dotenv import load_dotenv
-from PIL import Image
 from pdf2image import convert_from_path
-import pytesseract
 from streamlit_chat import message
 from streamlit_extras.colored_header import colored_header
-from streamlit_extras.add_vertical_space import add_vertical_space
 from app.services.document_processor import process_document
 from app.services.strands_agent import analyze_bill, compare_with_previous, chat_with_assistant
 
@@ -27,304 +24,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# Funzioni di utilità
-def process_image(image_path):
-    """
-    Estrae il testo da un'immagine usando OCR
-    """
-    try:
-        logger.info(f"Elaborazione immagine: {image_path}")
-        image = Image.open(image_path)
-        
-        # Migliora la qualità dell'immagine per OCR
-        # Converti in scala di grigi
-        image = image.convert('L')
-        
-        # Prova con diverse lingue in ordine di priorità
-        languages = ['spa', 'eng']
-        text = ""
-        
-        for lang in languages:
-            try:
-                logger.info(f"Tentativo di OCR con lingua: {lang}")
-                text = pytesseract.image_to_string(image, lang=lang)
-                if text and len(text.strip()) > 10:
-                    logger.info(f"OCR riuscito con lingua: {lang}")
-                    break
-            except Exception as e:
-                logger.warning(f"OCR fallito con lingua {lang}: {e}")
-        
-        if not text or len(text.strip()) < 10:
-            # Se tutte le lingue falliscono, prova senza specificare la lingua
-            logger.warning("Tentativo di OCR senza specificare la lingua")
-            text = pytesseract.image_to_string(image)
-        
-        if not text or len(text.strip()) < 10:
-            logger.warning(f"Poco o nessun testo estratto dall'immagine: {image_path}")
-        else:
-            logger.info(f"Testo estratto con successo dall'immagine: {len(text)} caratteri")
-        
-        return text
-    except Exception as e:
-        logger.error(f"Errore durante l'elaborazione dell'immagine: {e}")
-        st.error(f"Errore durante l'elaborazione dell'immagine: {e}")
-        return ""
-
-def process_pdf(pdf_path):
-    """
-    Converte un PDF in immagini ed estrae il testo usando OCR
-    """
-    try:
-        logger.info(f"Elaborazione PDF: {pdf_path}")
-        with tempfile.TemporaryDirectory() as path:
-            # Converti PDF in immagini
-            images = convert_from_path(pdf_path, output_folder=path, dpi=300)
-            
-            if not images:
-                logger.warning(f"Nessuna immagine estratta dal PDF: {pdf_path}")
-                return ""
-            
-            logger.info(f"Estratte {len(images)} pagine dal PDF")
-            
-            text = ""
-            # Prova con diverse lingue in ordine di priorità
-            languages = ['spa', 'eng']
-            
-            for i, image in enumerate(images):
-                # Converti in scala di grigi per migliorare OCR
-                image = image.convert('L')
-                
-                page_text = ""
-                for lang in languages:
-                    try:
-                        logger.info(f"Tentativo di OCR sulla pagina {i+1} con lingua: {lang}")
-                        page_text = pytesseract.image_to_string(image, lang=lang)
-                        if page_text and len(page_text.strip()) > 10:
-                            logger.info(f"OCR riuscito sulla pagina {i+1} con lingua: {lang}")
-                            break
-                    except Exception as e:
-                        logger.warning(f"OCR fallito sulla pagina {i+1} con lingua {lang}: {e}")
-                
-                if not page_text or len(page_text.strip()) < 10:
-                    # Se tutte le lingue falliscono, prova senza specificare la lingua
-                    logger.warning(f"Tentativo di OCR sulla pagina {i+1} senza specificare la lingua")
-                    page_text = pytesseract.image_to_string(image)
-                text += f"--- PAGINA {i+1} ---\n{page_text}\n\n"
-            
-            if not text or len(text.strip()) < 10:
-                logger.warning(f"Poco o nessun testo estratto dal PDF: {pdf_path}")
-            else:
-                logger.info(f"Testo estratto con successo dal PDF: {len(text)} caratteri")
-            
-            return text
-    except Exception as e:
-        logger.error(f"Errore durante l'elaborazione del PDF: {e}")
-        st.error(f"Errore durante l'elaborazione del PDF: {e}")
-        return ""
-
-def process_document(file_path):
-    """
-    Processa un documento (immagine o PDF) ed estrae il testo
-    """
-    if not os.path.exists(file_path):
-        logger.error(f"File non trovato: {file_path}")
-        return ""
-    
-    file_extension = os.path.splitext(file_path)[1].lower()
-    
-    if file_extension in ['.jpg', '.jpeg', '.png']:
-        return process_image(file_path)
-    elif file_extension == '.pdf':
-        return process_pdf(file_path)
-    else:
-        logger.error(f"Formato file non supportato: {file_extension}")
-        return ""
-
-def analyze_bill(bill_text):
-    """
-    Analizza il testo di una bolletta elettrica utilizzando Claude 3.5 Sonnet
-    """
-    if not bill_text or len(bill_text.strip()) < 50:
-        return {
-            "error": "Il testo estratto dalla bolletta è insufficiente per l'analisi. Assicurati che il documento sia leggibile."
-        }
-    
-    prompt = f"""
-    Sei un assistente specializzato nell'analisi delle bollette elettriche spagnole. Analizza attentamente la seguente bolletta elettrica ed estrai SOLO i dati reali presenti nel testo. Non inventare o simulare dati non presenti.
-
-    1. Estrai i dati principali (periodo di fatturazione, importo totale, consumi in kWh)
-    2. Identifica le voci di costo specifiche presenti nella bolletta
-    3. Identifica eventuali anomalie o incongruenze nei consumi o nei costi
-    4. Fornisci consigli pratici basati ESCLUSIVAMENTE sui dati reali estratti
-
-    Se alcuni dati non sono presenti o non possono essere estratti con certezza, indica chiaramente "Dato non disponibile" invece di inventare informazioni.
-
-    Ecco il testo della bolletta:
-    {bill_text}
-
-    Rispondi in formato JSON con i seguenti campi:
-    - summary: riepilogo dei dati principali effettivamente trovati
-    - cost_breakdown: spiegazione delle voci di costo identificate nel testo
-    - saving_tips: consigli per risparmiare basati sui dati reali
-    - anomalies: eventuali anomalie rilevate nei dati
-    - raw_data: dati strutturati estratti (periodo, importo, consumi, etc.)
-    """
-    
-    try:
-        logger.info("Invio richiesta a Bedrock per analisi bolletta")
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4096,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            })
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        result = response_body.get('content')[0].get('text')
-        logger.info("Risposta ricevuta da Bedrock")
-        
-        # Estrai il JSON dalla risposta
-        try:
-            # Cerca di estrarre il JSON dalla risposta
-            if '```json' in result:
-                json_str = result.split('```json')[1].split('```')[0].strip()
-                return json.loads(json_str)
-            else:
-                return json.loads(result)
-        except json.JSONDecodeError:
-            logger.error("Impossibile analizzare la risposta come JSON")
-            # Se non riesce a decodificare il JSON, restituisci la risposta come testo
-            return {
-                "error": "Impossibile analizzare la risposta come JSON", 
-                "raw_response": result,
-                "summary": "Errore nell'elaborazione della risposta. Controlla il testo estratto."
-            }
-            
-    except Exception as e:
-        logger.error(f"Errore durante l'analisi della bolletta: {e}")
-        return {"error": str(e)}
-
-def compare_with_previous(current_bill, previous_bill):
-    """
-    Confronta la bolletta corrente con una precedente
-    """
-    prompt = f"""
-    Sei un assistente specializzato nell'analisi delle bollette elettriche spagnole. Confronta la bolletta corrente con quella precedente e identifica SOLO differenze reali basate sui dati forniti. Non inventare o simulare dati non presenti.
-
-    1. Identifica differenze nei consumi (kWh) se presenti in entrambe le bollette
-    2. Identifica differenze nei costi se presenti in entrambe le bollette
-    3. Identifica possibili errori o anomalie basati ESCLUSIVAMENTE sui dati forniti
-    4. Suggerisci motivi plausibili per eventuali aumenti o diminuzioni
-    5. Fornisci suggerimenti per contestare eventuali errori al call center SOLO se ci sono anomalie evidenti
-
-    Se alcuni dati non sono presenti o non possono essere confrontati con certezza, indica chiaramente "Confronto non disponibile" invece di inventare informazioni.
-
-    Bolletta corrente:
-    {json.dumps(current_bill, indent=2)}
-
-    Bolletta precedente:
-    {json.dumps(previous_bill, indent=2)}
-
-    Rispondi in formato JSON con i seguenti campi:
-    - consumption_diff: differenza nei consumi con percentuale (solo se i dati sono disponibili)
-    - cost_diff: differenza nei costi con percentuale (solo se i dati sono disponibili)
-    - anomalies: eventuali anomalie o errori rilevati (solo se evidenti dai dati)
-    - explanation: possibili spiegazioni per le differenze (basate sui dati reali)
-    - complaint_tips: suggerimenti per contestare eventuali errori (solo se necessario)
-    """
-    
-    try:
-        logger.info("Invio richiesta a Bedrock per confronto bollette")
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 4096,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            })
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        result = response_body.get('content')[0].get('text')
-        logger.info("Risposta ricevuta da Bedrock")
-        
-        # Estrai il JSON dalla risposta
-        try:
-            # Cerca di estrarre il JSON dalla risposta
-            if '```json' in result:
-                json_str = result.split('```json')[1].split('```')[0].strip()
-                return json.loads(json_str)
-            else:
-                return json.loads(result)
-        except json.JSONDecodeError:
-            logger.error("Impossibile analizzare la risposta come JSON")
-            # Se non riesce a decodificare il JSON, restituisci la risposta come testo
-            return {
-                "error": "Impossibile analizzare la risposta come JSON", 
-                "raw_response": result,
-                "message": "Errore nell'elaborazione del confronto. Controlla i dati forniti."
-            }
-            
-    except Exception as e:
-        logger.error(f"Errore durante il confronto delle bollette: {e}")
-        return {"error": str(e)}
-
-def chat_with_assistant(user_input, bill_analysis=None):
-    """
-    Chatta con l'assistente per ottenere informazioni sulla bolletta
-    """
-    context = ""
-    if bill_analysis:
-        context = f"Analisi della bolletta: {json.dumps(bill_analysis, indent=2)}\n\n"
-    
-    prompt = f"""
-    {context}
-    
-    Sei un assistente specializzato nell'aiutare i clienti a comprendere le loro bollette elettriche e a risparmiare energia.
-    Rispondi alla seguente domanda del cliente in modo chiaro, conciso e utile.
-    Basa le tue risposte ESCLUSIVAMENTE sui dati reali presenti nell'analisi della bolletta.
-    Se l'informazione richiesta non è disponibile nei dati, indica chiaramente che non puoi rispondere a quella domanda specifica.
-    
-    Domanda del cliente: {user_input}
-    """
-    
-    try:
-        logger.info("Invio richiesta a Bedrock per chat con assistente")
-        response = bedrock_runtime.invoke_model(
-            modelId=model_id,
-            body=json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 2048,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            })
-        )
-        
-        response_body = json.loads(response.get('body').read())
-        result = response_body.get('content')[0].get('text')
-        logger.info("Risposta ricevuta da Bedrock")
-        return result
-            
-    except Exception as e:
-        logger.error(f"Errore durante la chat con l'assistente: {e}")
-        return f"Mi dispiace, si è verificato un errore: {str(e)}"
-
 # Interfaccia utente
 def main():
     # Sidebar
@@ -364,6 +63,9 @@ def main():
         st.session_state.comparison_result = None
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
+    if 'chat_session_id' not in st.session_state:
+        # ID della conversazione con l'agente, generato qui sul server per ogni sessione Streamlit
+        st.session_state.chat_session_id = uuid.uuid4().hex
     if 'extracted_text' not in st.session_state:
         st.session_state.extracted_text = None
     if 'prev_extracted_text' not in st.session_state:
@@ -634,7 +336,9 @@ def main():
                 
                 # Ottieni la risposta dall'assistente
                 with st.spinner("L'assistente sta rispondendo..."):
-                    bot_response = chat_with_assistant(user_input, st.session_state.current_bill_analysis)
+                    bot_response = chat_with_assistant(
+                        user_input, st.session_state.current_bill_analysis, st.session_state.chat_session_id
+                    )
                 
                 # Aggiorna l'ultima risposta nella cronologia
                 st.session_state.chat_history[-1] = (user_input, bot_response)
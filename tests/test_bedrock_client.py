@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import bedrock_client
+from app.services.bedrock_client import create_bedrock_model, get_bedrock_runtime, get_boto_session, get_client_config
+
+
+def test_client_config_uses_pool_and_retry_settings():
+    config = get_client_config()
+    assert config.max_pool_connections == bedrock_client.BEDROCK_MAX_POOL_CONNECTIONS
+    assert config.read_timeout == bedrock_client.BEDROCK_READ_TIMEOUT
+    assert config.connect_timeout == bedrock_client.BEDROCK_CONNECT_TIMEOUT
+    assert config.tcp_keepalive
+    assert config.retries == {'max_attempts': bedrock_client.BEDROCK_MAX_ATTEMPTS, 'mode': bedrock_client.BEDROCK_RETRY_MODE}
+
+
+def test_one_shared_client_across_threads(monkeypatch):
+    monkeypatch.setattr(bedrock_client, '_session', None)
+    monkeypatch.setattr(bedrock_client, '_runtime_client', None)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        clients = list(pool.map(lambda _: get_bedrock_runtime(), range(32)))
+
+    assert all(client is clients[0] for client in clients)
+    assert get_boto_session() is get_boto_session()
+    assert clients[0].meta.service_model.service_name == 'bedrock-runtime'
+    assert clients[0].meta.region_name == bedrock_client.region
+    assert clients[0].meta.config.max_pool_connections == bedrock_client.BEDROCK_MAX_POOL_CONNECTIONS
+
+
+def test_strands_models_reuse_the_shared_client():
+    models = [create_bedrock_model('model-a', 0.2), create_bedrock_model('model-b', 0.7)]
+    assert all(model.client is get_bedrock_runtime() for model in models)
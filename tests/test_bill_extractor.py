@@ -0,0 +1,113 @@
+import re
+
+import pytest
+
+from app.services.bill_extractor import (
+    GENERIC_LABELS, extract_bill_fields, is_confident, parse_number
+)
+
+
+def spanish_bill(tax_label='Impuesto sobre electricidad'):
+    """Testo OCR di una bolletta spagnola con tutte le voci principali"""
+    return f"""
+    Iberdrola Clientes S.A.U.
+    CUPS: ES 0021 0000 0000 0000 AB
+    Periodo de facturación: 01/03/2024 - 31/03/2024
+    Consumo total 250 kWh
+    Término de potencia 12,40 €
+    Término de energía 45,30 €
+    {tax_label} 2,95 €
+    IVA 21% s/ 60,65 € 12,74 €
+    Total importe factura 73,39 €
+    """
+
+
+def italian_bill():
+    """Testo OCR di una bolletta italiana con tutte le voci principali"""
+    return """
+    Enel Energia S.p.A.
+    POD IT001E12345678
+    Periodo di fatturazione dal 01/02/2024 al 29/02/2024
+    Consumo fatturato 180 kWh
+    Quota potenza 8,20 €
+    Spesa per la materia energia 38,10 €
+    Accise 3,15 €
+    IVA 10% 4,95 €
+    Totale da pagare 54,40 €
+    """
+
+
+@pytest.mark.parametrize('label', [
+    'Impuesto sobre electricidad',
+    'Impuesto sobre la electricidad',
+    'Impuesto especial sobre la electricidad',
+    'Impuesto especial sobre electricidad',
+    'Impuesto electricidad',
+    'Impuesto eléctrico',
+])
+def test_spanish_electricity_tax_labels(label):
+    assert any(re.search(pattern, label, re.IGNORECASE) for pattern in GENERIC_LABELS['es']['electricity_tax'])
+    raw_data = extract_bill_fields(spanish_bill(label))['raw_data']
+    assert raw_data['taxes']['electricity_tax'] == 2.95
+
+
+def test_extract_spanish_bill():
+    extraction = extract_bill_fields(spanish_bill())
+    raw_data = extraction['raw_data']
+    assert extraction['supplier'] == 'iberdrola'
+    assert extraction['language'] == 'es'
+    assert raw_data['supply_point'] == {'type': 'CUPS', 'code': 'ES0021000000000000AB'}
+    assert raw_data['billing_period'] == {'start': '2024-03-01', 'end': '2024-03-31', 'days': 31}
+    assert raw_data['consumption_kwh'] == 250
+    assert raw_data['power_term'] == 12.40
+    assert raw_data['energy_term'] == 45.30
+    assert raw_data['taxes'] == {'vat': 12.74, 'electricity_tax': 2.95}
+    assert raw_data['total_amount'] == 73.39
+    assert extraction['missing'] == []
+    assert is_confident(extraction)
+
+
+def test_extract_italian_bill():
+    extraction = extract_bill_fields(italian_bill())
+    raw_data = extraction['raw_data']
+    assert extraction['supplier'] == 'enel'
+    assert extraction['language'] == 'it'
+    assert raw_data['supply_point'] == {'type': 'POD', 'code': 'IT001E12345678'}
+    assert raw_data['billing_period'] == {'start': '2024-02-01', 'end': '2024-02-29', 'days': 29}
+    assert raw_data['consumption_kwh'] == 180
+    assert raw_data['taxes'] == {'vat': 4.95, 'electricity_tax': 3.15}
+    assert raw_data['total_amount'] == 54.40
+    assert is_confident(extraction)
+
+
+def test_components_above_total_halve_confidence():
+    text = spanish_bill().replace('Total importe factura 73,39 €', 'Total importe factura 20,00 €')
+    extraction = extract_bill_fields(text)
+    assert extraction['raw_data']['total_amount'] == 20.00
+    assert extraction['confidence'] == 0.5
+    assert not is_confident(extraction)
+
+
+def test_unit_prices_are_not_amounts():
+    extraction = extract_bill_fields("Término de energía 250 kWh x 0,1523 €/kWh 38,08 €\nIVA 21% 8,00 €\nTotal a pagar 46,08 €")
+    assert extraction['raw_data']['energy_term'] == 38.08
+    assert extraction['raw_data']['taxes'] == {'vat': 8.00}
+    assert extraction['raw_data']['total_amount'] == 46.08
+
+
+def test_empty_text():
+    extraction = extract_bill_fields('')
+    assert extraction['raw_data'] == {}
+    assert extraction['confidence'] == 0
+    assert not is_confident(extraction)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1.234,56', 1234.56),
+    ('45,30', 45.30),
+    ('45.30', 45.30),
+    ('1.234', 1234),
+    ('1,234.56', 1234.56),
+])
+def test_parse_number(text, expected):
+    assert parse_number(text) == expected
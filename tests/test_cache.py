@@ -0,0 +1,82 @@
+import os
+
+from app.services.cache import DiskLRUCache, SQLiteCache, TTLLRUCache, hash_file
+
+
+def age_entries(cache, *keys):
+    """Assegna alle voci tempi di modifica crescenti, nell'ordine indicato (la prima è la meno recente)"""
+    for age, key in enumerate(keys):
+        os.utime(cache._path(key), (1_000_000 + age, 1_000_000 + age))
+
+
+def test_disk_cache_round_trip(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'ocr'), max_bytes=1024)
+    assert cache.get('missing') is None
+    cache.set('a', 'testo della bolletta àèì')
+    assert cache.get('a') == 'testo della bolletta àèì'
+    cache.clear()
+    assert cache.get('a') is None
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskLRUCache(str(tmp_path / 'ocr'), max_bytes=250)
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key * 100)
+    # Tre voci da 100 byte superano il limite: una viene rimossa
+    assert sum(cache.get(key) is not None for key in ('a', 'b', 'c')) == 2
+
+    cache.clear()
+    cache.max_bytes = 1000
+    for key in ('a', 'b', 'c'):
+        cache.set(key, key * 100)
+    age_entries(cache, 'a', 'b', 'c')
+    # La lettura rende 'a' la voce usata più di recente
+    assert cache.get('a') == 'a' * 100
+    cache.max_bytes = 250
+    cache.set('d', 'd' * 100)
+    assert cache.get('b') is None
+    assert cache.get('c') is None
+    assert cache.get('a') == 'a' * 100 and cache.get('d') == 'd' * 100
+
+
+def test_hash_file_depends_on_content_only(tmp_path):
+    first, second, other = tmp_path / 'uno.pdf', tmp_path / 'due.pdf', tmp_path / 'altro.pdf'
+    first.write_bytes(b'%PDF-1.4 bolletta')
+    second.write_bytes(b'%PDF-1.4 bolletta')
+    other.write_bytes(b'%PDF-1.4 altra bolletta')
+    assert hash_file(str(first), chunk_size=4) == hash_file(str(second))
+    assert hash_file(str(first)) != hash_file(str(other))
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = TTLLRUCache(max_entries=2, ttl=60)
+    cache.set('a', [0.1])
+    cache.set('b', [0.2])
+    assert cache.get('a') == [0.1]
+    cache.set('c', [0.3])
+    assert cache.get('b') is None
+    assert cache.get('a') == [0.1] and cache.get('c') == [0.3]
+    assert cache.stats() == {'entries': 2, 'hits': 3, 'misses': 1, 'hit_rate': 0.75}
+
+
+def test_memory_cache_expires_entries():
+    cache = TTLLRUCache(max_entries=10, ttl=0)
+    cache.set('a', [0.1])
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_sqlite_cache_round_trip_and_expiry(tmp_path):
+    path = str(tmp_path / 'cache' / 'results.db')
+    cache = SQLiteCache(path, ttl=60)
+    cache.set('a', b'{"summary": "ok"}')
+    assert cache.get('a') == b'{"summary": "ok"}'
+    # Il file è condiviso: un'altra istanza (es. un altro worker) legge le stesse voci
+    assert SQLiteCache(path, ttl=60).get('a') == b'{"summary": "ok"}'
+
+    expired = SQLiteCache(path, ttl=0)
+    expired.set('b', b'{}')
+    assert expired.get('b') is None
+    cache.clear()
+    assert cache.get('a') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
@@ -0,0 +1,58 @@
+import datetime
+
+from app.services.catalog_index import CatalogIndex
+
+PRODUCTS = [
+    {'id': 'luce-fissa', 'type': 'electricity'},
+    {'id': 'gas-casa', 'type': 'gas'},
+    {'id': 'luce-verde', 'type': 'electricity'},
+    {'id': 'luce-fissa', 'type': 'electricity', 'name': 'duplicato'},
+]
+
+OFFERS = [
+    {'id': 'estate', 'valid_until': '2024-08-31'},
+    {'id': 'sempre', 'valid_until': 'ongoing'},
+    {'id': 'primavera', 'valid_until': '2024-05-31'},
+    {'id': 'senza-data'},
+    {'id': 'data-errata', 'valid_until': '31/12/2024'},
+    {'id': 'inverno', 'valid_until': '2025-02-28'},
+]
+
+
+def linear_active(offers, today):
+    """Filtro lineare di riferimento, come prima dell'indice"""
+    active = []
+    for offer in offers:
+        valid_until = offer.get('valid_until', 'ongoing')
+        try:
+            if valid_until == 'ongoing' or datetime.date.fromisoformat(valid_until) >= today:
+                active.append(offer)
+        except (TypeError, ValueError):
+            active.append(offer)
+    return active
+
+
+def test_product_lookups():
+    catalog = CatalogIndex(PRODUCTS, OFFERS)
+    assert catalog.get_product('luce-fissa') is PRODUCTS[0]
+    assert catalog.get_product('sconosciuto') is None
+    assert catalog.get_products_by_type('electricity') == [PRODUCTS[0], PRODUCTS[2], PRODUCTS[3]]
+    assert catalog.get_products_by_type('acqua') == []
+
+
+def test_active_offers_match_linear_filter():
+    catalog = CatalogIndex(PRODUCTS, OFFERS)
+    for day in ('2024-01-01', '2024-05-31', '2024-06-01', '2024-08-31', '2024-09-01', '2025-03-01'):
+        today = datetime.date.fromisoformat(day)
+        assert catalog.active_offers(today) == linear_active(OFFERS, today)
+
+    ids = [offer['id'] for offer in catalog.active_offers(datetime.date(2024, 6, 1))]
+    assert ids == ['estate', 'sempre', 'senza-data', 'data-errata', 'inverno']
+
+
+def test_active_offers_for_today_are_cached():
+    catalog = CatalogIndex(PRODUCTS, OFFERS)
+    first = catalog.active_offers()
+    assert catalog.active_offers() is first
+    assert catalog.active_offers(datetime.date.today()) is first
+    assert first == linear_active(OFFERS, datetime.date.today())
@@ -0,0 +1,48 @@
+from app.services.chunker import chunk_sections, split_unit
+
+
+def faq_sections(count=12):
+    return [f"D: Domanda numero {i} sulla tariffa?\nR: Risposta numero {i}, con qualche dettaglio in più." for i in range(count)]
+
+
+def test_short_document_is_one_chunk():
+    assert chunk_sections(['Prima sezione', 'Seconda sezione'], title='Prodotto') == ['Prodotto\nPrima sezione\nSeconda sezione']
+    assert chunk_sections([]) == []
+
+
+def test_chunks_respect_size_and_keep_title():
+    sections = faq_sections()
+    chunks = chunk_sections(sections, title='FAQ Tariffa Luce', size=200, overlap=0)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 200
+        assert chunk.startswith('FAQ Tariffa Luce\n')
+    # Senza sovrapposizione ogni sezione compare esattamente una volta, intera e nell'ordine
+    body = '\n'.join(chunk.split('\n', 1)[1] for chunk in chunks)
+    assert body == '\n'.join(sections)
+
+
+def test_overlap_repeats_whole_trailing_sections():
+    sections = [f"Caratteristica {i}: " + 'x' * 30 for i in range(20)]
+    chunks = chunk_sections(sections, size=200, overlap=100)
+    for previous, current in zip(chunks, chunks[1:]):
+        previous_lines, current_lines = previous.split('\n'), current.split('\n')
+        carried = [line for line in current_lines if line in previous_lines]
+        assert carried and carried == previous_lines[-len(carried):]
+        assert sum(len(line) + 1 for line in carried) <= 100
+        assert len(current) <= 200
+
+
+def test_split_unit_prefers_lines_then_sentences():
+    text = "Prima riga.\nSeconda riga con una frase. E un'altra frase."
+    assert split_unit(text, 30) == ['Prima riga.', 'Seconda riga con una frase.', "E un'altra frase."]
+    assert split_unit('a' * 25, 10) == ['a' * 10, 'a' * 10, 'a' * 5]
+    assert split_unit('   ', 10) == []
+
+
+def test_long_section_is_split_within_budget():
+    section = ' '.join(f"parola{i}" for i in range(200))
+    chunks = chunk_sections([section], title='Offerta', size=120, overlap=20)
+    assert all(len(chunk) <= 120 for chunk in chunks)
+    words = set(' '.join(chunk.split('\n', 1)[1] for chunk in chunks).split())
+    assert words == set(section.split())
@@ -0,0 +1,65 @@
+import subprocess
+
+import pytest
+
+from app.services import document_processor
+from app.services.document_processor import _extract_text_layer, _has_usable_text, _page_windows, iter_pdf_pages
+
+NATIVE_PAGE = "Factura de electricidad\nTotal importe factura 73,39 €\nConsumo total 250 kWh\n"
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    """PDF di tre pagine: la prima con livello di testo, la seconda senza, la terza con testo corrotto"""
+    ocr_calls = []
+
+    def ocr_page(pdf_path, page_number, dpi=None, lang=None):
+        ocr_calls.append(page_number)
+        return f"testo OCR pagina {page_number}"
+
+    monkeypatch.setattr(document_processor, 'pdfinfo_from_path', lambda path: {'Pages': 3})
+    monkeypatch.setattr(document_processor, '_extract_text_layer', lambda path: [NATIVE_PAGE, '', '\x01\x02' * 40, ''])
+    monkeypatch.setattr(document_processor, '_ocr_pdf_page', ocr_page)
+    monkeypatch.setattr(document_processor, 'OCR_PREPROCESS', True)
+    return ocr_calls
+
+
+def test_native_pages_skip_ocr(fake_pdf):
+    pages = list(iter_pdf_pages('bolletta.pdf', max_workers=1, timeout=60, use_text_layer=True))
+    assert [page['source'] for page in pages] == ['text_layer', 'ocr', 'ocr']
+    assert pages[0]['text'] == NATIVE_PAGE
+    assert pages[1]['text'] == 'testo OCR pagina 2'
+    assert fake_pdf == [2, 3]
+
+
+def test_text_layer_disabled_uses_ocr_everywhere(fake_pdf):
+    pages = list(iter_pdf_pages('bolletta.pdf', max_workers=1, timeout=60, use_text_layer=False))
+    assert [page['source'] for page in pages] == ['ocr', 'ocr', 'ocr']
+    assert fake_pdf == [1, 2, 3]
+
+
+def test_process_pdf_reports_sources(fake_pdf):
+    report = {}
+    text = document_processor.process_pdf('bolletta.pdf', max_workers=1, timeout=60, report=report)
+    assert '--- PAGINA 1 ---\n' + NATIVE_PAGE in text
+    assert report['sources'] == {1: 'text_layer', 2: 'ocr', 3: 'ocr'}
+    assert report['complete']
+
+
+def test_has_usable_text():
+    assert _has_usable_text(NATIVE_PAGE)
+    assert not _has_usable_text('Pagina 1')
+    assert not _has_usable_text('\x01\x02' * 40)
+
+
+def test_page_windows_groups_consecutive_pages():
+    assert _page_windows([2, 3, 4, 6, 7], 2) == [[2, 3], [4], [6, 7]]
+    assert _page_windows([1, 2, 3], 1) == [[1], [2], [3]]
+
+
+def test_missing_pdftotext_falls_back_to_ocr(monkeypatch):
+    def missing(*args, **kwargs):
+        raise FileNotFoundError('pdftotext')
+
+    monkeypatch.setattr(subprocess, 'run', missing)
+    assert _extract_text_layer('bolletta.pdf') is None
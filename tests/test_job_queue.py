@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from app.services.job_queue import (
+    STATUS_ANALYZING, STATUS_COMPLETED, STATUS_FAILED, STATUS_OCR, STATUS_QUEUED, BillJobQueue
+)
+
+BILL_TEXT = "Factura de electricidad. Total importe factura 73,39 €. Consumo total 250 kWh."
+
+
+def fake_ocr(text=BILL_TEXT, pages=2, lang='spa'):
+    """Funzione OCR che riporta le pagine al callback e la lingua nel report"""
+    def ocr(file_path, on_page=None, report=None):
+        for page in range(1, pages + 1):
+            if on_page:
+                on_page({'page': page, 'text': text, 'source': 'text_layer', 'lang': lang})
+        if report is not None:
+            report['lang'] = lang
+        return text
+    return ocr
+
+
+def fake_analysis(result=None, tokens=('{"sum', 'mary": "ok"}'), error=None):
+    def analyze(text, callback_handler=None):
+        if callback_handler:
+            for token in tokens:
+                callback_handler(data=token)
+        if error:
+            raise error
+        return result or {'summary': 'ok'}
+    return analyze
+
+
+def collect(queue):
+    """Accoda un job con un listener e ne attende la fine, restituendo stato ed eventi"""
+    events, done = [], threading.Event()
+
+    def listener(event, data):
+        events.append((event, data))
+        if event in ('result', 'error'):
+            done.set()
+
+    job_id = queue.submit('bolletta.pdf', 'bolletta.pdf', listener=listener)
+    assert done.wait(5)
+    return queue.wait(job_id, timeout=5), events
+
+
+def test_job_states_and_events():
+    queue = BillJobQueue(fake_ocr(), fake_analysis(), ocr_workers=1, analysis_workers=1)
+    job, events = collect(queue)
+
+    assert job['status'] == STATUS_COMPLETED
+    assert job['result'] == {'analysis': {'summary': 'ok'}}
+    assert job['lang'] == 'spa'
+    assert [data['status'] for event, data in events if event == 'status'] == [STATUS_OCR, STATUS_ANALYZING, STATUS_COMPLETED]
+    assert [data['page'] for event, data in events if event == 'page'] == [1, 2]
+    assert [data['text'] for event, data in events if event == 'token'] == ['{"sum', 'mary": "ok"}']
+    text_event = next(data for event, data in events if event == 'text')
+    assert text_event['extracted_text'] == BILL_TEXT and text_event['lang'] == 'spa'
+    assert events[-1] == ('result', {'analysis': {'summary': 'ok'}})
+    # Un job terminato non ha più listener
+    assert not queue._listeners
+
+
+@pytest.mark.parametrize('ocr, analysis, message', [
+    (fake_ocr(text='poco testo'), fake_analysis(), 'Impossibile estrarre testo sufficiente'),
+    (fake_ocr(), fake_analysis(error=RuntimeError('modello non disponibile')), 'modello non disponibile'),
+    (fake_ocr(), fake_analysis(result={'error': 'JSON non valido'}), 'JSON non valido'),
+])
+def test_failed_jobs(ocr, analysis, message):
+    queue = BillJobQueue(ocr, analysis, ocr_workers=1, analysis_workers=1)
+    job, events = collect(queue)
+
+    assert job['status'] == STATUS_FAILED
+    assert message in job['error']
+    assert events[-1][0] == 'error' and message in events[-1][1]['error']
+    assert not queue._listeners
+
+
+def test_wait_returns_on_new_version():
+    release = threading.Event()
+
+    def blocked_ocr(file_path, report=None):
+        release.wait(5)
+        return BILL_TEXT
+
+    queue = BillJobQueue(blocked_ocr, fake_analysis(), ocr_workers=1, analysis_workers=1)
+    job_id = queue.submit('bolletta.pdf', 'bolletta.pdf')
+    job = queue.wait(job_id, version=-1, timeout=5)
+    assert job['status'] in (STATUS_QUEUED, STATUS_OCR)
+    while job['status'] != STATUS_OCR:
+        job = queue.wait(job_id, version=job['version'], timeout=5)
+
+    # Nessun cambio di versione entro il timeout: viene restituito lo stato corrente
+    assert queue.wait(job_id, version=job['version'], timeout=0.05) == job
+
+    release.set()
+    while job['status'] != STATUS_COMPLETED:
+        job = queue.wait(job_id, version=job['version'], timeout=5)
+    assert job['result'] == {'analysis': {'summary': 'ok'}}
+    assert queue.wait('sconosciuto') is None
+
+
+def test_removed_listener_stops_events_but_not_the_job():
+    release = threading.Event()
+    events = []
+
+    def blocked_ocr(file_path, on_page=None, report=None):
+        release.wait(5)
+        return BILL_TEXT
+
+    queue = BillJobQueue(blocked_ocr, fake_analysis(), ocr_workers=1, analysis_workers=1)
+    job_id = queue.submit('bolletta.pdf', 'bolletta.pdf', listener=lambda event, data: events.append(event))
+    queue.remove_listener(job_id)
+    release.set()
+
+    job = queue.wait(job_id, timeout=5)
+    while job['status'] not in (STATUS_COMPLETED, STATUS_FAILED):
+        job = queue.wait(job_id, version=job['version'], timeout=5)
+    assert job['status'] == STATUS_COMPLETED
+    assert 'result' not in events and 'token' not in events
@@ -0,0 +1,70 @@
+from app.services.lexical_index import BM25Index, reciprocal_rank_fusion, stem, tokenize
+
+DOCUMENTS = {
+    'faq:1': "Come posso leggere la mia bolletta della luce? La bolletta riporta consumi e costi.",
+    'faq:2': "¿Cómo puedo cambiar la potencia contratada de mi factura?",
+    'product:1': "Tariffa luce a prezzo fisso per la casa, energia verde certificata.",
+    'product:2': "Pannelli solari con accumulo per ridurre la bolletta.",
+    'offer:1': "Sconto del 10% sulla tariffa gas per i nuovi clienti.",
+}
+
+
+def build():
+    index = BM25Index()
+    index.add_many(DOCUMENTS.items())
+    return index
+
+
+def test_tokenize_folds_accents_stopwords_and_inflections():
+    assert tokenize("Facturación de las facturas") == ['factur', 'factur']
+    assert tokenize("le bollette") == tokenize("bolletta") == ['bollett']
+    assert tokenize("il la de las") == []
+    assert stem('luce') == 'luce'
+
+
+def test_search_ranks_matching_documents():
+    index = build()
+    results = index.search("bollette luce", top_k=3)
+    keys = [key for key, _ in results]
+    assert keys[0] == 'faq:1'
+    assert set(keys) <= {'faq:1', 'product:1', 'product:2'}
+    assert all(score > 0 for _, score in results)
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+    assert index.search("factura potencia")[0][0] == 'faq:2'
+    assert index.search("parole assenti") == []
+
+
+def test_incremental_add_and_remove():
+    index = build()
+    index.remove(['faq:1', 'missing'])
+    assert len(index) == 4
+    assert 'faq:1' not in dict(index.search("bolletta"))
+
+    index.add('product:2', "Caldaia a condensazione")
+    assert index.search("pannelli solari") == []
+    assert index.search("caldaia")[0][0] == 'product:2'
+
+    # Dopo le modifiche i punteggi coincidono con quelli di un indice ricostruito da zero
+    rebuilt = BM25Index()
+    rebuilt.add_many((key, text) for key, text in DOCUMENTS.items() if key not in ('faq:1', 'product:2'))
+    rebuilt.add('product:2', "Caldaia a condensazione")
+    assert index.search("tariffa luce gas") == rebuilt.search("tariffa luce gas")
+
+
+def test_copy_is_independent():
+    index = build()
+    snapshot = index.copy()
+    index.remove(['offer:1'])
+    assert snapshot.search("sconto")[0][0] == 'offer:1'
+    assert index.search("sconto") == []
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd']], k=60)
+    assert [key for key, _ in fused] == ['b', 'a', 'd', 'c']
+    scores = dict(fused)
+    assert scores['b'] == 1 / 62 + 1 / 61
+    assert scores['a'] == 1 / 61
+    assert reciprocal_rank_fusion([[], []]) == []
+    # Senza embedding resta solo la classifica BM25, che la fusione non altera
+    assert [key for key, _ in reciprocal_rank_fusion([[], ['x', 'y']])] == ['x', 'y']
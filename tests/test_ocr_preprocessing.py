@@ -0,0 +1,38 @@
+import numpy as np
+from PIL import Image
+
+from app.services.ocr_preprocessing import choose_dpi, estimate_line_height, otsu_threshold, preprocess_image
+
+
+def bilevel_page(width=800, height=600, line_height=12, gap=14):
+    """Pagina 1 bit con righe di 'testo' nere su sfondo bianco, come una scansione bianco/nero"""
+    pixels = np.full((height, width), 255, dtype=np.uint8)
+    y = 40
+    while y + line_height < height - 40:
+        for x in range(60, width - 60, 18):
+            pixels[y:y + line_height, x:x + 10] = 0
+        y += line_height + gap
+    return Image.fromarray(pixels).convert('1')
+
+
+def test_otsu_threshold_keeps_ink_on_bilevel_page():
+    pixels = np.asarray(bilevel_page().convert('L'))
+    threshold = otsu_threshold(pixels)
+    assert (pixels <= threshold).sum() == (pixels == 0).sum()
+    assert estimate_line_height(pixels <= threshold) == 12
+
+
+def test_preprocess_image_keeps_text_of_bilevel_page():
+    page = bilevel_page()
+    ink_before = int((np.asarray(page.convert('L')) == 0).sum())
+
+    result = np.asarray(preprocess_image(page, rescale=False))
+    assert int((result == 0).sum()) == ink_before
+
+    rescaled = np.asarray(preprocess_image(page))
+    assert (rescaled == 0).sum() > 0
+    assert (rescaled == 255).sum() > 0
+
+
+def test_choose_dpi_on_bilevel_probe():
+    assert choose_dpi(bilevel_page(), probe_dpi=50) is not None
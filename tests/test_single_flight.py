@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.services.cache import ResultCache, TTLLRUCache
+from app.services.single_flight import SingleFlight
+
+
+def run_concurrently(fn, callers):
+    """Esegue fn da più thread insieme e ne raccoglie i risultati (o le eccezioni)"""
+    barrier = threading.Barrier(callers)
+
+    def call(_):
+        barrier.wait()
+        try:
+            return fn()
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        return list(pool.map(call, range(callers)))
+
+
+def slow(result, release, calls):
+    """Funzione che resta in corso finché release non viene impostato"""
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return fn
+
+
+def release_when_waiting(flight, waiting, release):
+    """Sblocca la chiamata in corso quando tutti gli altri chiamanti la stanno attendendo"""
+    def watch():
+        while flight.stats()['coalesced'] < waiting:
+            threading.Event().wait(0.005)
+        release.set()
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def test_concurrent_calls_share_one_execution():
+    flight, release, calls = SingleFlight('test'), threading.Event(), []
+    release_when_waiting(flight, 7, release)
+
+    results = run_concurrently(lambda: flight.do('key', slow({'value': 1}, release, calls)), 8)
+
+    assert len(calls) == 1
+    assert all(result == {'value': 1} for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert flight.stats() == {'executions': 1, 'coalesced': 7, 'in_flight': 0}
+
+    # Terminata la chiamata la chiave è libera: la successiva riparte da capo
+    release.set()
+    flight.do('key', slow({'value': 2}, release, calls))
+    assert len(calls) == 2
+
+
+def test_waiters_receive_the_same_exception():
+    flight, release, calls = SingleFlight('test'), threading.Event(), []
+    release_when_waiting(flight, 3, release)
+
+    results = run_concurrently(lambda: flight.do('key', slow(ValueError('boom'), release, calls)), 4)
+
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight('test')
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+    assert flight.stats()['executions'] == 2
+
+
+def test_result_cache_coalesces_and_then_hits():
+    cache = ResultCache(TTLLRUCache(10, 60))
+    release, calls, sources = threading.Event(), [], []
+    release_when_waiting(cache._flight, 5, release)
+
+    results = run_concurrently(
+        lambda: cache.get_or_compute(('analyze_bill', 'testo'), slow({'summary': 'ok'}, release, calls), sources.append), 6
+    )
+
+    assert len(calls) == 1
+    assert all(result == {'summary': 'ok'} for result in results)
+    assert sources == ['shared'] * 5
+    # Chi ha atteso riceve una copia indipendente
+    results[0]['summary'] = 'modificato'
+    assert sum(result['summary'] == 'ok' for result in results) == 5
+
+    assert cache.get_or_compute(('analyze_bill', 'testo'), slow({}, release, calls), sources.append) == {'summary': 'ok'}
+    assert len(calls) == 1 and sources[-1] == 'cache'
+    assert cache.stats()['coalesced'] == 5
+
+
+@pytest.mark.parametrize('result', [{'error': 'modello non disponibile'}, {'summary': 'parziale', 'degraded': True}])
+def test_result_cache_does_not_store_errors_or_partial_results(result):
+    cache = ResultCache(TTLLRUCache(10, 60))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return result
+
+    assert cache.get_or_compute(('analyze_bill', 'testo'), compute) == result
+    assert cache.get_or_compute(('analyze_bill', 'testo'), compute) == result
+    assert len(calls) == 2
@@ -0,0 +1,129 @@
+import numpy as np
+
+from app.services.vector_index import ExactIndex, IVFIndex, create_vector_index, normalize_rows, top_k_indices
+
+
+def random_vectors(n, dim=32, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def clustered_vectors(n, dim=32, clusters=40, seed=0):
+    """Vettori raggruppati attorno a centri casuali, come gli embedding di documenti simili"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return (centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))).astype(np.float32)
+
+
+def recall(index, exact, queries, top_k=10):
+    found = 0
+    for hits, expected in zip(index.search(queries, top_k), exact.search(queries, top_k)):
+        found += len({key for key, _ in hits} & {key for key, _ in expected})
+    return found / (len(queries) * top_k)
+
+
+def build(index, vectors):
+    index.add([f"doc{i}" for i in range(len(vectors))], vectors)
+    return index
+
+
+def brute_force(vectors, query, top_k):
+    """Similarità del coseno documento per documento, con ordinamento completo"""
+    scores = [float(np.dot(v, query) / (np.linalg.norm(v) * np.linalg.norm(query))) for v in vectors]
+    return sorted(range(len(vectors)), key=lambda i: -scores[i])[:top_k], scores
+
+
+def test_normalize_rows_keeps_zero_rows():
+    matrix = np.array([[3, 4], [0, 0]], dtype=np.float64)
+    result = normalize_rows(matrix)
+    assert result.dtype == np.float32 and result.flags['C_CONTIGUOUS']
+    assert np.allclose(result, [[0.6, 0.8], [0, 0]])
+    assert matrix[0, 0] == 3
+
+
+def test_top_k_indices_matches_full_sort():
+    scores = np.random.default_rng(1).normal(size=500)
+    assert list(top_k_indices(scores, 10)) == list(np.argsort(-scores)[:10])
+    assert len(top_k_indices(scores, 1000)) == 500
+    assert len(top_k_indices(scores, 0)) == 0
+
+
+def test_exact_search_matches_brute_force():
+    vectors = random_vectors(300)
+    index = ExactIndex()
+    index.add([f"doc{i}" for i in range(len(vectors))], vectors)
+    queries = random_vectors(5, seed=1)
+
+    for query, hits in zip(queries, index.search(queries, 5)):
+        expected, scores = brute_force(vectors, query, 5)
+        assert [key for key, _ in hits] == [f"doc{i}" for i in expected]
+        assert np.allclose([similarity for _, similarity in hits], [scores[i] for i in expected], atol=1e-5)
+        assert all(isinstance(similarity, float) for _, similarity in hits)
+
+
+def test_exact_search_after_update_and_remove():
+    vectors = random_vectors(50)
+    keys = [f"doc{i}" for i in range(len(vectors))]
+    index = ExactIndex()
+    index.add(keys, vectors)
+    index.add(['doc3'], -vectors[7:8])
+    index.remove(['doc7', 'missing'])
+
+    assert len(index) == 49 and 'doc7' not in index
+    assert index.search(-vectors[7:8], 1)[0][0][0] == 'doc3'
+    assert index.search(np.zeros((1, 32)), 3)[0][0][1] == 0.0
+    assert ExactIndex().search(vectors[:2], 3) == [[], []]
+
+
+def test_ivf_recall_against_exact_search():
+    vectors = clustered_vectors(4000)
+    queries = clustered_vectors(50, seed=1)
+    exact = build(ExactIndex(), vectors)
+    ivf = build(IVFIndex(n_probe=8), vectors)
+
+    assert len(ivf.centroids) == int(np.sqrt(len(vectors)))
+    assert recall(ivf, exact, queries) >= 0.9
+    ivf.n_probe = len(ivf.centroids)
+    assert recall(ivf, exact, queries) == 1.0
+
+
+def test_ivf_search_does_not_modify_index():
+    ivf = build(IVFIndex(n_lists=16), clustered_vectors(500))
+    ivf.add(['new'], clustered_vectors(1, seed=2))
+    ivf.remove(['doc0'])
+    vectors, keys = ivf.vectors.copy(), list(ivf.keys)
+
+    hits = ivf.search(clustered_vectors(1, seed=2), 1)[0]
+    assert hits[0][0] == 'new'
+    assert np.array_equal(ivf.vectors, vectors) and ivf.keys == keys
+    assert 'doc0' not in ivf and len(ivf) == 500
+
+
+def test_ivf_retrains_when_index_doubles():
+    ivf = build(IVFIndex(), clustered_vectors(100))
+    assert ivf._trained_size == 100
+    ivf.add([f"extra{i}" for i in range(150)], clustered_vectors(150, seed=3))
+    assert ivf._trained_size == 250
+    assert len(ivf.centroids) == int(np.sqrt(250))
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vectors = clustered_vectors(600)
+    queries = clustered_vectors(10, seed=1)
+    path = str(tmp_path / 'index.npz')
+    for index in (build(ExactIndex(), vectors), build(IVFIndex(n_lists=20, n_probe=4), vectors)):
+        index.save(path, tag='v1')
+        loaded = type(index).load(path, tag='v1')
+        assert loaded.keys == index.keys
+        assert np.array_equal(loaded.vectors, index.vectors)
+        assert loaded.search(queries, 5) == index.search(queries, 5)
+        assert type(index).load(path, tag='v2') is None
+
+    assert IVFIndex.load(path).n_probe == 4
+    assert ExactIndex.load(path) is None
+    assert ExactIndex.load(str(tmp_path / 'missing.npz')) is None
+
+
+def test_create_vector_index_backends():
+    assert isinstance(create_vector_index(10, 'auto'), ExactIndex)
+    assert isinstance(create_vector_index(10 ** 6, 'auto'), IVFIndex)
+    assert isinstance(create_vector_index(backend='unknown'), ExactIndex)